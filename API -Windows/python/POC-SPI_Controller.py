@@ -21,6 +21,16 @@ from array import array
 
 from promira_py import *
 from promact_is_py import *
+from ps_collect import collect_all, collect_errors, collect_print_errors
+from ps_session import SessionManager, PromiraError
+from ps_discovery import DiscoveryCache, DISCOVERY_SNAPSHOT
+from ps_profile import ProfileApplier, profile_from_dict
+from ps_stream import stream_transfer
+from ps_hexdump import *
+from ps_words import queue_spi_write_words, unpack_words
+from ps_calibrate import CalibrationTable, calibrate
+from ps_orchestrate import Orchestrator
+from ps_ber import ber_echo
 
 
 #==========================================================================
@@ -54,6 +64,10 @@ SPI_Word_Delay = 0                  # Spacing in time between bytes (Delay fo in
 SPI_BUFFER_SIZE = 2048              # Size of the SPI Buffer (For File Transfers)
 SPI_Word_Size = 32                  #
 SPI_Write_Number_of_Words = 1       #
+SPI_MISO_Latency = 128              # Clocks between MOSI and the matching MISO
+
+DUMP_MODE = DUMP_FULL               # DUMP_FULL, DUMP_SUMMARY or DUMP_QUIET
+DUMP_LIMIT = None                   # Bytes shown per transaction (None = all)
 
 SPI_TARGET_POWER_LEVEL = PS_PHY_TARGET_POWER_TARGET1_3V     # Setting to provide =>3.3V or 5V to pin 4 ( TARGET POWER )
 
@@ -63,59 +77,73 @@ SPI_DUAL_DATA_RATE = PS_SPI_IO_STANDARD   # SPI Data Rate Selection
 SPI_MODE = PS_SPI_MODE_0            # SPI MODE Selection
 SPI_BIT_ORDER = PS_SPI_BITORDER_MSB #
 
+# Controller profiles, same format as a ps_profile JSON/TOML file
+SPI_PROFILE = profile_from_dict({
+    "defaults" : {
+        "app_config"   : PS_APP_CONFIG_SPI,
+        "target_power" : SPI_TARGET_POWER_LEVEL,
+        "level_shift"  : SPI_LS_Voltage,
+        "word_delay"   : SPI_Word_Delay,
+        "mode"         : SPI_MODE,
+        "bit_order"    : SPI_BIT_ORDER,
+        "ss_polarity"  : SPI_SS_MASK_Active,
+        "ss_enable"    : SPI_SS_MASK,
+        "bitrate_khz"  : SPI_Frequency,
+        "miso_latency" : SPI_MISO_Latency,
+    },
+    "controllers" : {
+        "north" : { "unique_id" : 2416713000 },
+        "south" : { "unique_id" : 2416711301, "bitrate_khz" : 8000 },
+    },
+})
+
 
 
 #==========================================================================
 # FUNCTIONS From the API
 #==========================================================================
 APP_NAME = "com.totalphase.promact_is"
+
+# unique_ids of the controllers
+SPI_CONTROLLER_IDS = dict((name, settings["unique_id"])
+                          for name, settings in SPI_PROFILE.items())
+
+# Discovery results, kept on disk between runs
+DISCOVERY = DiscoveryCache(snapshot = DISCOVERY_SNAPSHOT)
+
+# Open sessions, reused per IP and reconnected on PS_APP_CONNECTION_LOST
+SESSIONS = SessionManager(DISCOVERY.resolve)
+
+# Last settings applied to each session
+PROFILES = ProfileApplier()
+
+# Measured MISO latency per controller and bitrate (see SPI_Calibrate)
+CALIBRATION = CalibrationTable()
+
+# Opens, configures and drives North and South in parallel
+ORCHESTRATOR = Orchestrator(SPI_PROFILE, SESSIONS, PROFILES)
+
 def dev_open (ip):
-    pm = pm_open(ip)
-    if pm <= 0:
-         print("Unable to open Promira platform on %s" % ip)
-         print("Error code = %d" % pm)
-         sys.exit()
-
-    ret = pm_load(pm, APP_NAME)
-    if ret < 0:
-         print("Unable to load the application(%s)" % APP_NAME)
-         print("Error code = %d" % ret)
-         sys.exit()
-
-    conn = ps_app_connect(ip)
-    if conn <= 0:
-         print("Unable to open the application on %s" % ip)
-         print("Error code = %d" % conn)
-         sys.exit()
-
-    channel = ps_channel_open(conn)
-    if channel <= 0:
-         print("Unable to open the channel")
-         print("Error code = %d" % channel)
-         sys.exit()
-
-    return pm, conn, channel
+    try:
+        session = SESSIONS.get(ip)
+    except PromiraError as e:
+        print(e)
+        sys.exit()
+
+    print("%s startup: %s" % (ip, session.startup_report()))
+    return session.pm, session.conn, session.channel
 
 def dev_close (pm, app, channel):
-    ps_channel_close(channel)
-    ps_app_disconnect(app)
-    pm_close(pm)
+    # Closes only the controller that owns channel; the other side of
+    # a North/South flow stays open
+    session = SESSIONS.for_channel(channel)
+    if session is not None:
+        PROFILES.forget(session)
+    SESSIONS.close_channel(channel)
 
 def dev_collect (collect):
-    if collect < 0:
-        print(ps_app_status_string(collect))
-        return
-
-    response = array('B', [ ])
-    while True:
-        t, length, result = ps_collect_resp(collect, -1)
-        if t == PS_APP_NO_MORE_CMDS_TO_COLLECT:
-            break
-        elif t < 0:
-            print(ps_app_status_string(t))
-        if t == PS_SPI_CMD_READ:
-            ret, word_size, buf = ps_collect_spi_read(collect, result)
-            response += buf
+    response, table = collect_all(collect)
+    collect_print_errors(table)
     return response
 
 def spi_master_oe (channel, queue, enable):
@@ -142,8 +170,8 @@ def blast_bytes (channel, queue, data_io, filename):
         # Clear the queue
         ps_queue_clear(queue)
 
-        # Write the data to the bus
-        data_out = array('B', filedata)
+        # Write the data to the bus (bytes are queued without a copy)
+        data_out = filedata
         ps_queue_spi_ss(queue, SPI_SS_MASK)
         ps_queue_spi_write(queue, data_io, 8, len(data_out), data_out)
         ps_queue_spi_ss(queue, 0)
@@ -156,28 +184,9 @@ def blast_bytes (channel, queue, data_io, filename):
             print("error: only a partial number of bytes written")
             print("  (%d) instead of full (%d)" % (count, len(data_out)))
 
-        sys.stdout.write("*** Transaction #%02d\n" % trans_num)
-        # sys.stdout.write("Data written to device:")
-        # for i in range(count):
-        #     if ((i & 0x0f) == 0):
-        #         sys.stdout.write("\n%04x:  " % i)
-
-        #     sys.stdout.write("%02x " % (data_out[i] & 0xff))
-        #     if (((i + 1) & 0x07) == 0):
-        #         sys.stdout.write(" ")
-
-        # sys.stdout.write("\n\n")
-
-        sys.stdout.write("Data read from device:")
-        for i in range(count):
-            if ((i & 0x0f) == 0):
-                sys.stdout.write("\n%04x:  " % i)
-
-            sys.stdout.write("%02x " % (data_in[i] & 0xff))
-            if (((i + 1) & 0x07) == 0):
-                sys.stdout.write(" ")
-
-        sys.stdout.write("\n\n")
+        # write_dump("Data written to device:", data_out)
+        write_dump("*** Transaction #%02d\nData read from device:" % trans_num,
+                   data_in, limit = DUMP_LIMIT, mode = DUMP_MODE)
 
         trans_num = trans_num + 1
 
@@ -198,36 +207,27 @@ def Detect_SPI_Controller( verbose = 0 ):
 
     if(verbose) : print("Detecting the Promira platforms...")
 
-    # Find all the attached devices
-    (num, ips, unique_ids, statuses) = pm_find_devices_ext(16, 16, 16)
+    # Find all the attached devices (cached for DISCOVERY_TTL seconds)
+    devices = DISCOVERY.devices()
 
-    if num > 0:
-        if(verbose) : print("%d device(s) found:" % num)
+    if devices:
+        if(verbose) : print("%d device(s) found:" % len(devices))
 
         # Print the information on each device
-        for i in range(num):
-            ip        = ips[i]
-            unique_id = unique_ids[i]
-            status    = statuses[i]
-
+        for dev in devices:
             # Determine if the device is in-use
-            if status & PM_DEVICE_NOT_FREE:
-                inuse = "(in-use)"
-            else:
+            if dev.is_free():
                 inuse = "(avail)"
+            else:
+                inuse = "(in-use)"
 
             # Display device ip address, in-use status, and serial number
-            ipstr = "%u.%u.%u.%u" \
-                % (ip & 0xff, ip >> 8 & 0xff, ip >> 16 & 0xff, ip >> 24 & 0xff)
-            if(verbose) : print("    ip = %s   %s  (%04d-%06d)"
-                % (ipstr, inuse, unique_id // 1000000, unique_id % 1000000))
-
-            if not status & PM_DEVICE_NOT_FREE:
-                pm   = pm_open(ipstr)
-                data = pm_apps(pm, 1024)[1]
-                apps = ''.join([ chr(c) for c in data ])
-                if(verbose) : print("    - apps = %s" % apps)
-                pm_close(pm)
+            if(verbose) : print("    ip = %s   %s  (%s)"
+                % (dev.ip_str, inuse, dev.serial()))
+
+            # Apps are only listed when they are going to be printed
+            if verbose and dev.is_free():
+                print("    - apps = %s" % DISCOVERY.apps(dev.unique_id))
 
     else:
         print("No devices found.")
@@ -235,13 +235,11 @@ def Detect_SPI_Controller( verbose = 0 ):
 
     # Selection of the SPI Controller by IP Address
 
-    if len(ips) == 1:
+    if len(devices) == 1:
 
-        ip = ips[0]
-        ipstr = "%u.%u.%u.%u" % (ip & 0xff, ip >> 8 & 0xff, ip >> 16 & 0xff, ip >> 24 & 0xff)
+        ip = devices[0].ip
 
-        print(f"Selected SPI Controller ip is: {ipstr}")
-        # print("Selected SPI Controller ip is: %s" %(ipstr))
+        print(f"Selected SPI Controller ip is: {devices[0].ip_str}")
     else:
         ip=0
         print("More than one TotalPhase Promira SPI Controllers detected ")
@@ -256,63 +254,26 @@ def Select_SPI_Controller_Handler( Requested_Handler , verbose = 0 ):
 
     if(verbose) : print(f"Selecting which SPI Controller to use: {Requested_Handler}")
 
+    name = Requested_Handler.capitalize()
+    unique_id = SPI_CONTROLLER_IDS.get(Requested_Handler.lower())
 
-    # ----> unique_ids[i]
-    # 2416713000 = NORTH SPI CONTROLLER
-    # 2416711301 = SOUTH SPI CONTROLLER
+    # Cached IP, checked against the unique ID, or a fresh discovery
+    ipstr = unique_id and DISCOVERY.resolve(unique_id)
+    if not ipstr:
+        print("No SPI Controllers found.")
+        return 0, 0, 0, 0
 
-    # Find all the attached devices
-    (num, ips, unique_ids, statuses) = pm_find_devices_ext(16, 16, 16)
-    pm_out =0
-    conn_out = 0
-    channel_out = 0
-    ip_out = 0
+    if(verbose) :
+        print(f" {name} SPI Controller Found")
+        print(" %s ip = %s , %s ID = (%d)" % (name, ipstr, name, unique_id))
 
-    if num > 0:
-        if(verbose) : print("%d device(s) found:" % num)
-        # Print the information on each device
-        for i in range(num):
-            ip        = ips[i]
-            unique_id = unique_ids[i]
-            ipstr = "%u.%u.%u.%u" % (ip & 0xff, ip >> 8 & 0xff, ip >> 16 & 0xff, ip >> 24 & 0xff)
-
-
-            # Detecting North SPI CONTROLLER
-            if (unique_id == 2416713000):
-                if(verbose) :
-                    print(f" North SPI Controller Found")
-                    print(" North ip = %s , North ID = (%d)" % (ipstr, unique_id))
-                # Open the device North and return the channel (channel)
-                if Requested_Handler.lower() == "north":
-                    pm, conn, channel = dev_open(ipstr)
-                    print("North SPI Controller Initialized.")
-                    ip_out = ipstr
-                    pm_out = pm
-                    conn_out = conn
-                    channel_out = channel
-
-
-            # Detecting South SPI CONTROLLER
-            if (unique_id == 2416711301):
-                if(verbose) :
-                    print(f" South SPI Controller Found")
-                    print(" South ip = %s, South ID = (%d)" % (ipstr, unique_id))
-                # Open the device South and return the handler (channel)
-                if Requested_Handler.lower() == "south":
-                    pm, conn, channel = dev_open(ipstr)
-                    print("South SPI Controller Initialized.")
-                    ip_out = ipstr
-                    pm_out = pm
-                    conn_out = conn
-                    channel_out = channel                                
-    else:
-        print("No SPI Controllers found.")
-        channel = 0
+    # Open the device and return the handler (channel)
+    pm, conn, channel = dev_open(ipstr)
+    print(f"{name} SPI Controller Initialized.")
 
-    
     if(verbose) : print(f"channel = {channel}")
 
-    return pm_out, conn_out, channel_out, ip_out
+    return pm, conn, channel, ipstr
 
 def normalize_hex_array(hex_array):
     """
@@ -368,83 +329,178 @@ def MYnormalize(hex_array):
         result.extend(value.to_bytes(num_bytes, 'big'))
     return array('B', result)
 
-def SPI_Write_Hex_Array(conn, channel, hex_array):
-        
-    filename = "hex_array.bin"
-    #Create File
-    with open('hex_array.bin', 'wb') as f:
-        f.write(bytearray(normalize_hex_array(hex_array)))
+def print_transactions(data_in):
+    # Dump read data in SPI_BUFFER_SIZE blocks, one per transaction
+    data_in = memoryview(data_in)
+    for trans_num, offset in enumerate(range(0, len(data_in), SPI_BUFFER_SIZE)):
+        write_dump("*** Transaction #%02d\nData read from device:" % trans_num,
+                   data_in[offset:offset + SPI_BUFFER_SIZE],
+                   limit = DUMP_LIMIT, mode = DUMP_MODE)
 
+def SPI_Transaction(channel, data_out, data_io = SPI_DUAL_DATA_RATE):
+    """
+    Send data_out from memory on the session that owns channel and
+    print what was read back.  One submit on the session queue; master
+    output stays enabled between calls.
+    """
+    session = SESSIONS.for_channel(channel)
+    if session is None:
+        print("No open session for channel %d" % channel)
+        return None
 
-    # Create a queue for SPI transactions
-    queue = ps_queue_create(conn, PS_MODULE_ID_SPI_ACTIVE)
+    data_in, table = session.transfer(data_out, data_io, SPI_SS_MASK,
+                                      SPI_BUFFER_SIZE)
+    collect_print_errors(table)
 
-    # Enable master output
-    spi_master_oe(channel, queue, 1)
+    if (len(data_in) != len(data_out)):
+        print("error: only a partial number of bytes written")
+        print("  (%d) instead of full (%d)" % (len(data_in), len(data_out)))
 
-    # Perform the operation
-    blast_bytes(channel, queue, SPI_DUAL_DATA_RATE, filename)
+    print_transactions(data_in)
+    return data_in
 
-    # Disable master output
-    spi_master_oe(channel, queue, 0)
+def SPI_Write_Hex_Array(conn, channel, hex_array):
 
-    # Destroy the queue
-    ps_queue_destroy(queue)
+    return SPI_Transaction(channel, MYnormalize(hex_array), SPI_DUAL_DATA_RATE)
 
 def SPI_Read(conn, channel, size):
-    
-    #Create Array of Zeros of size lenght
-    hex_array = [0x0] * size
-
-    data_io  = PS_SPI_IO_STANDARD
-    
-    filename = "hex_array.bin"
-    #Create File
-    with open('hex_array.bin', 'wb') as f:
-        f.write(bytearray(normalize_hex_array(hex_array)))
-
-
-    # Create a queue for SPI transactions
-    queue = ps_queue_create(conn, PS_MODULE_ID_SPI_ACTIVE)
-
-    # Enable master output
-    spi_master_oe(channel, queue, 1)
+    """
+    Read size bytes.  The clocks are generated on the controller, so
+    no zero bytes are sent over the network.
+    """
+    session = SESSIONS.for_channel(channel)
+    if session is None:
+        print("No open session for channel %d" % channel)
+        return None
 
-    # Perform the operation
-    blast_bytes(channel, queue, data_io, filename)
+    data_in, table = session.read(size, PS_SPI_IO_STANDARD, SPI_SS_MASK)
+    collect_print_errors(table)
 
-    # Disable master output
-    spi_master_oe(channel, queue, 0)
+    if (len(data_in) != size):
+        print("error: only a partial number of bytes read")
+        print("  (%d) instead of full (%d)" % (len(data_in), size))
 
-    # Destroy the queue
-    ps_queue_destroy(queue)
+    print_transactions(data_in)
+    return data_in
 
 def SPI_Read_smart_poc(conn, channel, size):
-    
-    #Create Array of Zeros of size lenght
-    hex_array = [0x0] * size
-
-    
-    filename = "hex_array.bin"
-    #Create File
-    with open('hex_array.bin', 'wb') as f:
-        f.write(bytearray(normalize_hex_array(hex_array)))
-
 
-    # Create a queue for SPI transactions
-    queue = ps_queue_create(conn, PS_MODULE_ID_SPI_ACTIVE)
+    return SPI_Read(conn, channel, size)
 
-    # Enable master output
-    spi_master_oe(channel, queue, 1)
+def SPI_Transaction_Frames(conn, channel, frames):
+    """
+    Send frames (each a buffer or list of hex values) back to back,
+    compensating the controller's MISO latency.  Each frame's response
+    is clocked out during the next frame and the burst is padded only
+    once.  Returns one response per frame, aligned to its request.
+    """
+    session = SESSIONS.for_channel(channel)
+    if session is None:
+        print("No open session for channel %d" % channel)
+        return None
+
+    frames = [ MYnormalize(f) if isinstance(f, list) else f for f in frames ]
+    responses, table = session.transfer_frames(frames, SPI_DUAL_DATA_RATE,
+                                               SPI_SS_MASK)
+    collect_print_errors(table)
+    return responses
+
+def SPI_Calibrate(conn, channel, unique_id):
+    """
+    Measure the MISO latency at every supported bitrate with the
+    controller's MOSI looped back through the device, store it in the
+    calibration table and use it for the current bitrate.
+    """
+    session = SESSIONS.for_channel(channel)
+    if session is None:
+        print("No open session for channel %d" % channel)
+        return None
+
+    results = calibrate(session, unique_id, CALIBRATION, io = SPI_DUAL_DATA_RATE,
+                        ss_mask = SPI_SS_MASK)
+    for bitrate, (latency, score) in sorted(results.items()):
+        print("%6d kHz: latency %4d clocks (%d bytes + %d bits), score %.2f"
+              % (bitrate, latency, latency // 8, latency % 8, score))
+
+    bitrate = session.call(ps_spi_bitrate, 0)
+    session.latency = CALIBRATION.latency(unique_id, bitrate, session.latency)
+    return results
+
+def SPI_Handles(key):
+    # (pm, conn, channel, ip) of a controller opened by the orchestrator
+    session = ORCHESTRATOR.sessions.get(key)
+    if session is None:
+        return 0, 0, 0, 0
+    return session.pm, session.conn, session.channel, session.ip
+
+def SPI_Run_Both(north_transactions, south_transactions, align = True):
+    """
+    Run a transaction list on each controller at the same time; each
+    entry is a byte buffer or a callable taking the session.  With
+    align the two lists start together.  Returns { "north" : result,
+    "south" : result } with result.result holding one
+    (data, table) per transaction.
+    """
+    results = ORCHESTRATOR.run({ "north" : north_transactions,
+                                 "south" : south_transactions }, align)
+    print(ORCHESTRATOR.report(results))
+    return results
 
-    # Perform the operation
-    blast_bytes(channel, queue, PS_SPI_IO_STANDARD, filename)
+def SPI_Transaction_Words(conn, channel, words, word_size = SPI_Word_Size):
+    """
+    Full-duplex transfer of words of word_size bits (2 to 32), packed
+    with NumPy.  Returns the words read back as a numpy uint32 array,
+    or None on error.
+    """
+    session = SESSIONS.for_channel(channel)
+    if session is None:
+        print("No open session for channel %d" % channel)
+        return None
+
+    with session.lock:
+        if not session.oe:
+            session.output_enable(1)
+        queue = session.queue
+        ps_queue_clear(queue)
+        ps_queue_spi_ss(queue, SPI_SS_MASK)
+        queue_spi_write_words(queue, SPI_DUAL_DATA_RATE, word_size, words)
+        ps_queue_spi_ss(queue, 0)
+        collect, _ = ps_queue_submit(queue, channel, 0)
+        data, table = collect_all(collect)
 
-    # Disable master output
-    spi_master_oe(channel, queue, 0)
+    if collect_errors(table):
+        collect_print_errors(table)
+        return None
+    return unpack_words(data, word_size, len(words))
 
-    # Destroy the queue
-    ps_queue_destroy(queue)
+def SPI_BER_Test(conn, channel, unique_id, order = 31, seconds = 60,
+                 bitrates = None, levels = None):
+    """
+    Bit error rate test through a device echoing MOSI on MISO: stream
+    a PRBS pattern for `seconds` at each bitrate and level-shift
+    voltage, using the calibrated MISO latency where there is one.
+    Returns { (level, bitrate_khz) : BerStats }.
+    """
+    session = SESSIONS.for_channel(channel)
+    if session is None:
+        print("No open session for channel %d" % channel)
+        return None
+
+    def latency_for(bitrate):
+        return CALIBRATION.latency(unique_id, bitrate, SPI_MISO_Latency)
+
+    results = { }
+    for level in levels or (SPI_LS_Voltage, ):
+        level = session.configure(ps_phy_level_shift, level)
+        found = ber_echo(session, order, seconds, bitrates,
+                         io = SPI_DUAL_DATA_RATE, ss_mask = SPI_SS_MASK,
+                         latency_for = latency_for)
+        for bitrate, stats in sorted(found.items()):
+            print("%.2f V %s" % (level, stats.report()))
+            results[(level, bitrate)] = stats
+    if levels:
+        session.configure(ps_phy_level_shift, SPI_LS_Voltage)
+    return results
 
 
 """" 
@@ -468,18 +524,21 @@ def blast_bytes_array(channel, queue, byte_array):
     """
     Write the given byte array directly over SPI without reading from a file.
     """
+    if not isinstance(byte_array, (bytes, bytearray, array, memoryview)):
+        byte_array = array('B', byte_array)
+    view = memoryview(byte_array)
+
     trans_num = 0
     offset = 0
-    while offset < len(byte_array):
-        # Slice the data into chunks of BUFFER_SIZE
-        chunk = byte_array[offset:offset + SPI_BUFFER_SIZE]
-        offset += len(chunk)
+    while offset < len(view):
+        # Slice the data into chunks of BUFFER_SIZE (no copy)
+        data_out = view[offset:offset + SPI_BUFFER_SIZE]
+        offset += len(data_out)
 
         # Clear the queue
         ps_queue_clear(queue)
 
-        # Prepare and write data
-        data_out = array('B', chunk)
+        # Write data
         ps_queue_spi_ss(queue, SPI_SS_MASK)
         ps_queue_spi_write(queue, SPI_DUAL_DATA_RATE, 8, len(data_out), data_out)
         ps_queue_spi_ss(queue, 0)
@@ -492,52 +551,32 @@ def blast_bytes_array(channel, queue, byte_array):
             print("error: only a partial number of bytes written")
             print("  (%d) instead of full (%d)" % (count, len(data_out)))
 
-        sys.stdout.write("*** Transaction #%02d\n" % trans_num)
-        sys.stdout.write("Data read from device:")
-        for i in range(count):
-            if (i & 0x0f) == 0:
-                sys.stdout.write("\n%04x:  " % i)
-            sys.stdout.write("%02x " % (data_in[i] & 0xff))
-            if ((i + 1) & 0x07) == 0:
-                sys.stdout.write(" ")
-        sys.stdout.write("\n\n")
+        write_dump("*** Transaction #%02d\nData read from device:" % trans_num,
+                   data_in, limit = DUMP_LIMIT, mode = DUMP_MODE)
 
         trans_num += 1
 
 
 def SPI_Transaction_Array(channel, queue, byte_array):
     """
-    Write the given byte array directly over SPI without reading from a file.
+    Full-duplex transfer of byte_array (a buffer, a list of hex values or
+    an iterator of buffers) in SPI_BUFFER_SIZE chunks, each sent once.
+    The next chunk is submitted while the previous one is collected.
     Returns all data read from the SPI device as a single array.
     """
-    from array import array
-
-    data_out = MYnormalize(byte_array)
-
-    received_data = array('B')
-    offset = 0
-
-    while offset < len(byte_array):
-        # Slice the data into chunks of BUFFER_SIZE
-        chunk = byte_array[offset:offset + SPI_BUFFER_SIZE]
-        offset += len(chunk)
-
-        # Clear the queue
-        ps_queue_clear(queue)
-
-        # Prepare and write data
-        # data_out = array('B', chunk)
-        ps_queue_spi_ss(queue, SPI_SS_MASK)
-        ps_queue_spi_write(queue, SPI_DUAL_DATA_RATE, 8, len(data_out), data_out)
-        ps_queue_spi_ss(queue, 0)
-
-        collect, _ = ps_queue_submit(queue, channel, 0)
-        data_in = dev_collect(collect)
-
-        if len(data_in) != len(data_out):
-            print("Warning: Partial write occurred (%d of %d bytes)" % (len(data_in), len(data_out)))
-
-        received_data.extend(data_in)
+    if isinstance(byte_array, list):
+        byte_array = MYnormalize(byte_array)
+
+    bitrate = PROFILES.current(SESSIONS.for_channel(channel), 'bitrate')
+    received_data, stats = stream_transfer(channel, queue, byte_array,
+                                           chunk = SPI_BUFFER_SIZE,
+                                           io = SPI_DUAL_DATA_RATE,
+                                           ss_mask = SPI_SS_MASK,
+                                           bitrate_khz = bitrate)
+    collect_print_errors(stats.errors)
+    if stats.read != stats.written:
+        print("Warning: Partial write occurred (%d of %d bytes)" % (stats.read, stats.written))
+    print("SPI transfer: %s" % stats.report())
 
     return received_data
 
@@ -558,78 +597,28 @@ def SPI_Transaction_Array(channel, queue, byte_array):
 
 # SPI_INIT_BOTH(PS_APP_CONFIG_SPI,PS_PHY_TARGET_POWER_TARGET1_3V,SPI_LS_Voltage,SPI_Word_Delay,  PS_SPI_MODE_0, PS_SPI_BITORDER_MSB, SlaveBitmask, SPI_SS_MASK)
 
-(pm_North, conn_North, HANDLER_North, IP_North) = Select_SPI_Controller_Handler("NORTH" , 0)
-(pm_South, conn_South, HANDLER_South, IP_South) = Select_SPI_Controller_Handler("South" , 0)
-
-if ( HANDLER_North == 0) : print(f"The North SPI Controller is Missing")
-if ( HANDLER_South == 0) : print(f"The South SPI Controller is Missing")
-
-
-if ( HANDLER_North != 0) :
-    print(f"The North SPI Controller is Connected")
-
-    channel = HANDLER_North
-    name = "North_SPI"
-
-    # Device is already opened
-    #     
-    # Ensure that the SPI subsystem is enabled
-    ps_app_configure(channel, PS_APP_CONFIG_SPI)
-
-    # Select Target Power supply voltage level.
-    ps_phy_target_power(channel, PS_PHY_TARGET_POWER_TARGET1_3V)
-
-    # Configure the power of output signal.
-    #a = ps_phy_level_shift (HANDLER_South, 0.9)
-    a = ps_phy_level_shift (channel, SPI_LS_Voltage)
-    print(f"{name} Level Shift Configured --> Level = { a } .")
-
-    # Configure the Word Delay 
-    a = ps_spi_configure_delays (channel, SPI_Word_Delay)
-    if (a == PS_APP_OK ) : print(f"{name} Word Delay set Successfully.")
-
-    # Setup the clock phase
-    ps_spi_configure(channel, PS_SPI_MODE_0, PS_SPI_BITORDER_MSB, SPI_SS_MASK_Active)
-
-    # Configure SS
-    ps_spi_enable_ss(channel, SPI_SS_MASK)
-
-    # Set the bitrate
-    bitrate = ps_spi_bitrate(channel, SPI_Frequency)
-    print(f"{name} Bitrate set to {bitrate} kHz.")
-
-if ( HANDLER_South != 0) : 
-    print(f"The South SPI Controller is Connected")
-
-    channel = HANDLER_South
-    name = "South_SPI"
-
-    # Device is already opened
-    #     
-    # Ensure that the SPI subsystem is enabled
-    ps_app_configure(channel, PS_APP_CONFIG_SPI)
-
-    # Select Target Power supply voltage level.
-    ps_phy_target_power(channel, PS_PHY_TARGET_POWER_TARGET1_3V)
-
-    # Configure the power of output signal.
-    #a = ps_phy_level_shift (HANDLER_South, 0.9)
-    a = ps_phy_level_shift (channel, SPI_LS_Voltage)
-    print(f"{name} Level Shift Configured --> Level = { a } .")
-
-    # Configure the Word Delay 
-    a = ps_spi_configure_delays (channel, SPI_Word_Delay)
-    if (a == PS_APP_OK ) : print(f"{name} Word Delay set Successfully.")
+# Open and configure both controllers at once; only changed settings are sent
+SPI_OPEN = ORCHESTRATOR.open_all()
 
-    # Setup the clock phase
-    ps_spi_configure(channel, SPI_MODE, PS_SPI_BITORDER_MSB, SPI_SS_MASK_Active)
+for key, opened in sorted(SPI_OPEN.items()):
+    name = key.capitalize()
+    if not opened.ok():
+        print(f"The {name} SPI Controller is Missing ({opened.error})")
+        continue
 
-    # Configure SS
-    ps_spi_enable_ss(channel, SPI_SS_MASK)
+    results = opened.result
+    session = ORCHESTRATOR.sessions[key]
+    session.latency = CALIBRATION.latency(SPI_PROFILE[key]["unique_id"],
+                                          results['bitrate'],
+                                          SPI_PROFILE[key]["miso_latency"])
+    print("%s startup: %s" % (session.ip, session.startup_report()))
+    print(f"The {name} SPI Controller is Connected")
+    print(f"{name}_SPI Level Shift Configured --> Level = { results['level_shift'] } .")
+    if (results['delays'] == PS_APP_OK ) : print(f"{name}_SPI Word Delay set Successfully.")
+    print(f"{name}_SPI Bitrate set to {results['bitrate']} kHz.")
 
-    # Set the bitrate
-    bitrate = ps_spi_bitrate(channel, 8000)
-    print(f"{name} Bitrate set to {bitrate} kHz.")
+(pm_North, conn_North, HANDLER_North, IP_North) = SPI_Handles("north")
+(pm_South, conn_South, HANDLER_South, IP_South) = SPI_Handles("south")
 
 
 
@@ -690,8 +679,8 @@ print("Received data from SPI:")
 print("[" + ", ".join(f"0x{byte:02X}" for byte in data_received) + "]")
 
 
-# Close the device and exit
-dev_close(pm, conn, channel)
+# Close both controllers and exit
+ORCHESTRATOR.close_all()
 
   
   
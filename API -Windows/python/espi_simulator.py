@@ -34,6 +34,12 @@ import unittest
 
 from promira_py import *
 from promact_is_py import *
+from ps_words import pack_words
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 #==========================================================================
@@ -316,6 +322,11 @@ class EspiSimulator (unittest.TestCase):
         self._spi_submit()
 
     def _espi_pack_cmd_for_single (self, data):
+        # One 2-bit word per bit, driven on the low line
+        if numpy is not None:
+            bits = numpy.unpackbits(numpy.array(data, dtype = numpy.uint8))
+            return pack_words(bits, 2).tolist()
+
         result = [ ]
         for byte in data:
             word = 0
@@ -328,6 +339,11 @@ class EspiSimulator (unittest.TestCase):
         return result
 
     def _espi_pack_resp_for_single (self, data):
+        # One 2-bit word per bit, on the high line
+        if numpy is not None:
+            bits = numpy.unpackbits(numpy.array(data, dtype = numpy.uint8))
+            return pack_words(bits << 1, 2).tolist()
+
         result = [ ]
         for byte in data:
             word = 0
@@ -0,0 +1,36 @@
+#==========================================================================
+# Promira SPI Controller
+#--------------------------------------------------------------------------
+# Project : POC- SPI Controller
+# File    : fake_promira.py
+#--------------------------------------------------------------------------
+# Stand-ins for the native libraries, for the unit tests
+#--------------------------------------------------------------------------
+# Importing this module before any ps_* module lets the tests run
+# without a Promira: promira_py and promact_is_py find modules named
+# promira and promact_is that report a compatible version.  The tests
+# patch whatever API functions they use.
+#==========================================================================
+
+
+#==========================================================================
+# IMPORTS
+#==========================================================================
+import sys
+import types
+
+
+#==========================================================================
+# CONSTANTS
+#==========================================================================
+API_VERSION = 0x013c
+
+
+#==========================================================================
+# MAIN PROGRAM
+#==========================================================================
+for _name in ('promira', 'promact_is'):
+    if _name not in sys.modules:
+        _api = types.ModuleType(_name)
+        _api.py_version = lambda: (API_VERSION << 16) | API_VERSION
+        sys.modules[_name] = _api
@@ -33,6 +33,7 @@ import time
 
 from promira_py import *
 from promact_is_py import *
+from ps_hexdump import *
 
 
 #==========================================================================
@@ -42,6 +43,10 @@ BUFFER_SIZE      = 65535
 SLAVE_RESP_SIZE  =    26
 INTERVAL_TIMEOUT =   500
 
+# DUMP_FULL, DUMP_SUMMARY or DUMP_QUIET, and bytes shown per transaction
+DUMP_MODE        = DUMP_FULL
+DUMP_LIMIT       = None
+
 
 #==========================================================================
 # FUNCTION (APP)
@@ -110,17 +115,9 @@ def dump (channel, timeout_ms):
                 return
 
             # Dump the data to the screen
-            sys.stdout.write("*** Transaction #%02d\n" % trans_num)
-            sys.stdout.write("Data read from device:")
-            for i in range(num_bytes):
-                if ((i&0x0f) == 0):
-                    sys.stdout.write("\n%04x:  " % i)
-
-                sys.stdout.write("%02x " % (data_in[i] & 0xff))
-                if (((i+1)&0x07) == 0):
-                    sys.stdout.write(" ")
-
-            sys.stdout.write("\n\n")
+            write_dump("*** Transaction #%02d\nData read from device:"
+                       % trans_num, memoryview(data_in)[:num_bytes],
+                       limit = DUMP_LIMIT, mode = DUMP_MODE)
 
         elif (result == PS_I2C_SLAVE_WRITE):
             # Get number of bytes written to master
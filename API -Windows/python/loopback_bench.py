@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+#==========================================================================
+# Promira SPI Controller
+#--------------------------------------------------------------------------
+# Project : POC- SPI Controller
+# File    : loopback_bench.py
+#--------------------------------------------------------------------------
+# Two-adapter SPI/I2C loopback throughput benchmark
+#--------------------------------------------------------------------------
+# Drives one Promira as master and a second one, wired to it, as slave
+# from the same process, the pairing spi_file/spi_slave and
+# i2c_file/i2c_slave are run with by hand.  For every combination of
+# bitrate, IO mode, chunk size and word delay it sends random data,
+# drains the slave on a second thread, checks that every byte arrived
+# intact and prints one JSON record with throughput, per-transaction
+# latency percentiles and data-lost counts.
+#
+# The ber mode instead streams a PRBS pattern over SPI for a given
+# time per bitrate and prints one JSON record of bit error counts
+# per bitrate (see ps_ber).
+#==========================================================================
+
+
+#==========================================================================
+# IMPORTS
+#==========================================================================
+from __future__ import division, with_statement, print_function
+import json
+import os
+import sys
+import threading
+import time
+
+from promira_py import *
+from promact_is_py import *
+from ps_collect import collect_errors
+from ps_session import PromiraSession, PromiraError
+from ps_ber import ber_link
+
+
+#==========================================================================
+# CONSTANTS
+#==========================================================================
+MB = 1 * 1024 * 1024
+KB = 1 * 1024
+
+DEFAULT_SIZE = 256 * KB
+
+SS_MASK         = 0x1
+SLAVE_READ_SIZE = 65535
+I2C_SLAVE_ADDR  = 0x40
+
+POLL_MS         = 50         # slave poll slice
+DRAIN_IDLE_MS   = 500        # slave gives up after this long idle
+
+# Sweep axes
+SPI_BITRATES    = ( 1000, 5000, 10000, 20000, 40000 )
+SPI_IO_MODES    = ( PS_SPI_IO_STANDARD, PS_SPI_IO_DUAL, PS_SPI_IO_QUAD )
+SPI_CHUNKS      = ( 256, 2 * KB, 16 * KB, 64 * KB - 1 )
+SPI_WORD_DELAYS = ( 0, 2 )
+
+I2C_BITRATES    = ( 100, 400, 1000 )
+I2C_CHUNKS      = ( 64, 256, 1024 )
+
+BER_ORDER       = 31
+BER_SECONDS     = 60         # per bitrate
+
+
+#==========================================================================
+# HELPER FUNCTIONS
+#==========================================================================
+def percentile (ordered, p):
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def mismatches (sent, received):
+    # Byte errors over the common length plus any missing bytes
+    size = min(len(sent), len(received))
+    if bytes(sent[:size]) == bytes(received[:size]):
+        errors = 0
+    else:
+        errors = sum(1 for a, b in zip(sent[:size], received[:size]) if a != b)
+    return errors + len(sent) - size
+
+def record (bus, sent, received, seconds, latencies, lost, **point):
+    ordered = sorted(latencies)
+    errors  = mismatches(sent, received)
+    rate    = seconds and len(sent) * 8 / seconds / 1e6 or 0.0
+    rec = dict(point)
+    rec.update({
+        'bus'        : bus,
+        'bytes'      : len(sent),
+        'received'   : len(received),
+        'errors'     : errors,
+        'lost'       : lost,
+        'ok'         : errors == 0 and lost == 0,
+        'seconds'    : round(seconds, 6),
+        'mbps'       : round(rate, 3),
+        'efficiency' : round(rate * 1000 / point['bitrate_khz'], 4),
+        'txn'        : len(latencies),
+        'lat_p50_ms' : round(percentile(ordered, 50) * 1000, 3),
+        'lat_p90_ms' : round(percentile(ordered, 90) * 1000, 3),
+        'lat_p99_ms' : round(percentile(ordered, 99) * 1000, 3),
+        'lat_max_ms' : round((ordered and ordered[-1] or 0) * 1000, 3),
+    })
+    return rec
+
+
+#==========================================================================
+# CLASSES
+#==========================================================================
+class SlaveDrain (threading.Thread):
+    """
+    Collect everything the slave receives until `expected` bytes have
+    arrived, or stop() was called and the slave stays idle for
+    DRAIN_IDLE_MS.
+    """
+    def __init__ (self, channel, bus, expected):
+        threading.Thread.__init__(self, name = 'slave-drain', daemon = True)
+        self.channel  = channel
+        self.bus      = bus
+        self.expected = expected
+        self.received = bytearray()
+        self.lost     = 0
+        self.error    = None
+        self._done    = threading.Event()
+        self._buf     = array_u08(SLAVE_READ_SIZE)
+
+    def stop (self):
+        self._done.set()
+
+    def _poll (self):
+        if self.bus == 'spi':
+            return ps_spi_slave_poll(self.channel, POLL_MS)
+        return ps_i2c_slave_poll(self.channel, POLL_MS)
+
+    def _read (self, status):
+        if self.bus == 'spi':
+            if status & PS_SPI_SLAVE_DATA:
+                ret, info = ps_spi_slave_read_into(self.channel, self._buf)
+                if ret < 0:
+                    self.error = ret
+                else:
+                    self.received += memoryview(self._buf)[:ret]
+            if status & PS_SPI_SLAVE_DATA_LOST:
+                self.lost += max(0, ps_spi_slave_data_lost_stats(self.channel))
+        else:
+            if status & PS_I2C_SLAVE_READ:
+                ret, addr, data, num = ps_i2c_slave_read(self.channel,
+                                                         self._buf)
+                if ret < 0:
+                    self.error = ret
+                else:
+                    self.received += memoryview(self._buf)[:num]
+            if status & PS_I2C_SLAVE_DATA_LOST:
+                self.lost += max(0, ps_i2c_slave_data_lost_stats(self.channel))
+
+    def run (self):
+        idle = 0
+        while len(self.received) < self.expected and self.error is None:
+            status = self._poll()
+            if status < 0:
+                self.error = status
+                break
+            if status == 0:
+                if self._done.is_set():
+                    idle += POLL_MS
+                    if idle >= DRAIN_IDLE_MS:
+                        break
+                continue
+            idle = 0
+            self._read(status)
+
+
+#==========================================================================
+# FUNCTIONS
+#==========================================================================
+def setup_spi (master, slave):
+    for session in (master, slave):
+        session.configure(ps_app_configure, PS_APP_CONFIG_SPI)
+        session.configure(ps_spi_configure, PS_SPI_MODE_0,
+                          PS_SPI_BITORDER_MSB, 0)
+        session.configure(ps_spi_enable_ss, SS_MASK)
+    master.configure(ps_phy_target_power, PS_PHY_TARGET_POWER_BOTH)
+    slave.configure(ps_phy_target_power, PS_PHY_TARGET_POWER_NONE)
+    slave.configure(ps_spi_slave_host_read_size, SLAVE_READ_SIZE)
+    slave.configure(ps_spi_slave_enable, PS_SPI_SLAVE_MODE_STD)
+
+def setup_i2c (master, slave):
+    for session in (master, slave):
+        session.configure(ps_app_configure, PS_APP_CONFIG_I2C)
+    master.configure(ps_i2c_pullup, PS_I2C_PULLUP_BOTH)
+    master.configure(ps_phy_target_power, PS_PHY_TARGET_POWER_BOTH)
+    slave.configure(ps_i2c_slave_enable, I2C_SLAVE_ADDR, 0, 0)
+
+def run_spi (master, slave, data, bitrate, io, chunk, word_delay):
+    bitrate = master.configure(ps_spi_bitrate, bitrate)
+    master.configure(ps_spi_configure_delays, word_delay)
+    slave.configure(ps_spi_std_slave_configure, io, 0)
+
+    drain = SlaveDrain(slave.channel, 'spi', len(data))
+    drain.start()
+
+    view = memoryview(data)
+    latencies = [ ]
+    start = time.perf_counter()
+    for offset in range(0, len(view), chunk):
+        t = time.perf_counter()
+        _, table = master.transfer(view[offset:offset + chunk], io, SS_MASK, 0)
+        latencies.append(time.perf_counter() - t)
+        if collect_errors(table):
+            break
+    seconds = time.perf_counter() - start
+
+    drain.stop()
+    drain.join()
+    return record('spi', data, drain.received, seconds, latencies,
+                  drain.lost, bitrate_khz = bitrate, io = io, chunk = chunk,
+                  word_delay = word_delay)
+
+def run_i2c (master, slave, data, bitrate, chunk):
+    bitrate = master.configure(ps_i2c_bitrate, bitrate)
+
+    drain = SlaveDrain(slave.channel, 'i2c', len(data))
+    drain.start()
+
+    view = memoryview(data)
+    latencies = [ ]
+    start = time.perf_counter()
+    for offset in range(0, len(view), chunk):
+        t = time.perf_counter()
+        ret, num = master.call(ps_i2c_write, I2C_SLAVE_ADDR, PS_I2C_NO_FLAGS,
+                               view[offset:offset + chunk])
+        latencies.append(time.perf_counter() - t)
+        if ret < 0:
+            break
+    seconds = time.perf_counter() - start
+
+    drain.stop()
+    drain.join()
+    return record('i2c', data, drain.received, seconds, latencies,
+                  drain.lost, bitrate_khz = bitrate, chunk = chunk)
+
+def sweep (bus, master, slave, size, out = sys.stdout):
+    """Run every sweep point of bus and write one JSON line per point."""
+    data = os.urandom(size)
+    if bus == 'spi':
+        setup_spi(master, slave)
+        points = [ (run_spi, (br, io, chunk, wd))
+                   for br in SPI_BITRATES for io in SPI_IO_MODES
+                   for chunk in SPI_CHUNKS for wd in SPI_WORD_DELAYS ]
+    else:
+        setup_i2c(master, slave)
+        points = [ (run_i2c, (br, chunk))
+                   for br in I2C_BITRATES for chunk in I2C_CHUNKS ]
+
+    results = [ ]
+    for run, args in points:
+        rec = run(master, slave, data, *args)
+        out.write(json.dumps(rec, sort_keys = True) + "\n")
+        out.flush()
+        results.append(rec)
+    return results
+
+def ber_sweep (master, slave, seconds, out = sys.stdout):
+    """PRBS bit error counts at every SPI bitrate, one JSON line each."""
+    setup_spi(master, slave)
+    slave.configure(ps_spi_std_slave_configure, PS_SPI_IO_STANDARD, 0)
+    results = ber_link(master, slave, BER_ORDER, seconds, SPI_BITRATES)
+    for bitrate, stats in sorted(results.items()):
+        out.write(json.dumps(dict(stats.as_dict(), bus = 'ber'),
+                             sort_keys = True) + "\n")
+    out.flush()
+    return results
+
+
+#==========================================================================
+# MAIN PROGRAM
+#==========================================================================
+if __name__ == '__main__':
+    if (len(sys.argv) < 4):
+        print("usage: loopback_bench MASTER_IP SLAVE_IP spi|i2c [SIZE_KB]")
+        print("       loopback_bench MASTER_IP SLAVE_IP ber [SECONDS]")
+        print("")
+        print("  Wire the master's bus to the slave's.  One JSON record")
+        print("  per sweep point is written to stdout.")
+        sys.exit()
+
+    master_ip = sys.argv[1]
+    slave_ip  = sys.argv[2]
+    bus       = sys.argv[3].lower()
+    arg       = len(sys.argv) > 4 and int(sys.argv[4]) or 0
+
+    master = PromiraSession(master_ip)
+    slave  = PromiraSession(slave_ip)
+    try:
+        master.open()
+        slave.open()
+    except PromiraError as e:
+        print(e)
+        sys.exit()
+
+    try:
+        if bus == 'ber':
+            ber_sweep(master, slave, arg or BER_SECONDS)
+        else:
+            sweep(bus, master, slave, arg * KB or DEFAULT_SIZE)
+    finally:
+        if bus != 'i2c':
+            slave.call(ps_spi_slave_disable)
+        else:
+            slave.call(ps_i2c_slave_disable)
+        master.close()
+        slave.close()
@@ -0,0 +1,183 @@
+#==========================================================================
+# Promira SPI Controller
+#--------------------------------------------------------------------------
+# Project : POC- SPI Controller
+# File    : ps_asyncio.py
+#--------------------------------------------------------------------------
+# asyncio front-end for promact_is channels
+#--------------------------------------------------------------------------
+# Every blocking promact_is call runs on a bounded thread pool shared by
+# all channels, so many channels can be driven from a single event
+# loop.  Only calls that share a handle are serialized: submits of one
+# queue, the asynchronous collects of a channel (they return queues in
+# submit order), SPI slave calls and GPIO calls each take their own
+# lock.  An async_submit therefore goes out while an async_collect is
+# still waiting on the same channel.  Long waits are split into short
+# slices so that cancelling a task takes effect within POLL_SLICE_MS.
+#==========================================================================
+
+
+#==========================================================================
+# IMPORTS
+#==========================================================================
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from promact_is_py import *
+from ps_collect import collect_all
+
+
+#==========================================================================
+# CONSTANTS
+#==========================================================================
+DEFAULT_WORKERS = 8
+POLL_SLICE_MS   = 100
+SLAVE_READ_SIZE = 65535
+
+
+#==========================================================================
+# EXECUTOR
+#==========================================================================
+_executor      = None
+_executor_lock = threading.Lock()
+
+def default_executor ():
+    """Return the shared executor, creating it on first use."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(DEFAULT_WORKERS,
+                                           thread_name_prefix = 'promira')
+        return _executor
+
+
+#==========================================================================
+# CLASSES
+#==========================================================================
+class AsyncChannel:
+    """
+    Awaitable wrapper around one PromiraChannelHandle.
+
+    executor defaults to default_executor().  The locks are created
+    lazily so the object may be built outside the event loop.
+    """
+    def __init__ (self, channel, executor = None):
+        self.channel   = channel
+        self.executor  = executor or default_executor()
+        self._locks    = { }
+        self._gpio_ref = None
+
+    async def run (self, func, *args, lock = 'channel'):
+        """
+        Run func(*args) on the executor.  Calls passing the same lock
+        key run one at a time; the default key serializes the calls
+        made through run() directly.
+        """
+        if lock not in self._locks:
+            self._locks[lock] = asyncio.Lock()
+        loop = asyncio.get_running_loop()
+        async with self._locks[lock]:
+            return await loop.run_in_executor(self.executor, func, *args)
+
+    #----------------------------------------------------------------------
+    # Queues
+    #----------------------------------------------------------------------
+    async def submit (self, queue, out = None, skip = (), ctrl_id = 0):
+        """Submit queue and collect it.  Returns collect_all's result."""
+        def job ():
+            collect, _ = ps_queue_submit(queue, self.channel, ctrl_id)
+            return collect_all(collect, out, skip)
+        return await self.run(job, lock = ('queue', queue))
+
+    async def async_submit (self, queue, ctrl_id = 0):
+        """Submit queue without waiting for pending collects."""
+        return await self.run(ps_queue_async_submit, queue, self.channel,
+                              ctrl_id, lock = ('queue', queue))
+
+    async def async_collect (self, out = None, skip = ()):
+        """Collect the next asynchronously submitted queue."""
+        def job ():
+            collect, _ = ps_queue_async_collect(self.channel)
+            return collect_all(collect, out, skip)
+        return await self.run(job, lock = 'collect')
+
+    #----------------------------------------------------------------------
+    # SPI slave
+    #----------------------------------------------------------------------
+    async def slave_poll (self, timeout_ms = -1):
+        """
+        Wait for a slave event.  Returns the ps_spi_slave_poll status;
+        PS_SPI_SLAVE_NO_DATA once timeout_ms expires (never if < 0).
+        """
+        deadline = timeout_ms >= 0 and time.monotonic() + timeout_ms / 1000
+        while True:
+            wait = POLL_SLICE_MS
+            if deadline:
+                left = int((deadline - time.monotonic()) * 1000)
+                wait = max(0, min(wait, left))
+            status = await self.run(ps_spi_slave_poll, self.channel, wait,
+                                    lock = 'slave')
+            if status != PS_SPI_SLAVE_NO_DATA:
+                return status
+            if deadline and time.monotonic() >= deadline:
+                return status
+
+    async def slave_events (self, timeout_ms = -1, size = SLAVE_READ_SIZE):
+        """
+        Async iterator over SPI slave events.
+
+        Yields (PS_SPI_SLAVE_DATA, read_info, data) for each reception
+        and (PS_SPI_SLAVE_DATA_LOST, lost_count, None) on overflow.
+        Ends when no event arrives within timeout_ms (runs forever if
+        timeout_ms < 0) or on an error.
+        """
+        while True:
+            status = await self.slave_poll(timeout_ms)
+            if status == PS_SPI_SLAVE_NO_DATA or status < 0:
+                return
+
+            if status & PS_SPI_SLAVE_DATA:
+                num_read, info, data = await self.run(
+                    ps_spi_slave_read, self.channel, size, lock = 'slave')
+                if num_read < 0:
+                    return
+                yield (PS_SPI_SLAVE_DATA, info, data)
+
+            if status & PS_SPI_SLAVE_DATA_LOST:
+                lost = await self.run(ps_spi_slave_data_lost_stats,
+                                      self.channel, lock = 'slave')
+                yield (PS_SPI_SLAVE_DATA_LOST, lost, None)
+
+    #----------------------------------------------------------------------
+    # GPIO
+    #----------------------------------------------------------------------
+    async def gpio_change (self, timeout_ms = -1):
+        """
+        Wait until the GPIO inputs differ from the last value seen.
+        Returns the new value, the unchanged value once timeout_ms
+        expires (never if < 0), or a negative status code.
+        """
+        if self._gpio_ref is None:
+            self._gpio_ref = await self.run(ps_gpio_get, self.channel,
+                                            lock = 'gpio')
+            if self._gpio_ref < 0:
+                value, self._gpio_ref = self._gpio_ref, None
+                return value
+
+        deadline = timeout_ms >= 0 and time.monotonic() + timeout_ms / 1000
+        while True:
+            wait = POLL_SLICE_MS
+            if deadline:
+                left = int((deadline - time.monotonic()) * 1000)
+                wait = max(0, min(wait, left))
+            value = await self.run(ps_gpio_change, self.channel, wait,
+                                   lock = 'gpio')
+            if value < 0:
+                return value
+            if value != self._gpio_ref:
+                self._gpio_ref = value
+                return value
+            if deadline and time.monotonic() >= deadline:
+                return value
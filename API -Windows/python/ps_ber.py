@@ -0,0 +1,368 @@
+#==========================================================================
+# Promira SPI Controller
+#--------------------------------------------------------------------------
+# Project : POC- SPI Controller
+# File    : ps_ber.py
+#--------------------------------------------------------------------------
+# Bit error rate testing with PRBS patterns
+#--------------------------------------------------------------------------
+# Prbs generates the ITU-T O.150 PRBS7, PRBS15, PRBS23 and PRBS31
+# sequences in chunks with NumPy.  An LFSR sequence with taps n and m
+# satisfies b[k] = b[k-n] ^ b[k-m], and squaring its polynomial gives
+# b[k] = b[k-n*2^j] ^ b[k-m*2^j], so m*2^j bits come out of a single
+# vectorized XOR of the last n*2^j bits.
+#
+# BerStats counts bit errors, with a histogram by bit position in the
+# byte, for one bitrate.  ber_echo sends the pattern through a device
+# that echoes MOSI on MISO; ber_link sends it from a master to a second
+# Promira running as SPI slave, which checks the stream as it arrives
+# and resynchronizes on the received bits after lost data.  Only one
+# chunk and the generator history are held at a time, so a test can
+# run for hours.
+#
+# NumPy is needed for all of it.
+#==========================================================================
+
+
+#==========================================================================
+# IMPORTS
+#==========================================================================
+from __future__ import division, with_statement, print_function
+import threading
+import time
+
+from promact_is_py import *
+from ps_collect import collect_errors
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+#==========================================================================
+# CONSTANTS
+#==========================================================================
+# Feedback taps (n, m) of x^n + x^m + 1
+PRBS_TAPS = {
+    7  : (7, 6),
+    15 : (15, 14),
+    23 : (23, 18),
+    31 : (31, 28),
+}
+
+PRBS_MAX_SHIFT = 15          # history of n * 2^15 bits, ~1 MB for PRBS31
+
+BER_CHUNK      = 16 * 1024   # bytes per transfer
+BER_POLL_MS    = 50
+BER_IDLE_MS    = 500         # slave drain gives up after this long idle
+
+
+#==========================================================================
+# HELPER FUNCTIONS
+#==========================================================================
+def _check ():
+    if numpy is None:
+        raise ImportError("BER testing needs numpy")
+
+def _as_array (data):
+    return numpy.frombuffer(data, dtype = numpy.uint8)
+
+
+#==========================================================================
+# CLASSES
+#==========================================================================
+class Prbs:
+    """
+    PRBS bit stream of the given order, returned in bytes MSB first.
+
+    seed is the first `order` bits of the stream (all ones by default,
+    must not be zero).  A receiver seeded with `order` received bits
+    reproduces the rest of the stream from that point.
+    """
+    def __init__ (self, order = 31, seed = None):
+        _check()
+        if order not in PRBS_TAPS:
+            raise ValueError("PRBS order must be one of %s, not %d" %
+                             (sorted(PRBS_TAPS), order))
+        self.order = order
+        self.n, self.m = PRBS_TAPS[order]
+        if seed is None:
+            seed = (1 << order) - 1
+        seed &= (1 << order) - 1
+        if not seed:
+            raise ValueError("PRBS seed must not be zero")
+
+        bits = [ (seed >> (order - 1 - i)) & 1 for i in range(order) ]
+        self._hist    = numpy.array(bits, dtype = numpy.uint8)
+        self._pending = self._hist.copy()
+        self._limit   = self.n << PRBS_MAX_SHIFT
+
+    @classmethod
+    def from_bytes (cls, order, data):
+        """Generator continuing a stream whose first bytes are data."""
+        bits = numpy.unpackbits(_as_array(data)[:(order + 7) // 8])
+        seed = int(''.join('%d' % b for b in bits[:order]), 2)
+        return cls(order, seed)
+
+    def _extend (self, count):
+        # Append at least count new bits to the history, return them
+        blocks = [ ]
+        made = 0
+        hist = self._hist
+        while made < count:
+            shift = 0
+            while (self.n << (shift + 1)) <= len(hist) and \
+                  shift < PRBS_MAX_SHIFT:
+                shift += 1
+            back_n = self.n << shift
+            step   = self.m << shift
+            new = hist[-back_n:len(hist) - back_n + step] ^ hist[-step:]
+            hist = numpy.concatenate((hist[-(self._limit - step):], new))
+            blocks.append(new)
+            made += step
+        self._hist = hist
+        return numpy.concatenate(blocks)
+
+    def bits (self, count):
+        """The next count bits as a uint8 array of 0s and 1s."""
+        pending = self._pending
+        if len(pending) < count:
+            pending = numpy.concatenate(
+                (pending, self._extend(count - len(pending))))
+        self._pending = pending[count:]
+        return pending[:count]
+
+    def next (self, size):
+        """The next size bytes as a uint8 array."""
+        return numpy.packbits(self.bits(size * 8))
+
+class BerStats:
+    """Error counts of one bitrate."""
+    def __init__ (self, bitrate_khz = None, order = None):
+        self.bitrate_khz = bitrate_khz
+        self.order       = order
+        self.bits        = 0
+        self.errors      = 0
+        self.positions   = [ 0 ] * 8     # errors by bit, MSB first
+        self.chunks      = 0
+        self.bad_chunks  = 0
+        self.missing     = 0             # bytes sent but not received
+        self.lost        = 0             # slave data-lost events
+        self.resyncs     = 0
+        self.seconds     = 0.0
+
+    def compare (self, expected, received):
+        """
+        Count the bit errors of received against expected (byte
+        buffers).  Bytes missing from the end of received are counted
+        separately, not as errors.  Returns the number of bit errors.
+        """
+        expected = _as_array(expected)
+        received = _as_array(received)
+        size = min(len(expected), len(received))
+        diff = expected[:size] ^ received[:size]
+        bad  = diff[numpy.flatnonzero(diff)]
+
+        errors = 0
+        if len(bad):
+            counts = numpy.unpackbits(bad).reshape(-1, 8).sum(axis = 0)
+            for i in range(8):
+                self.positions[i] += int(counts[i])
+            errors = int(counts.sum())
+            self.bad_chunks += 1
+        self.bits    += size * 8
+        self.errors  += errors
+        self.missing += len(expected) - size
+        self.chunks  += 1
+        return errors
+
+    def ber (self):
+        """Measured bit error rate, None before any bit was checked."""
+        if not self.bits:
+            return None
+        return self.errors / self.bits
+
+    def ber_limit (self):
+        """
+        Upper bound on the bit error rate at 95% confidence when no
+        error was seen (3 / bits), otherwise the measured rate.
+        """
+        if not self.bits:
+            return None
+        return self.errors and self.ber() or 3 / self.bits
+
+    def as_dict (self):
+        return {
+            'bitrate_khz' : self.bitrate_khz,
+            'order'       : self.order,
+            'bits'        : self.bits,
+            'errors'      : self.errors,
+            'ber'         : self.ber(),
+            'ber_limit'   : self.ber_limit(),
+            'positions'   : list(self.positions),
+            'chunks'      : self.chunks,
+            'bad_chunks'  : self.bad_chunks,
+            'missing'     : self.missing,
+            'lost'        : self.lost,
+            'resyncs'     : self.resyncs,
+            'seconds'     : round(self.seconds, 3),
+        }
+
+    def report (self):
+        text = "PRBS%s %s kHz: %d bits, %d errors" % \
+            (self.order, self.bitrate_khz, self.bits, self.errors)
+        if self.errors:
+            text += ", BER %.3g, by bit %s" % (self.ber(), self.positions)
+        elif self.bits:
+            text += ", BER < %.3g" % self.ber_limit()
+        if self.missing:
+            text += ", %d bytes missing" % self.missing
+        if self.lost:
+            text += ", %d lost, %d resyncs" % (self.lost, self.resyncs)
+        return text
+
+class BerReceiver (threading.Thread):
+    """
+    Check the PRBS stream arriving at an SPI slave channel against a
+    local generator.  After a data-lost event the generator is reseeded
+    from the next received bytes.  Runs until stop() was called and
+    the slave stays idle for BER_IDLE_MS.
+    """
+    def __init__ (self, channel, order, stats, seed = None,
+                  size = BER_CHUNK):
+        threading.Thread.__init__(self, name = 'ber-receiver', daemon = True)
+        self.channel = channel
+        self.order   = order
+        self.stats   = stats
+        self.prbs    = Prbs(order, seed)
+        self.error   = None
+        self._sync   = True
+        self._done   = threading.Event()
+        self._buf    = numpy.zeros(size, dtype = numpy.uint8)
+
+    def stop (self):
+        self._done.set()
+
+    def _check_data (self, data):
+        if not self._sync:
+            if len(data) < (self.order + 7) // 8:
+                return
+            self.prbs = Prbs.from_bytes(self.order, data)
+            self.stats.resyncs += 1
+            self._sync = True
+        self.stats.compare(self.prbs.next(len(data)), data)
+
+    def run (self):
+        idle = 0
+        while self.error is None:
+            status = ps_spi_slave_poll(self.channel, BER_POLL_MS)
+            if status < 0:
+                self.error = status
+                break
+            if status == 0:
+                if self._done.is_set():
+                    idle += BER_POLL_MS
+                    if idle >= BER_IDLE_MS:
+                        break
+                continue
+            idle = 0
+            if status & PS_SPI_SLAVE_DATA_LOST:
+                self.stats.lost += max(
+                    1, ps_spi_slave_data_lost_stats(self.channel))
+                self._sync = False
+            if status & PS_SPI_SLAVE_DATA:
+                ret, info = ps_spi_slave_read_into(self.channel, self._buf)
+                if ret < 0:
+                    self.error = ret
+                elif ret:
+                    self._check_data(self._buf[:ret])
+
+
+#==========================================================================
+# FUNCTIONS
+#==========================================================================
+def _sweep (session, bitrates, run):
+    # run(stats) at each bitrate, then restore the original bitrate
+    results = { }
+    with session.lock:
+        original = session.call(ps_spi_bitrate, 0)
+        try:
+            for requested in bitrates or (original, ):
+                actual = session.configure(ps_spi_bitrate, requested)
+                if actual < 0 or actual in results:
+                    continue
+                results[actual] = run(actual)
+        finally:
+            if bitrates and original > 0:
+                session.configure(ps_spi_bitrate, original)
+    return results
+
+def ber_echo (session, order = 31, seconds = 10, bitrates = None,
+              chunk = BER_CHUNK, io = PS_SPI_IO_STANDARD, ss_mask = 1,
+              latency_for = None):
+    """
+    Stream PRBS data for `seconds` at each bitrate (the current one by
+    default) through a device echoing MOSI on MISO, and compare what
+    comes back.  Responses are aligned with session.latency, set per
+    bitrate from latency_for(bitrate_khz) when given.  Returns
+    { bitrate_khz : BerStats }.
+    """
+    _check()
+
+    def run (bitrate):
+        stats = BerStats(bitrate, order)
+        if latency_for is not None:
+            session.latency = latency_for(bitrate)
+        prbs  = Prbs(order)
+        start = time.perf_counter()
+        while time.perf_counter() - start < seconds:
+            data = prbs.next(chunk)
+            responses, table = session.transfer_frames([ data ], io, ss_mask)
+            if collect_errors(table):
+                stats.missing += len(data)
+                stats.chunks  += 1
+                continue
+            stats.compare(data, responses[0])
+        stats.seconds = time.perf_counter() - start
+        return stats
+
+    latency = session.latency
+    try:
+        return _sweep(session, bitrates, run)
+    finally:
+        session.latency = latency
+
+def ber_link (master, slave, order = 31, seconds = 10, bitrates = None,
+              chunk = BER_CHUNK, io = PS_SPI_IO_STANDARD, ss_mask = 1):
+    """
+    Stream PRBS data for `seconds` at each bitrate from master to a
+    Promira configured as SPI slave (enabled, with a host read size of
+    at least chunk) and check it on the slave side.  Returns
+    { bitrate_khz : BerStats }.
+    """
+    _check()
+
+    def run (bitrate):
+        stats = BerStats(bitrate, order)
+        receiver = BerReceiver(slave.channel, order, stats,
+                               size = chunk)
+        receiver.start()
+        prbs  = Prbs(order)
+        sent  = 0
+        start = time.perf_counter()
+        try:
+            while time.perf_counter() - start < seconds and \
+                  receiver.error is None:
+                _, table = master.transfer(prbs.next(chunk), io, ss_mask, 0)
+                if collect_errors(table):
+                    break
+                sent += chunk
+        finally:
+            stats.seconds = time.perf_counter() - start
+            receiver.stop()
+            receiver.join()
+        stats.missing += max(0, sent - stats.bits // 8)
+        return stats
+
+    return _sweep(master, bitrates, run)
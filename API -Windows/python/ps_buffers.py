@@ -0,0 +1,66 @@
+#==========================================================================
+# Promira SPI Controller
+#--------------------------------------------------------------------------
+# Project : POC- SPI Controller
+# File    : ps_buffers.py
+#--------------------------------------------------------------------------
+# Reusable receive buffers for the promact_is read and collect paths
+#--------------------------------------------------------------------------
+# Pair a BufferPool with ps_collect_spi_read_into, ps_spi_slave_read_into
+# or ps_i2c_read_into to fill buffers in place instead of allocating a
+# new array on every read.
+#==========================================================================
+
+
+#==========================================================================
+# IMPORTS
+#==========================================================================
+from __future__ import division, with_statement, print_function
+import threading
+from contextlib import contextmanager
+
+from promact_is_py import array_u08
+
+
+#==========================================================================
+# CLASSES
+#==========================================================================
+class BufferPool:
+    """
+    Thread-safe pool of fixed-size array('B') receive buffers.
+
+    Buffers are allocated on demand and recycled by release(); at most
+    max_free idle buffers are kept (0 means no limit).  Contents are not
+    cleared between uses, so callers must rely on the byte count
+    returned by the read, not on the buffer length.
+    """
+    def __init__ (self, size, count = 0, max_free = 0):
+        self.size     = size
+        self.max_free = max_free
+        self._free    = [ array_u08(size) for _ in range(count) ]
+        self._lock    = threading.Lock()
+
+    def acquire (self):
+        with self._lock:
+            if self._free:
+                return self._free.pop()
+        return array_u08(self.size)
+
+    def release (self, buf):
+        if len(buf) != self.size:
+            raise ValueError("buffer does not belong to this pool")
+        with self._lock:
+            if not self.max_free or len(self._free) < self.max_free:
+                self._free.append(buf)
+
+    @contextmanager
+    def borrow (self):
+        buf = self.acquire()
+        try:
+            yield buf
+        finally:
+            self.release(buf)
+
+    def free_count (self):
+        with self._lock:
+            return len(self._free)
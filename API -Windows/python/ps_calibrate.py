@@ -0,0 +1,187 @@
+#==========================================================================
+# Promira SPI Controller
+#--------------------------------------------------------------------------
+# Project : POC- SPI Controller
+# File    : ps_calibrate.py
+#--------------------------------------------------------------------------
+# MISO latency calibration by cross-correlation
+#--------------------------------------------------------------------------
+# measure_latency sends a pseudo-random pattern to a device that echoes
+# MOSI on MISO, clocks max_latency more bits, and cross-correlates the
+# two bit streams with NumPy.  The peak gives the delay in clocks,
+# i.e. the byte delay and bit offset of the response.  calibrate()
+# repeats this at each bitrate the controller actually sets and stores
+# the results per unique ID in a CalibrationTable kept on disk.
+#
+# NumPy is needed for measuring, not for reading the table.
+#==========================================================================
+
+
+#==========================================================================
+# IMPORTS
+#==========================================================================
+from __future__ import division, with_statement, print_function
+import json
+import os
+import threading
+import time
+
+from promact_is_py import *
+from ps_stream import queue_spi_read
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+#==========================================================================
+# CONSTANTS
+#==========================================================================
+CALIBRATION_FILE = os.path.join(os.path.expanduser('~'),
+                                '.promira_calibration.json')
+
+CAL_PATTERN_SIZE = 512       # bytes of pattern per measurement
+CAL_MAX_LATENCY  = 1024      # clocks searched after the pattern
+CAL_MIN_SCORE    = 0.9       # correlation peak accepted as a match
+CAL_SEED         = 0x5EED
+
+# Requested bitrates in kHz; the controller rounds each one down
+CAL_BITRATES     = ( 1000, 2000, 4000, 8000, 10000, 20000, 40000 )
+
+
+#==========================================================================
+# HELPER FUNCTIONS
+#==========================================================================
+def _check ():
+    if numpy is None:
+        raise ImportError("latency calibration needs numpy")
+
+def cal_pattern (size = CAL_PATTERN_SIZE, seed = CAL_SEED):
+    """Reproducible pseudo-random bytes as a numpy uint8 array."""
+    _check()
+    return numpy.random.default_rng(seed).integers(0, 256, size,
+                                                   dtype = numpy.uint8)
+
+def correlate_latency (sent, received, max_latency = CAL_MAX_LATENCY):
+    """
+    Find the shift in bits at which received best matches sent.
+
+    received must hold at least len(sent) * 8 + max_latency bits.
+    Returns (latency, score) where score is the normalized correlation
+    peak: 1.0 for a perfect echo, about 0 for unrelated data.
+    """
+    _check()
+    tx = numpy.unpackbits(numpy.frombuffer(sent, dtype = numpy.uint8))
+    rx = numpy.unpackbits(numpy.frombuffer(received, dtype = numpy.uint8))
+    rx = rx[:len(tx) + max_latency]
+    if len(rx) < len(tx):
+        return (-1, 0.0)
+
+    # Map bits to +1/-1 so matching bits add and mismatches cancel
+    tx = tx.astype(numpy.float32) * 2 - 1
+    rx = rx.astype(numpy.float32) * 2 - 1
+    corr = numpy.correlate(rx, tx, 'valid')
+    latency = int(numpy.argmax(corr))
+    return (latency, float(corr[latency]) / len(tx))
+
+
+#==========================================================================
+# CLASSES
+#==========================================================================
+class CalibrationTable:
+    """
+    Latency per unique ID and bitrate, stored as JSON:
+
+        { "<unique_id>": { "<bitrate_khz>": { "latency": clocks,
+                                              "score":   peak,
+                                              "time":    epoch } } }
+
+    The file is read on construction and written by save().
+    """
+    def __init__ (self, path = CALIBRATION_FILE):
+        self.path    = path
+        self.entries = { }
+        self._lock   = threading.Lock()
+        self.load()
+
+    def load (self):
+        try:
+            with open(self.path) as f:
+                self.entries = json.load(f)
+        except (IOError, OSError, ValueError):
+            self.entries = { }
+
+    def save (self):
+        with self._lock:
+            text = json.dumps(self.entries, indent = 1, sort_keys = True)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(text)
+        os.replace(tmp, self.path)
+
+    def set (self, unique_id, bitrate_khz, latency, score):
+        with self._lock:
+            device = self.entries.setdefault(str(unique_id), { })
+            device[str(bitrate_khz)] = { 'latency' : latency,
+                                         'score'   : round(score, 4),
+                                         'time'    : int(time.time()) }
+
+    def latency (self, unique_id, bitrate_khz, default = None):
+        """Calibrated latency in clocks, or default if not measured."""
+        with self._lock:
+            entry = self.entries.get(str(unique_id), { }) \
+                                .get(str(bitrate_khz))
+        return entry['latency'] if entry else default
+
+
+#==========================================================================
+# FUNCTIONS
+#==========================================================================
+def measure_latency (session, io = PS_SPI_IO_STANDARD, ss_mask = 1,
+                     size = CAL_PATTERN_SIZE, max_latency = CAL_MAX_LATENCY):
+    """
+    Send a pattern on a PromiraSession and locate its echo.  Returns
+    (latency, score); latency is -1 if nothing was read back.
+    """
+    pattern = cal_pattern(size)
+
+    def build (queue):
+        ps_queue_spi_ss(queue, ss_mask)
+        ps_queue_spi_write(queue, io, 8, len(pattern), pattern)
+        queue_spi_read(queue, (max_latency + 7) // 8, io)
+        ps_queue_spi_ss(queue, 0)
+
+    with session.lock:
+        if not session.oe:
+            session.output_enable(1)
+        data, table = session.transact(build)
+    return correlate_latency(pattern, data, max_latency)
+
+def calibrate (session, unique_id, table, bitrates = CAL_BITRATES,
+               io = PS_SPI_IO_STANDARD, ss_mask = 1,
+               min_score = CAL_MIN_SCORE):
+    """
+    Measure the latency at each requested bitrate and record it in
+    table under the bitrate ps_spi_bitrate actually set.  Only matches
+    scoring at least min_score are kept.  The original bitrate is
+    restored and the table saved.  Returns { bitrate_khz : (latency,
+    score) } for every bitrate tried.
+    """
+    results = { }
+    with session.lock:
+        original = session.call(ps_spi_bitrate, 0)
+        try:
+            for requested in bitrates:
+                actual = session.configure(ps_spi_bitrate, requested)
+                if actual < 0 or actual in results:
+                    continue
+                latency, score = measure_latency(session, io, ss_mask)
+                results[actual] = (latency, score)
+                if latency >= 0 and score >= min_score:
+                    table.set(unique_id, actual, latency, score)
+        finally:
+            if original > 0:
+                session.configure(ps_spi_bitrate, original)
+    table.save()
+    return results
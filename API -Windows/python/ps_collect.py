@@ -0,0 +1,128 @@
+#==========================================================================
+# Promira SPI Controller
+#--------------------------------------------------------------------------
+# Project : POC- SPI Controller
+# File    : ps_collect.py
+#--------------------------------------------------------------------------
+# Drain a promact_is collect handle in one call
+#--------------------------------------------------------------------------
+# collect_all replaces the per-script dev_collect loops: it walks every
+# command response of a submitted queue, places all read data in one
+# contiguous buffer and returns a compact per-command table.
+#==========================================================================
+
+
+#==========================================================================
+# IMPORTS
+#==========================================================================
+from __future__ import division, with_statement, print_function
+from array import array
+
+from promact_is_py import *
+
+
+#==========================================================================
+# CONSTANTS
+#==========================================================================
+# Columns of a collect table row
+COLLECT_TYPE   = 0
+COLLECT_RESULT = 1
+COLLECT_LENGTH = 2
+COLLECT_OFFSET = 3
+
+# Bytes of the widest SPI word (32 bits)
+MAX_WORD_BYTES = 4
+
+# Collect errors after which no further responses will arrive
+COLLECT_FATAL = ( PS_APP_INVALID_HANDLE,
+                  PS_APP_CONNECTION_LOST,
+                  PS_APP_TIMEOUT,
+                  PS_APP_NO_MORE_QUEUES_TO_COLLECT )
+
+
+#==========================================================================
+# FUNCTIONS
+#==========================================================================
+def collect_all (collect, out = None, skip = (), timeout = -1, offset = 0):
+    """
+    Drain every command response of a collect handle.
+
+    Read data of each PS_SPI_CMD_READ response is written back to back
+    into one buffer.  If out is None a new array('B') is grown to fit
+    and returned; otherwise the data is written into the writable
+    buffer out starting at offset and a memoryview of the filled part
+    is returned.  Reads that do not fit in out are truncated.
+
+    Responses whose index (0-based, counting every command in the
+    queue) is in skip are acknowledged but their data is discarded,
+    e.g. the command/address echo of a flash read.
+
+    Returns (data, table) where table holds one row per command:
+    (type, result, length, offset).  offset is the position of the
+    command's data in the buffer, or -1 if nothing was stored.  Error
+    codes appear in the type column; a negative collect handle yields
+    a single error row.
+    """
+    table = [ ]
+    if out is None:
+        data = array('B')
+        start = 0
+    else:
+        data = out
+        start = offset
+    pos = start
+
+    if collect < 0:
+        table.append((collect, 0, 0, -1))
+        return (_result(data, out, start, pos), table)
+
+    collect_resp = ps_collect_resp
+    read_into    = ps_collect_spi_read_into
+    append       = table.append
+    skip         = skip and frozenset(skip) or ()
+    grow         = out is None
+    index        = 0
+
+    while True:
+        t, length, result = collect_resp(collect, timeout)
+        if t == PS_APP_NO_MORE_CMDS_TO_COLLECT:
+            break
+
+        if t != PS_SPI_CMD_READ or index in skip:
+            append((t, result, length, -1))
+            if t in COLLECT_FATAL:
+                break
+            index += 1
+            continue
+
+        # Responses count words, and the word size is only known once
+        # the data is read: leave room for the widest words.
+        size = (result if result >= length else length) * MAX_WORD_BYTES
+        if grow:
+            data.frombytes(bytes(size))
+        ret, word_size = read_into(collect, data, pos, size)
+        if ret < 0:
+            append((ret, result, length, -1))
+        else:
+            # ret counts words; wider words take several bytes each
+            nbytes = min(size, ret * ((word_size + 7) // 8 or 1))
+            append((t, result, nbytes, pos))
+            pos += nbytes
+        if grow and pos != len(data):
+            del data[pos:]
+        index += 1
+
+    return (_result(data, out, start, pos), table)
+
+def _result (data, out, start, end):
+    if out is None:
+        return data
+    return memoryview(out)[start:end]
+
+def collect_errors (table):
+    """Return the rows of a collect table that carry an error code."""
+    return [ row for row in table if row[COLLECT_TYPE] < 0 ]
+
+def collect_print_errors (table):
+    for row in collect_errors(table):
+        print(ps_app_status_string(row[COLLECT_TYPE]))
@@ -0,0 +1,233 @@
+#==========================================================================
+# Promira SPI Controller
+#--------------------------------------------------------------------------
+# Project : POC- SPI Controller
+# File    : ps_discovery.py
+#--------------------------------------------------------------------------
+# Cached Promira device discovery indexed by unique ID and IP
+#--------------------------------------------------------------------------
+# DiscoveryCache runs pm_find_devices_ext only when its results are
+# older than the TTL, growing the result arrays to however many devices
+# answer.  Results can be kept in an on-disk snapshot so a new process
+# starts from the last known addresses and only checks that the cached
+# IP still answers with the expected unique ID.  Installed applications
+# are listed only when asked for.
+#==========================================================================
+
+
+#==========================================================================
+# IMPORTS
+#==========================================================================
+from __future__ import division, with_statement, print_function
+import json
+import os
+import threading
+import time
+
+from promira_py import *
+
+
+#==========================================================================
+# CONSTANTS
+#==========================================================================
+DISCOVERY_TTL      = 30.0
+DISCOVERY_MIN      = 16
+DISCOVERY_SNAPSHOT = os.path.join(os.path.expanduser('~'),
+                                  '.promira_discovery.json')
+
+
+#==========================================================================
+# HELPER FUNCTIONS
+#==========================================================================
+def ip_string (ip):
+    return "%u.%u.%u.%u" % (ip & 0xff, ip >> 8 & 0xff,
+                            ip >> 16 & 0xff, ip >> 24 & 0xff)
+
+def find_devices (size = DISCOVERY_MIN):
+    """
+    pm_find_devices_ext with arrays grown to fit every device found.
+    Returns a list of (ip, unique_id, status) tuples.
+    """
+    while True:
+        (num, ips, unique_ids, statuses) = \
+            pm_find_devices_ext(size, size, size)
+        if num <= size:
+            break
+        size = num
+    num = max(0, min(num, len(ips)))
+    return [ (ips[i], unique_ids[i], statuses[i]) for i in range(num) ]
+
+def find_ip (unique_id):
+    """Return the IP string of the device with this unique ID, or None."""
+    for ip, uid, status in find_devices():
+        if uid == unique_id:
+            return ip_string(ip)
+    return None
+
+
+#==========================================================================
+# CLASSES
+#==========================================================================
+class PromiraDevice:
+    def __init__ (self, ip, unique_id, status, seen):
+        self.ip        = ip
+        self.ip_str    = ip_string(ip)
+        self.unique_id = unique_id
+        self.status    = status
+        self.seen      = seen
+        self.apps      = None
+
+    def is_free (self):
+        return not self.status & PM_DEVICE_NOT_FREE
+
+    def serial (self):
+        return "%04d-%06d" % (self.unique_id // 1000000,
+                              self.unique_id % 1000000)
+
+class DiscoveryCache:
+    """
+    Promira discovery results, refreshed at most once per ttl seconds.
+
+    snapshot is a JSON file path (or None) used to persist results
+    between runs; entries loaded from it count as stale and are
+    re-checked with verify() before use.
+    """
+    def __init__ (self, ttl = DISCOVERY_TTL, snapshot = None):
+        self.ttl       = ttl
+        self.snapshot  = snapshot
+        self.refreshed = 0
+        self._by_id    = { }
+        self._by_ip    = { }
+        self._lock     = threading.RLock()
+        if snapshot:
+            self.load()
+
+    #----------------------------------------------------------------------
+    # Discovery
+    #----------------------------------------------------------------------
+    def fresh (self):
+        return time.time() - self.refreshed < self.ttl
+
+    def refresh (self):
+        with self._lock:
+            now = time.time()
+            apps = dict((uid, dev.apps) for uid, dev in self._by_id.items())
+            self._by_id = { }
+            self._by_ip = { }
+            for ip, uid, status in find_devices(max(DISCOVERY_MIN,
+                                                    len(apps))):
+                dev = PromiraDevice(ip, uid, status, now)
+                dev.apps = apps.get(uid)
+                self._add(dev)
+            self.refreshed = now
+            if self.snapshot:
+                self.save()
+
+    def _add (self, dev):
+        self._by_id[dev.unique_id] = dev
+        self._by_ip[dev.ip_str]    = dev
+
+    def devices (self):
+        with self._lock:
+            if not self.fresh():
+                self.refresh()
+            return sorted(self._by_id.values(), key = lambda d: d.unique_id)
+
+    def by_unique_id (self, unique_id):
+        with self._lock:
+            if not self.fresh():
+                self.refresh()
+            return self._by_id.get(unique_id)
+
+    def by_ip (self, ip):
+        with self._lock:
+            if not isinstance(ip, str):
+                ip = ip_string(ip)
+            if not self.fresh():
+                self.refresh()
+            return self._by_ip.get(ip)
+
+    #----------------------------------------------------------------------
+    # Fast path
+    #----------------------------------------------------------------------
+    def verify (self, unique_id):
+        """
+        Check that the cached IP of unique_id still answers with that
+        unique ID, without a network-wide discovery.
+        """
+        with self._lock:
+            dev = self._by_id.get(unique_id)
+        if dev is None:
+            return False
+        pm = pm_open(dev.ip_str)
+        if pm <= 0:
+            return False
+        ok = pm_unique_id(pm) == unique_id
+        pm_close(pm)
+        if ok:
+            dev.seen = time.time()
+        return ok
+
+    def resolve (self, unique_id):
+        """
+        Return the IP string of unique_id: from the cache while fresh,
+        from a verified stale or snapshot entry, or else from a full
+        rediscovery.  None if the device is not found.
+        """
+        with self._lock:
+            dev = self._by_id.get(unique_id)
+            if dev is not None and self.fresh():
+                return dev.ip_str
+        if dev is not None and self.verify(unique_id):
+            return dev.ip_str
+        dev = self.by_unique_id(unique_id)
+        if dev is None and self.fresh() and self.refreshed:
+            return None
+        return dev and dev.ip_str
+
+    def apps (self, unique_id):
+        """Installed applications of a device, listed on first request."""
+        with self._lock:
+            dev = self._by_id.get(unique_id)
+        if dev is None:
+            return None
+        if dev.apps is None:
+            pm = pm_open(dev.ip_str)
+            if pm <= 0:
+                return None
+            data = pm_apps(pm, 1024)[1]
+            pm_close(pm)
+            dev.apps = ''.join([ chr(c) for c in data ])
+        return dev.apps
+
+    #----------------------------------------------------------------------
+    # Snapshot
+    #----------------------------------------------------------------------
+    def load (self):
+        try:
+            with open(self.snapshot) as f:
+                entries = json.load(f)['devices']
+        except (IOError, OSError, ValueError, KeyError):
+            return
+        with self._lock:
+            for e in entries:
+                dev = PromiraDevice(e['ip'], e['unique_id'], e['status'],
+                                    e['seen'])
+                dev.apps = e.get('apps')
+                self._add(dev)
+
+    def save (self):
+        with self._lock:
+            entries = [ { 'ip'        : dev.ip,
+                          'unique_id' : dev.unique_id,
+                          'status'    : dev.status,
+                          'seen'      : dev.seen,
+                          'apps'      : dev.apps }
+                        for dev in self._by_id.values() ]
+        tmp = self.snapshot + '.tmp'
+        try:
+            with open(tmp, 'w') as f:
+                json.dump({ 'devices' : entries }, f, indent = 1)
+            os.replace(tmp, self.snapshot)
+        except (IOError, OSError):
+            pass
@@ -0,0 +1,239 @@
+#==========================================================================
+# Promira SPI Controller
+#--------------------------------------------------------------------------
+# Project : POC- SPI Controller
+# File    : ps_dispatch.py
+#--------------------------------------------------------------------------
+# Thread-safe channel dispatcher with micro-batching and priorities
+#--------------------------------------------------------------------------
+# A ChannelDispatcher owns one channel and one queue.  Any thread may
+# hand it operations; a single worker thread executes them, so queue
+# building and collecting never interleave on the channel.  Small
+# operations of the same priority arriving within the batch window are
+# appended to one queue and sent with a single ps_queue_submit.
+#==========================================================================
+
+
+#==========================================================================
+# IMPORTS
+#==========================================================================
+from __future__ import division, with_statement, print_function
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import Future
+
+from promact_is_py import *
+from ps_collect import *
+
+
+#==========================================================================
+# CONSTANTS
+#==========================================================================
+# Priority classes; lower values are served first
+PRIORITY_HIGH   = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BULK   = 2
+
+BATCH_WINDOW_MS = 1
+MAX_BATCH       = 16
+
+
+#==========================================================================
+# CLASSES
+#==========================================================================
+class _Op:
+    def __init__ (self, priority, build, func, args, coalesce, skip):
+        self.priority = priority
+        self.build    = build
+        self.func     = func
+        self.args     = args
+        self.coalesce = coalesce and build is not None
+        self.skip     = skip
+        self.future   = Future()
+
+class ChannelDispatcher:
+    """
+    Serialize and batch operations on one channel.
+
+    submit(build) queues an operation whose build(queue) callable
+    appends its commands to a queue handle (it must only append, and
+    may be called again if another operation in the same batch fails to
+    build).  The returned Future resolves to (data, table) as from
+    collect_all, restricted to that operation's commands: data holds
+    only its read bytes and table offsets are relative to data.  If
+    collecting stopped before an operation's commands, its table ends
+    in a PS_APP_COMMUNICATION_ERROR row.
+
+    run(func, *args) executes any other channel call, e.g.
+    ps_spi_bitrate, on the worker in priority order.
+
+    Operations of the same priority that arrive within batch_window_ms
+    of each other are coalesced, up to max_batch per submit.  Pass
+    coalesce=False for large transfers that should go out alone.
+    """
+    def __init__ (self, conn, channel, module = PS_MODULE_ID_SPI_ACTIVE,
+                  batch_window_ms = BATCH_WINDOW_MS, max_batch = MAX_BATCH):
+        self.channel   = channel
+        self.window    = batch_window_ms / 1000
+        self.max_batch = max(1, max_batch)
+        self.batches   = 0
+        self.ops       = 0
+
+        self._queue  = ps_queue_create(conn, module)
+        self._heap   = [ ]
+        self._seq    = itertools.count()
+        self._cond   = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target = self._worker,
+                                        name = 'promira-dispatch',
+                                        daemon = True)
+        self._thread.start()
+
+    def __enter__ (self):
+        return self
+
+    def __exit__ (self, exc_type, exc, tb):
+        self.close()
+
+    #----------------------------------------------------------------------
+    # Producer side
+    #----------------------------------------------------------------------
+    def submit (self, build, priority = PRIORITY_NORMAL, coalesce = True,
+                skip = ()):
+        return self._put(_Op(priority, build, None, (), coalesce, skip))
+
+    def run (self, func, *args, **kwargs):
+        priority = kwargs.pop('priority', PRIORITY_NORMAL)
+        return self._put(_Op(priority, None, func, args, False, ()))
+
+    def call (self, build, priority = PRIORITY_NORMAL, coalesce = True,
+              skip = ()):
+        """Blocking form of submit()."""
+        return self.submit(build, priority, coalesce, skip).result()
+
+    def _put (self, op):
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("dispatcher is closed")
+            heapq.heappush(self._heap, (op.priority, next(self._seq), op))
+            self._cond.notify()
+        return op.future
+
+    def close (self):
+        """Finish queued operations, stop the worker and free the queue."""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+        ps_queue_destroy(self._queue)
+
+    #----------------------------------------------------------------------
+    # Worker side
+    #----------------------------------------------------------------------
+    def _next_batch (self):
+        with self._cond:
+            while not self._heap and not self._closed:
+                self._cond.wait()
+            if not self._heap:
+                return None
+
+            first = heapq.heappop(self._heap)[2]
+            batch = [ first ]
+            if not first.coalesce:
+                return batch
+
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                if self._heap:
+                    top = self._heap[0][2]
+                    if top.priority != first.priority or not top.coalesce:
+                        break
+                    batch.append(heapq.heappop(self._heap)[2])
+                    continue
+                left = deadline - time.monotonic()
+                if left <= 0 or self._closed:
+                    break
+                self._cond.wait(left)
+            return batch
+
+    def _worker (self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            batch = [ op for op in batch
+                      if op.future.set_running_or_notify_cancel() ]
+            if not batch:
+                continue
+            try:
+                if batch[0].func is not None:
+                    op = batch[0]
+                    op.future.set_result(op.func(*op.args))
+                else:
+                    self._execute(batch)
+            except BaseException as e:
+                for op in batch:
+                    if not op.future.done():
+                        op.future.set_exception(e)
+
+    def _build (self, batch):
+        # Returns the number of commands each operation appended.
+        queue = self._queue
+        while batch:
+            ps_queue_clear(queue)
+            sizes = [ ]
+            for op in batch:
+                before = ps_queue_size(queue)
+                try:
+                    op.build(queue)
+                except Exception as e:
+                    op.future.set_exception(e)
+                    batch.remove(op)
+                    break
+                sizes.append(ps_queue_size(queue) - before)
+            else:
+                return sizes
+        return [ ]
+
+    def _execute (self, batch):
+        sizes = self._build(batch)
+        if not batch:
+            return
+
+        skip = set()
+        base = 0
+        for op, n in zip(batch, sizes):
+            skip.update(base + i for i in op.skip)
+            base += n
+
+        collect, _ = ps_queue_submit(self._queue, self.channel, 0)
+        data, table = collect_all(collect, None, skip)
+        self.batches += 1
+        self.ops     += len(batch)
+
+        if collect < 0:
+            for op in batch:
+                op.future.set_result((data[:0], table))
+            return
+
+        index = 0
+        for op, n in zip(batch, sizes):
+            rows = table[index:index + n]
+            index += n
+            stored = [ r for r in rows if r[COLLECT_OFFSET] >= 0 ]
+            if stored:
+                start = stored[0][COLLECT_OFFSET]
+                end   = stored[-1][COLLECT_OFFSET] + stored[-1][COLLECT_LENGTH]
+            else:
+                start = end = 0
+            rows = [ r if r[COLLECT_OFFSET] < 0 else
+                     r[:COLLECT_OFFSET] + (r[COLLECT_OFFSET] - start,)
+                     for r in rows ]
+            if len(rows) < n and not collect_errors(rows):
+                # Collecting stopped before this operation's commands
+                rows.append((PS_APP_COMMUNICATION_ERROR, 0, 0, -1))
+            op.future.set_result((data[start:end], rows))
@@ -0,0 +1,723 @@
+#==========================================================================
+# Promira SPI Controller
+#--------------------------------------------------------------------------
+# Project : POC- SPI Controller
+# File    : ps_flash.py
+#--------------------------------------------------------------------------
+# Batched SPI NOR flash page programming
+#--------------------------------------------------------------------------
+# PageProgrammer packs several pages into one queue: for each page a
+# write enable, the page program command and data, a delay of most of
+# the expected program time, then a few flag status reads spaced out
+# with ps_queue_spi_delay_ns.  The whole batch is one submit; the host
+# only looks at the collected status bytes.  The first status read
+# that shows the device ready bounds the page program time, and these
+# measurements, kept per device model in a FlashTiming table on disk,
+# set the delays and poll spacing of the next batches.
+#
+# If a page is still busy at its last status read, the commands queued
+# behind it were ignored by the device: the host waits for it to
+# finish and sends the rest of the batch again.
+#
+# program_diff reprograms only the sectors whose content changed.  It
+# hashes the image sector by sector as it streams, compares against
+# the hashes of what the device holds (read back, or cached in a
+# HashCache from the last image written) and erases and programs just
+# the sectors that differ, with the erase commands plan_erase picks for
+# each 64K group.  Pages that are all 0xFF are never sent.
+#
+# plan_erase covers a set of address ranges with the fastest mix of
+# the device's erase units (4K/32K/64K sectors, dies, the whole chip)
+# that erases nothing outside the 4K blocks the ranges touch, using
+# the learned erase times; erase_ranges runs such a plan.
+#==========================================================================
+
+
+#==========================================================================
+# IMPORTS
+#==========================================================================
+from __future__ import division, with_statement, print_function
+import hashlib
+import json
+import os
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import deque
+
+from promact_is_py import *
+from ps_collect import *
+
+
+#==========================================================================
+# CONSTANTS
+#==========================================================================
+FLASH_TIMING_FILE = os.path.join(os.path.expanduser('~'),
+                                 '.promira_flash_timing.json')
+FLASH_HASH_FILE   = os.path.join(os.path.expanduser('~'),
+                                 '.promira_flash_hashes.json')
+
+CMD_WREN         = 0x06
+CMD_FLAG_STATUS  = 0x70
+CMD_CLEAR_FLAGS  = 0x50
+
+FLAG_READY       = 0x80
+FLAG_ERRORS      = 0x32      # erase, program and protection errors
+
+PROGRAM_BATCH    = 16        # pages per submit
+PAGE_SIZE        = 256
+DEFAULT_PAGE_US  = 500       # page program time before any measurement
+DIFF_GROUP_MAX   = 64 * 1024 # program_diff buffers and plans this much
+
+# Sector erases: size -> (command, timing operation, typical us,
+# timeout s, takes an address)
+ERASE_SECTOR = {
+    4 * 1024  : (0x20, 'erase_4k',  250000, 1.0, True),
+    32 * 1024 : (0x52, 'erase_32k', 400000, 2.0, True),
+    64 * 1024 : (0xD8, 'erase_64k', 700000, 4.0, True),
+}
+
+# Sector sizes most parts support
+ERASE_SECTORS    = ( 4 * 1024, 64 * 1024 )
+
+CMD_DIE_ERASE    = 0xC4
+CMD_BULK_ERASE   = 0xC7
+ERASE_US_PER_MB  = 10000000  # die and bulk erase before any measurement
+ERASE_TIMEOUT    = 3         # host wait, multiple of the typical time
+ERASE_OVERHEAD_US = 1000     # submit and collect of one erase queue
+
+POLL_START       = 0.75      # first status read at this share of typical
+POLL_MARGIN      = 1.2       # last status read at this multiple of worst
+POLL_SPAN        = 2.0       # worst case before any measurement, x typical
+POLL_MIN_US      = 10
+POLL_COUNT       = 8         # status reads per page
+WAIT_TIMEOUT     = 1.0       # host wait for a page still busy, seconds
+HOST_POLL_US     = 1000000   # longer erases are polled from the host
+
+TIMING_HISTORY   = 32        # measurements kept per device and operation
+TIMING_PERCENT   = 90        # the typical time is this percentile
+TIMING_WORST     = 8         # the worst time is the maximum of the last few
+
+
+#==========================================================================
+# HELPER FUNCTIONS
+#==========================================================================
+def addr_bytes (addr, addr_size):
+    """addr as addr_size bytes, most significant first."""
+    return [ (addr >> (8 * i)) & 0xff for i in range(addr_size - 1, -1, -1) ]
+
+def is_blank (data):
+    """True if data is all 0xFF, i.e. programming it changes nothing."""
+    return not bytes(data).translate(None, b'\xff')
+
+def sector_hash (data, sector_size):
+    """Digest of one sector; a short sector is padded with 0xFF."""
+    h = hashlib.blake2b(digest_size = 16)
+    h.update(data)
+    if len(data) < sector_size:
+        h.update(b'\xff' * (sector_size - len(data)))
+    return h.hexdigest()
+
+def sector_hashes (data, sector_size):
+    """sector_hash of every sector of data."""
+    view = memoryview(data)
+    return [ sector_hash(view[i:i + sector_size], sector_size)
+             for i in range(0, len(view), sector_size) ]
+
+def erase_units (device_size, sectors = ERASE_SECTORS, die_size = 0):
+    """
+    Erase units of a device, { size : ERASE_SECTOR style entry }: the
+    given sector sizes, die erase if die_size is set (multi-die parts),
+    otherwise bulk erase of the whole chip.
+    """
+    units = dict((size, ERASE_SECTOR[size]) for size in sectors)
+    if die_size:
+        typical = die_size * ERASE_US_PER_MB // (1024 * 1024)
+        units[die_size] = (CMD_DIE_ERASE, 'erase_die', typical,
+                           typical * ERASE_TIMEOUT / 1e6, True)
+    else:
+        typical = device_size * ERASE_US_PER_MB // (1024 * 1024)
+        units[device_size] = (CMD_BULK_ERASE, 'erase_bulk', typical,
+                              typical * ERASE_TIMEOUT / 1e6, False)
+    return units
+
+def plan_erase (ranges, sizes, cost, device_size):
+    """
+    Choose erase commands covering ranges, a list of (start, end)
+    byte ranges with end exclusive.  sizes are the erase unit sizes,
+    each dividing the next; cost(size) is the expected time of one
+    erase of that size.  Every block of the smallest size that a range
+    touches is erased and nothing else; a larger unit is used where
+    all its blocks are to be erased and it is faster than its parts.
+    Returns (plan, time) with plan a list of (addr, size) in address
+    order.
+    """
+    sizes = sorted(sizes)
+    units = set(sizes)
+    small = sizes[0]
+    for a, b in zip(sizes, sizes[1:]):
+        if b % a:
+            raise ValueError("erase size %d is not a multiple of %d" % (b, a))
+    if sizes[-1] < device_size:
+        sizes.append(device_size)        # root only, never erased whole
+
+    # Sorted indices of the smallest blocks to erase
+    blocks = set()
+    for start, end in ranges:
+        start = max(0, start)
+        end   = min(device_size, end)
+        blocks.update(range(start // small, (end + small - 1) // small))
+    blocks = sorted(blocks)
+
+    def count (addr, size):
+        return bisect_left(blocks, (addr + size) // small) - \
+               bisect_left(blocks, addr // small)
+
+    def best (addr, level):
+        size = sizes[level]
+        needed = count(addr, size)
+        if not needed:
+            return (0, [ ])
+        if level == 0:
+            return (cost(size), [ (addr, size) ])
+        total, plan = 0, [ ]
+        child = sizes[level - 1]
+        for sub in range(addr, addr + size, child):
+            t, p = best(sub, level - 1)
+            total += t
+            plan  += p
+        if size in units and needed * small == size and cost(size) < total:
+            return (cost(size), [ (addr, size) ])
+        return (total, plan)
+
+    total, plan = 0, [ ]
+    top = sizes[-1]
+    for addr in range(0, device_size, top):
+        t, p = best(addr, len(sizes) - 1)
+        total += t
+        plan  += p
+    return (plan, total)
+
+
+#==========================================================================
+# CLASSES
+#==========================================================================
+class FlashTiming:
+    """
+    Measured operation times per device model, stored as JSON:
+
+        { "<device>": { "<operation>": { "typical_us": t,
+                                         "max_us":     m,
+                                         "samples":    n } } }
+
+    record() adds a measurement, typical() returns the TIMING_PERCENT
+    percentile of the recent ones and worst() their maximum, or the
+    stored values before any.  The maximum only covers the last few
+    measurements, so it recovers from early overestimates.
+    """
+    def __init__ (self, path = FLASH_TIMING_FILE):
+        self.path    = path
+        self.entries = { }
+        self._recent = { }
+        self._counts = { }
+        self._lock   = threading.Lock()
+        self.load()
+
+    def load (self):
+        try:
+            with open(self.path) as f:
+                self.entries = json.load(f)
+        except (IOError, OSError, ValueError):
+            self.entries = { }
+
+    def save (self):
+        with self._lock:
+            for (device, op), samples in self._recent.items():
+                entry = self.entries.setdefault(device, { }) \
+                                    .setdefault(op, { 'samples' : 0 })
+                entry['typical_us'] = round(self._percentile(samples), 1)
+                entry['max_us']     = round(max(samples), 1)
+                entry['samples']   += self._counts.pop((device, op), 0)
+            text = json.dumps(self.entries, indent = 1, sort_keys = True)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(text)
+        os.replace(tmp, self.path)
+
+    def _percentile (self, samples):
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1,
+                           len(ordered) * TIMING_PERCENT // 100)]
+
+    def record (self, device, op, us):
+        with self._lock:
+            key = (device, op)
+            if key not in self._recent:
+                self._recent[key] = deque(maxlen = TIMING_HISTORY)
+            self._recent[key].append(us)
+            self._counts[key] = self._counts.get(key, 0) + 1
+
+    def typical (self, device, op, default = None):
+        """Typical time of op in microseconds, default if unknown."""
+        with self._lock:
+            samples = self._recent.get((device, op))
+            if samples:
+                return self._percentile(samples)
+            entry = self.entries.get(device, { }).get(op)
+        return entry['typical_us'] if entry else default
+
+    def worst (self, device, op, default = None):
+        """Longest of the last TIMING_WORST times of op in microseconds."""
+        with self._lock:
+            samples = self._recent.get((device, op))
+            if samples:
+                return max(list(samples)[-TIMING_WORST:])
+            entry = self.entries.get(device, { }).get(op)
+        return entry['max_us'] if entry else default
+
+class HashCache:
+    """
+    Sector hashes of the image last written to each device, stored as
+    JSON: { "<key>": { "sector": size, "size": device size,
+    "hashes": [ digest, ... ] } }.  key identifies the flash, e.g. its
+    model and its factory unique ID; None digests are sectors of
+    unknown content.
+
+    The hashes only describe the device while nothing else writes it:
+    another programming tool makes them stale, so spot-check the
+    device before trusting an entry.
+    """
+    def __init__ (self, path = FLASH_HASH_FILE):
+        self.path    = path
+        self.entries = { }
+        self._lock   = threading.Lock()
+        self.load()
+
+    def load (self):
+        try:
+            with open(self.path) as f:
+                self.entries = json.load(f)
+        except (IOError, OSError, ValueError):
+            self.entries = { }
+
+    def save (self):
+        with self._lock:
+            text = json.dumps(self.entries, indent = 1, sort_keys = True)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(text)
+        os.replace(tmp, self.path)
+
+    def get (self, key, sector_size, size = None):
+        """
+        The cached hashes, None if unknown, for another sector size or
+        for a device of another size.
+        """
+        with self._lock:
+            entry = self.entries.get(key)
+        if entry and entry['sector'] == sector_size and \
+           entry.get('size') == size:
+            return entry['hashes']
+        return None
+
+    def set (self, key, sector_size, hashes, size = None):
+        with self._lock:
+            if hashes is None:
+                self.entries.pop(key, None)
+            else:
+                self.entries[key] = { 'sector' : sector_size,
+                                      'size'   : size,
+                                      'hashes' : list(hashes) }
+
+class ProgramStats:
+    """Totals of one PageProgrammer.program call."""
+    def __init__ (self):
+        self.pages   = 0
+        self.blank   = 0             # all-0xFF pages not sent
+        self.sectors = 0             # sectors compared by program_diff
+        self.erased  = 0             # sectors erased by program_diff
+        self.batches = 0
+        self.waits   = 0             # pages still busy at the last poll
+        self.resent  = 0             # pages sent again after a wait
+        self.failed  = [ ]           # (addr, flag status) of failed pages
+        self.errors  = [ ]           # collect rows with error codes
+        self.seconds = 0.0
+
+    def report (self):
+        text = "%d pages in %d batches, %.3f s" % \
+            (self.pages, self.batches, self.seconds)
+        if self.seconds:
+            text += ", %.1f KB/s" % (self.pages * 256 / 1024 / self.seconds)
+        if self.blank:
+            text += ", %d blank pages skipped" % self.blank
+        if self.sectors:
+            text += ", %d of %d sectors changed" % (self.erased, self.sectors)
+        if self.waits:
+            text += ", %d waits, %d pages resent" % (self.waits, self.resent)
+        if self.failed:
+            text += ", %d pages failed" % len(self.failed)
+        if self.errors:
+            text += ", %d errors" % len(self.errors)
+        return text
+
+class PageProgrammer:
+    """
+    Program pages of an SPI NOR flash in batches of `batch` pages.
+
+    device names the model in the timing table.  cmd_write is the page
+    program command for io (e.g. 0x02, 0xA2, 0x32); addr_size is the
+    number of address bytes.  bitrate_khz is used to account for the
+    length of the status reads in the measurements.  units are the
+    erase units as from erase_units(), ERASE_SECTORS by default.
+    """
+    def __init__ (self, channel, queue, device, addr_size,
+                  io = PS_SPI_IO_STANDARD, cmd_write = 0x02,
+                  batch = PROGRAM_BATCH, timing = None, ss_mask = 1,
+                  bitrate_khz = 40000, units = None):
+        self.channel   = channel
+        self.queue     = queue
+        self.device    = device
+        self.addr_size = addr_size
+        self.io        = io
+        self.cmd_write = cmd_write
+        self.batch     = max(1, batch)
+        self.timing    = timing or FlashTiming()
+        self.ss_mask   = ss_mask
+        self.poll_us   = 16 * 1000 / bitrate_khz
+        self.units     = units or dict((size, ERASE_SECTOR[size])
+                                       for size in ERASE_SECTORS)
+        self._index    = 0
+
+    def _queue_cmd (self, data, io = PS_SPI_IO_STANDARD):
+        # SS-framed write; returns the queue index of the write
+        queue = self.queue
+        ps_queue_spi_ss(queue, self.ss_mask)
+        ps_queue_spi_write(queue, io, 8, len(data), data)
+        ps_queue_spi_ss(queue, 0)
+        self._index += 3
+        return self._index - 2
+
+    def _queue_page (self, addr, data):
+        queue = self.queue
+        self._queue_cmd(array('B', [ CMD_WREN ]))
+        head = array('B', [ self.cmd_write ] +
+                     addr_bytes(addr, self.addr_size))
+        ps_queue_spi_ss(queue, self.ss_mask)
+        ps_queue_spi_write(queue, PS_SPI_IO_STANDARD, 8, len(head), head)
+        ps_queue_spi_write(queue, self.io, 8, len(data), data)
+        ps_queue_spi_ss(queue, 0)
+        self._index += 4
+
+    def _queue_delay (self, us):
+        # The SPI delay is a u32 in ns; die and bulk erases wait longer
+        if us >= 1000000:
+            ps_queue_delay_ms(self.queue, int(us // 1000))
+        else:
+            ps_queue_spi_delay_ns(self.queue, int(us * 1000))
+        self._index += 1
+
+    def schedule (self, op = 'page', default = DEFAULT_PAGE_US):
+        """
+        (delay_us, interval_us, polls) of the status reads for op.  The
+        device runs every queued read even once it is ready, so the
+        reads span from most of the typical time to just past the
+        worst one seen.
+        """
+        typical  = max(POLL_MIN_US,
+                       self.timing.typical(self.device, op, default))
+        worst    = self.timing.worst(self.device, op, typical * POLL_SPAN)
+        delay    = typical * POLL_START
+        end      = max(typical, worst) * POLL_MARGIN
+        interval = max(POLL_MIN_US, (end - delay) / (POLL_COUNT - 1))
+        polls    = int((end - delay) // interval) + 1
+        return (delay, interval, max(1, min(POLL_COUNT, polls)))
+
+    def command (self, data):
+        """Send one SS-framed command now; returns the bytes read."""
+        ps_queue_clear(self.queue)
+        self._index = 0
+        self._queue_cmd(array('B', data))
+        collect, _ = ps_queue_submit(self.queue, self.channel, 0)
+        data_in, table = collect_all(collect)
+        return data_in
+
+    def wait_ready (self, timeout = WAIT_TIMEOUT):
+        """
+        Poll the flag status from the host until the device is ready.
+        Returns (flag status, seconds waited); status is 0 on timeout.
+        """
+        start = time.perf_counter()
+        while time.perf_counter() - start < timeout:
+            data_in = self.command([ CMD_FLAG_STATUS, 0x00 ])
+            if data_in and data_in[-1] & FLAG_READY:
+                return (data_in[-1], time.perf_counter() - start)
+        return (0, time.perf_counter() - start)
+
+    def _check (self, addr, status, stats):
+        if status & FLAG_ERRORS:
+            stats.failed.append((addr, status))
+            self.command([ CMD_CLEAR_FLAGS ])
+
+    def _queue_polls (self, delay, interval, polls):
+        # Delay then status reads; returns their queue indices
+        status_cmd = array('B', [ CMD_FLAG_STATUS, 0x00 ])
+        self._queue_delay(delay)
+        reads = [ ]
+        for i in range(polls):
+            if i:
+                self._queue_delay(interval)
+            reads.append(self._queue_cmd(status_cmd))
+        return reads
+
+    def _elapsed (self, delay, interval, i):
+        # Estimated time of an operation first seen ready at status read
+        # i: the middle of the span since the previous read
+        if i == 0:
+            return delay / 2
+        return delay + (i - 0.5) * (interval + self.poll_us)
+
+    def _first_ready (self, data, table, reads):
+        # (poll index, flag status) of the first ready read, or None
+        for i, index in enumerate(reads):
+            row = table[index]
+            if row[COLLECT_OFFSET] < 0 or not row[COLLECT_LENGTH]:
+                continue
+            status = data[row[COLLECT_OFFSET] + row[COLLECT_LENGTH] - 1]
+            if status & FLAG_READY:
+                return (i, status)
+        return None
+
+    def _submit (self, keep, stats):
+        # Submit the queue, keeping only the data of the keep indices
+        skip = [ i for i in range(self._index) if i not in keep ]
+        collect, _ = ps_queue_submit(self.queue, self.channel, 0)
+        data, table = collect_all(collect, None, skip)
+        stats.batches += 1
+
+        errors = collect_errors(table)
+        if errors or len(table) < self._index:
+            stats.errors.extend(errors or [ (PS_APP_COMMUNICATION_ERROR,
+                                             0, 0, -1) ])
+            return None
+        return (data, table)
+
+    def _erase_schedule (self, op, default):
+        # Queued reads cannot stop once the device is ready, which
+        # would waste seconds on die and bulk erases: those get one
+        # read after the delay and are then polled from the host
+        delay, interval, polls = self.schedule(op, default)
+        if delay >= HOST_POLL_US:
+            polls = 1
+        return (delay, interval, polls)
+
+    def erase_cost (self, size):
+        """Expected time in us of one erase of size, polls included."""
+        cmd, op, default, timeout, addressed = self.units[size]
+        delay, interval, polls = self._erase_schedule(op, default)
+        if polls == 1:
+            return max(delay, self.timing.typical(self.device, op, default)) \
+                + ERASE_OVERHEAD_US
+        return delay + (polls - 1) * (interval + self.poll_us) + \
+            ERASE_OVERHEAD_US
+
+    def erase (self, addr, size, stats):
+        """
+        Erase the unit of size bytes (a key of self.units) at addr and
+        wait for it, polling in the queue as for pages.  Returns True
+        on success.
+        """
+        cmd, op, default, timeout, addressed = self.units[size]
+        delay, interval, polls = self._erase_schedule(op, default)
+        ps_queue_clear(self.queue)
+        self._index = 0
+        self._queue_cmd(array('B', [ CMD_WREN ]))
+        if addressed:
+            self._queue_cmd(array('B', [ cmd ] +
+                                  addr_bytes(addr, self.addr_size)))
+        else:
+            self._queue_cmd(array('B', [ cmd ]))
+        reads = self._queue_polls(delay, interval, polls)
+
+        result = self._submit(set(reads), stats)
+        if result is None:
+            return False
+        ready = self._first_ready(result[0], result[1], reads)
+        if ready:
+            i, status = ready
+            self.timing.record(self.device, op,
+                               self._elapsed(delay, interval, i))
+        else:
+            status, waited = self.wait_ready(timeout)
+            if polls == 1:
+                elapsed = delay + waited * 1e6
+            else:
+                elapsed = self._elapsed(delay, interval, polls) + waited * 1e6
+            self.timing.record(self.device, op, elapsed)
+            stats.waits += 1
+            if not status:
+                stats.failed.append((addr, status))
+                return False
+        failed = len(stats.failed)
+        self._check(addr, status, stats)
+        return len(stats.failed) == failed
+
+    def erase_ranges (self, ranges, device_size):
+        """
+        Erase the (start, end) byte ranges with the plan from
+        plan_erase, one command at a time.  Returns (ProgramStats,
+        plan); stats.erased counts the erases done.
+        """
+        stats = ProgramStats()
+        plan, expected = plan_erase(ranges, self.units, self.erase_cost,
+                                    device_size)
+        start = time.perf_counter()
+        for addr, size in plan:
+            if not self.erase(addr, size, stats):
+                break
+            stats.erased += 1
+        stats.seconds = time.perf_counter() - start
+        self.timing.save()
+        return (stats, plan)
+
+    def _run_batch (self, batch, stats):
+        while batch:
+            delay, interval, polls = self.schedule()
+            ps_queue_clear(self.queue)
+            self._index = 0
+            polled = [ ]
+            for addr, data in batch:
+                self._queue_page(addr, data)
+                polled.append(self._queue_polls(delay, interval, polls))
+
+            # Only the status bytes are of interest
+            result = self._submit(set(i for reads in polled for i in reads),
+                                  stats)
+            if result is None:
+                return
+            data, table = result
+
+            done = 0
+            for (addr, _), reads in zip(batch, polled):
+                done += 1
+                ready = self._first_ready(data, table, reads)
+                if ready:
+                    i, status = ready
+                    self.timing.record(self.device, 'page',
+                                       self._elapsed(delay, interval, i))
+                    self._check(addr, status, stats)
+                else:
+                    # Still busy: the pages queued behind it were ignored
+                    status, waited = self.wait_ready()
+                    self.timing.record(self.device, 'page',
+                                       self._elapsed(delay, interval, polls) +
+                                       waited * 1e6)
+                    stats.waits += 1
+                    if not status:
+                        stats.failed.append((addr, status))
+                    else:
+                        self._check(addr, status, stats)
+                    break
+
+            stats.pages += done
+            batch = batch[done:]
+            stats.resent += len(batch)
+
+    def _program (self, pages, stats):
+        batch = [ ]
+        for addr, data in pages:
+            if is_blank(data):
+                stats.blank += 1
+                continue
+            batch.append((addr, bytes(data)))
+            if len(batch) == self.batch:
+                self._run_batch(batch, stats)
+                batch = [ ]
+                if stats.errors:
+                    return
+        if batch:
+            self._run_batch(batch, stats)
+
+    def program (self, pages):
+        """
+        Program pages, an iterable of (addr, data) with at most one page
+        of data each, as from ImageSource.pages.  All-0xFF pages are
+        skipped and the data of the others is copied as it is batched.
+        The timing table is saved at the end.  Returns a ProgramStats.
+        """
+        stats = ProgramStats()
+        start = time.perf_counter()
+        self._program(pages, stats)
+        stats.seconds = time.perf_counter() - start
+        self.timing.save()
+        return stats
+
+    def program_diff (self, pages, old_hashes, sector_size = 4 * 1024):
+        """
+        Program only the sectors of pages whose hash differs from
+        old_hashes, the sector_hashes of the device's current content.
+        pages run contiguously from address 0, as from
+        ImageSource.pages.  Changed sectors are erased first; with
+        old_hashes None every sector is.  The image is buffered one
+        group at a time, the largest erase unit up to DIFF_GROUP_MAX,
+        and the changed sectors of a group are erased with the plan
+        from plan_erase, so a group that changed completely takes one
+        large erase.  Returns (ProgramStats, hashes of the new image).
+        """
+        stats  = ProgramStats()
+        start  = time.perf_counter()
+        hashes = [ ]
+        sizes  = sorted(size for size, unit in self.units.items()
+                        if unit[4] and size <= DIFF_GROUP_MAX and
+                        size % sector_size == 0)
+        group  = sizes and sizes[-1] or sector_size
+        buf    = bytearray(group)
+        base   = None
+        fill   = 0
+
+        def flush ():
+            view = memoryview(buf)
+            changed = [ ]
+            for offset in range(0, fill, sector_size):
+                end = min(offset + sector_size, fill)
+                index = (base + offset) // sector_size
+                digest = sector_hash(view[offset:end], sector_size)
+                hashes.append(digest)
+                stats.sectors += 1
+                if old_hashes is None or index >= len(old_hashes) or \
+                   old_hashes[index] != digest:
+                    changed.append((offset, end))
+            if not changed:
+                return True
+            stats.erased += len(changed)
+
+            plan, _ = plan_erase([ (offset, offset + sector_size)
+                                   for offset, end in changed ],
+                                 sizes, self.erase_cost, group)
+            for addr, size in plan:
+                if not self.erase(base + addr, size, stats):
+                    return False
+            self._program(((base + i, view[i:min(i + PAGE_SIZE, end)])
+                           for offset, end in changed
+                           for i in range(offset, end, PAGE_SIZE)), stats)
+            return not stats.errors
+
+        for addr, data in pages:
+            if base is not None and addr >= base + group:
+                if not flush():
+                    break
+                base = None
+            if base is None:
+                base = addr - addr % group
+                buf[:] = b'\xff' * group
+                fill = 0
+            offset = addr - base
+            buf[offset:offset + len(data)] = data
+            fill = max(fill, offset + len(data))
+        else:
+            if base is not None:
+                flush()
+
+        stats.seconds = time.perf_counter() - start
+        self.timing.save()
+        return (stats, hashes)
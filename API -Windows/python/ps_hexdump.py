@@ -0,0 +1,103 @@
+#==========================================================================
+# Promira SPI Controller
+#--------------------------------------------------------------------------
+# Project : POC- SPI Controller
+# File    : ps_hexdump.py
+#--------------------------------------------------------------------------
+# Bulk hex dump of transaction data
+#--------------------------------------------------------------------------
+# Renders a whole buffer with one bytes.hex call and string slicing, in
+# the same 16-bytes-per-row layout the examples print byte by byte, and
+# writes it with a single stream write.  Summary and quiet modes and a
+# byte limit keep logging from slowing down an acquisition loop.
+#==========================================================================
+
+
+#==========================================================================
+# IMPORTS
+#==========================================================================
+from __future__ import division, with_statement, print_function
+import sys
+from array import array
+
+
+#==========================================================================
+# CONSTANTS
+#==========================================================================
+DUMP_FULL    = 0     # every byte, 16 per row
+DUMP_SUMMARY = 1     # byte count and the first few bytes
+DUMP_QUIET   = 2     # nothing
+
+SUMMARY_BYTES = 8
+
+
+#==========================================================================
+# FUNCTIONS
+#==========================================================================
+def _view (data):
+    if not isinstance(data, (bytes, bytearray, array, memoryview)):
+        data = bytes(data)
+    view = memoryview(data)
+    if view.format != 'B':
+        view = view.cast('B')
+    return view
+
+def hex_dump (data, addr = 0, width = 4, limit = None, mode = DUMP_FULL):
+    """
+    Return data (any byte buffer or list of ints) as dump text, rows
+    joined by newlines and no trailing newline:
+
+        0000:  00 01 02 03 04 05 06 07  08 09 0a 0b 0c 0d 0e 0f
+
+    Row addresses start at addr and have width hex digits.  At most
+    limit bytes are shown in DUMP_FULL mode; a final row counts the
+    rest.
+    """
+    if mode == DUMP_QUIET:
+        return ""
+    view = _view(data)
+    size = len(view)
+
+    if mode == DUMP_SUMMARY:
+        text = "%d bytes" % size
+        if size:
+            text += ": " + view[:SUMMARY_BYTES].hex(' ')
+        if size > SUMMARY_BYTES:
+            text += " ..."
+        return text
+
+    shown = size if limit is None else max(0, min(size, limit))
+    # Three characters per byte, "xx ", with an extra space after
+    # every eighth byte of a row
+    text = view[:shown].hex(' ') + ' '
+    row  = ("%%0%dx:  " % width) + "%s %s "
+    full = shown >> 4
+    rows = [ row % (addr + (r << 4), text[r * 48:r * 48 + 24],
+                    text[r * 48 + 24:r * 48 + 48])
+             for r in range(full) ]
+
+    rest = shown & 0xf
+    if rest:
+        i = full * 48
+        part = text[i:i + rest * 3]
+        if rest >= 8:
+            part = part[:24] + ' ' + part[24:]
+        rows.append(("%%0%dx:  " % width) % (addr + (full << 4)) + part)
+
+    if shown < size:
+        rows.append("... %d more bytes" % (size - shown))
+    return "\n".join(rows)
+
+def write_dump (header, data, addr = 0, width = 4, limit = None,
+                mode = DUMP_FULL, end = "\n\n", stream = None):
+    """
+    Write header, the dump of data on the following lines, and end,
+    in one write to stream (sys.stdout by default).  header may be
+    None.  Nothing is written in DUMP_QUIET mode.
+    """
+    if mode == DUMP_QUIET:
+        return
+    text = hex_dump(data, addr, width, limit, mode)
+    if header is not None:
+        text = header + (text and "\n" + text)
+    (stream or sys.stdout).write(text + end)
@@ -0,0 +1,156 @@
+#==========================================================================
+# Promira SPI Controller
+#--------------------------------------------------------------------------
+# Project : POC- SPI Controller
+# File    : ps_image.py
+#--------------------------------------------------------------------------
+# Streaming image source for flash programming
+#--------------------------------------------------------------------------
+# An ImageSource hands out an image page by page as memoryview slices,
+# whatever holds the image: a file path (memory-mapped), an open file,
+# a bytes-like object or mmap, or an iterator of byte chunks.  Buffers
+# are sliced without copying; files and iterators go through one
+# reused page buffer.  Memory use does not depend on the image size and
+# the first page is available at once.
+#
+# A page view is only valid until the next page is produced; the queue
+# functions copy the data, so it can be passed to ps_queue_spi_write
+# directly.
+#==========================================================================
+
+
+#==========================================================================
+# IMPORTS
+#==========================================================================
+from __future__ import division, with_statement, print_function
+import mmap
+from array import array
+
+
+#==========================================================================
+# CONSTANTS
+#==========================================================================
+PAGE_SIZE  = 256
+READ_CHUNK = 64 * 1024
+
+
+#==========================================================================
+# HELPER FUNCTIONS
+#==========================================================================
+def _view (data):
+    view = memoryview(data)
+    if view.format != 'B':
+        view = view.cast('B')
+    return view
+
+def pattern_chunks (size, chunk = READ_CHUNK):
+    """The examples' test image: byte n is n & 0xff, size bytes in all."""
+    block = bytes(range(256)) * (chunk // 256)
+    for offset in range(0, size, len(block)):
+        yield block[:size - offset]
+
+
+#==========================================================================
+# CLASSES
+#==========================================================================
+class ImageSource:
+    """
+    Page-wise access to an image.
+
+    source is a path, a binary file object, a bytes-like object, or an
+    iterable of bytes-like chunks of any size.  limit caps the number
+    of bytes used.  size is the image size when it is known up front,
+    None for an iterator.
+    """
+    def __init__ (self, source, limit = None):
+        self.limit = limit
+        self._map  = None
+        self._file = None
+        self._data = None
+        self._iter = None
+
+        if isinstance(source, str):
+            self._file = open(source, 'rb')
+            source = self._file
+
+        if hasattr(source, 'readinto'):
+            # Map real files; read anything else (pipes, empty or
+            # in-memory files) in chunks
+            try:
+                self._map = mmap.mmap(source.fileno(), 0,
+                                      access = mmap.ACCESS_READ)
+                self._data = _view(self._map)
+            except (AttributeError, OSError, ValueError):
+                self._iter = iter(lambda: source.read(READ_CHUNK), b'')
+        elif isinstance(source, (bytes, bytearray, memoryview, mmap.mmap,
+                                 array)) or hasattr(source, '__array__'):
+            self._data = _view(source)
+        else:
+            self._iter = iter(source)
+
+        self.size = None
+        if self._data is not None:
+            self.size = len(self._data)
+            if limit is not None:
+                self.size = min(self.size, limit)
+
+    def __enter__ (self):
+        return self
+
+    def __exit__ (self, exc_type, exc, tb):
+        self.close()
+
+    def close (self):
+        self._data = None
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                pass                # pages still in use; unmapped with them
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def pages (self, page_size = PAGE_SIZE):
+        """
+        Yield (offset, view) for every page of the image; the last page
+        may be short.
+        """
+        if self._data is not None:
+            data = self._data[:self.size]
+            for offset in range(0, len(data), page_size):
+                yield (offset, data[offset:offset + page_size])
+            return
+
+        page   = bytearray(page_size)
+        fill   = 0
+        offset = 0
+        limit  = self.limit
+        for chunk in self._iter:
+            if limit is not None and offset + fill >= limit:
+                break
+            chunk = _view(chunk)
+            pos = 0
+            while pos < len(chunk):
+                if limit is not None and offset + fill >= limit:
+                    break
+                if fill == 0 and len(chunk) - pos >= page_size and \
+                   (limit is None or offset + page_size <= limit):
+                    # Whole page inside the chunk, no copy needed
+                    yield (offset, chunk[pos:pos + page_size])
+                    pos    += page_size
+                    offset += page_size
+                    continue
+                n = min(page_size - fill, len(chunk) - pos)
+                if limit is not None:
+                    n = min(n, limit - offset - fill)
+                page[fill:fill + n] = chunk[pos:pos + n]
+                fill += n
+                pos  += n
+                if fill == page_size:
+                    yield (offset, memoryview(page))
+                    offset += page_size
+                    fill = 0
+        if fill:
+            yield (offset, memoryview(page)[:fill])
@@ -0,0 +1,140 @@
+#==========================================================================
+# Promira SPI Controller
+#--------------------------------------------------------------------------
+# Project : POC- SPI Controller
+# File    : ps_orchestrate.py
+#--------------------------------------------------------------------------
+# Run several controllers side by side
+#--------------------------------------------------------------------------
+# An Orchestrator opens, configures and drives a set of named
+# controllers, one worker thread per controller, so a dual-board test
+# takes as long as its slowest board rather than the sum of both.
+# Workers can wait on a barrier so all controllers start their
+# transaction lists together.  Every step reports a result, an error
+# and its timing per controller.
+#==========================================================================
+
+
+#==========================================================================
+# IMPORTS
+#==========================================================================
+from __future__ import division, with_statement, print_function
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from promact_is_py import *
+from ps_session import SessionManager, PromiraError
+from ps_profile import ProfileApplier
+
+
+#==========================================================================
+# CLASSES
+#==========================================================================
+class ControllerResult:
+    """Outcome of one step on one controller."""
+    def __init__ (self, name):
+        self.name    = name
+        self.result  = None
+        self.error   = None
+        self.start   = 0.0
+        self.seconds = 0.0
+
+    def ok (self):
+        return self.error is None
+
+class Orchestrator:
+    """
+    Parallel control of the controllers named in a profile.
+
+    profile maps names to settings as from ps_profile; each entry's
+    unique_id locates the controller through manager.  open_all()
+    opens and configures them, run() executes one job per controller.
+    A job is a callable job(session) or a list of transactions, each
+    a byte buffer (sent with session.transfer) or a callable.
+    """
+    def __init__ (self, profile, manager = None, applier = None):
+        self.profile  = profile
+        self.manager  = manager or SessionManager()
+        self.applier  = applier or ProfileApplier()
+        self.sessions = { }
+
+    def _parallel (self, names, work, align = False):
+        barrier = threading.Barrier(len(names)) if align else None
+        epoch   = time.perf_counter()
+
+        def worker (name):
+            res = ControllerResult(name)
+            try:
+                if barrier is not None:
+                    barrier.wait()
+                res.start = time.perf_counter() - epoch
+                res.result = work(name)
+            except Exception as e:
+                res.error = e
+                if barrier is not None:
+                    barrier.abort()
+            res.seconds = time.perf_counter() - epoch - res.start
+            return res
+
+        if not names:
+            return { }
+        with ThreadPoolExecutor(len(names)) as pool:
+            futures = [ pool.submit(worker, name) for name in names ]
+            return dict((f.result().name, f.result()) for f in futures)
+
+    def open_all (self, names = None):
+        """
+        Open and configure the named controllers (all by default).
+        Each result holds the profile applier's { step : result }.
+        """
+        names = list(names or sorted(self.profile))
+
+        def work (name):
+            settings = self.profile[name]
+            session  = self.manager.get(settings['unique_id'])
+            self.sessions[name] = session
+            return self.applier.apply(session, settings)
+
+        return self._parallel(names, work)
+
+    def run (self, jobs, align = False):
+        """
+        Run jobs[name] on every open controller named in jobs.  With
+        align set, all workers start at the same moment.  Each result
+        holds the job's return value, or the list of transfer results.
+        """
+        names = [ n for n in sorted(jobs) if n in self.sessions ]
+
+        def work (name):
+            session = self.sessions[name]
+            job = jobs[name]
+            if callable(job):
+                return job(session)
+            results = [ ]
+            for item in job:
+                if callable(item):
+                    results.append(item(session))
+                else:
+                    results.append(session.transfer(item))
+            return results
+
+        return self._parallel(names, work, align)
+
+    def close_all (self):
+        self.manager.close_all()
+        self.sessions.clear()
+
+    def report (self, results):
+        """One line per controller plus the overall wall time."""
+        lines = [ ]
+        for name, res in sorted(results.items()):
+            state = res.ok() and "ok" or "error: %s" % res.error
+            lines.append("%-8s %8.1f ms  %s" % (name, res.seconds * 1000,
+                                                 state))
+        if results:
+            total = max(r.start + r.seconds for r in results.values())
+            serial = sum(r.seconds for r in results.values())
+            lines.append("wall     %8.1f ms  (serial %.1f ms)" %
+                         (total * 1000, serial * 1000))
+        return "\n".join(lines)
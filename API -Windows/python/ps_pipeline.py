@@ -0,0 +1,112 @@
+#==========================================================================
+# Promira SPI Controller
+#--------------------------------------------------------------------------
+# Project : POC- SPI Controller
+# File    : ps_pipeline.py
+#--------------------------------------------------------------------------
+# Windowed asynchronous queue submission on one channel
+#--------------------------------------------------------------------------
+# Keeps up to `depth` queues outstanding with ps_queue_async_submit so
+# the bus stays busy while the host collects and builds the next queue.
+# Results are collected with ps_queue_async_collect and handed to a
+# consumer callback in submission order.
+#==========================================================================
+
+
+#==========================================================================
+# IMPORTS
+#==========================================================================
+from __future__ import division, with_statement, print_function
+from collections import deque
+
+from promact_is_py import *
+from ps_collect import collect_all
+
+
+#==========================================================================
+# CLASSES
+#==========================================================================
+class SubmitPipeline:
+    """
+    Submit queues asynchronously with at most `depth` in flight.
+
+    Each submission is tagged with a rolling u08 ctrl_id.  Async
+    collects come back in FIFO order, so the ctrl_id and the caller's
+    context are matched to results by position in the in-flight list.
+
+    Before each submit the pipeline blocks on the oldest outstanding
+    queue while the window is full, as seen both by this object and by
+    ps_channel_submitted_count.  After each submit, queues the channel
+    reports as completed (ps_channel_uncollected_count) are collected
+    without blocking.
+
+    consumer(context, data, table) receives the collect_all result of
+    every queue, in order.  A queue handle may be cleared and rebuilt
+    as soon as submit() returns.
+    """
+    def __init__ (self, channel, depth = 4, consumer = None, timeout = -1):
+        self.channel   = channel
+        self.depth     = max(1, depth)
+        self.consumer  = consumer
+        self.timeout   = timeout
+        self.submitted = 0
+        self.collected = 0
+        self._inflight = deque()
+        self._ctrl_id  = 0
+
+    def __enter__ (self):
+        return self
+
+    def __exit__ (self, exc_type, exc, tb):
+        self.flush()
+
+    def pending (self):
+        return len(self._inflight)
+
+    def submit (self, queue, context = None, out = None, skip = (),
+                offset = 0):
+        """
+        Submit queue asynchronously.  out, skip and offset are passed to
+        collect_all when the queue is collected.  Returns the ctrl_id
+        used, or a negative status code if the submit failed.
+        """
+        channel = self.channel
+        while self._inflight and \
+              (len(self._inflight) >= self.depth or
+               ps_channel_submitted_count(channel) >= self.depth):
+            self.collect_one()
+
+        ctrl_id = self._ctrl_id
+        ret = ps_queue_async_submit(queue, channel, ctrl_id)
+        if ret < 0:
+            return ret
+
+        self._ctrl_id = (ctrl_id + 1) & 0xff
+        self._inflight.append((ctrl_id, context, out, skip, offset))
+        self.submitted += 1
+
+        while self._inflight and ps_channel_uncollected_count(channel) > 0:
+            self.collect_one()
+        return ctrl_id
+
+    def collect_one (self):
+        """
+        Collect the oldest outstanding queue and deliver it to the
+        consumer.  Returns (ctrl_id, context, data, table), or None if
+        nothing is in flight.
+        """
+        if not self._inflight:
+            return None
+
+        ctrl_id, context, out, skip, offset = self._inflight.popleft()
+        collect, _ = ps_queue_async_collect(self.channel)
+        data, table = collect_all(collect, out, skip, self.timeout, offset)
+        self.collected += 1
+
+        if self.consumer:
+            self.consumer(context, data, table)
+        return (ctrl_id, context, data, table)
+
+    def flush (self):
+        while self._inflight:
+            self.collect_one()
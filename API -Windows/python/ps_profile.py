@@ -0,0 +1,192 @@
+#==========================================================================
+# Promira SPI Controller
+#--------------------------------------------------------------------------
+# Project : POC- SPI Controller
+# File    : ps_profile.py
+#--------------------------------------------------------------------------
+# Declarative controller profiles applied as minimal deltas
+#--------------------------------------------------------------------------
+# A profile names each controller and its SPI settings.  ProfileApplier
+# remembers what it last applied to each channel and only issues the
+# configuration calls whose values changed.  Controllers are separate
+# devices, so apply_all() configures them in parallel.
+#
+# Profile files are JSON or TOML (tomllib, or tomli before Python 3.11):
+#
+#   [defaults]
+#   app_config   = "SPI"
+#   target_power = "TARGET1_3V"
+#   level_shift  = 0.9
+#   word_delay   = 0
+#   mode         = 0
+#   bit_order    = "MSB"
+#   ss_polarity  = 0x00
+#   ss_enable    = 1
+#   bitrate_khz  = 1000
+#
+#   [controllers.north]
+#   unique_id    = 2416713000
+#
+#   [controllers.south]
+#   unique_id    = 2416711301
+#   bitrate_khz  = 8000
+#
+# Symbolic values are looked up in promact_is_py with the prefix given
+# in NAMED, e.g. "TARGET1_3V" is PS_PHY_TARGET_POWER_TARGET1_3V.
+#==========================================================================
+
+
+#==========================================================================
+# IMPORTS
+#==========================================================================
+from __future__ import division, with_statement, print_function
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import promact_is_py
+from promact_is_py import *
+
+try:
+    import tomllib
+except ImportError:
+    try:
+        import tomli as tomllib
+    except ImportError:
+        tomllib = None
+
+
+#==========================================================================
+# CONSTANTS
+#==========================================================================
+# Configuration steps in the order they are issued:
+# (step, profile keys, function called as func(channel, *values))
+SETTINGS = (
+    ('app_config',   ('app_config',),                    ps_app_configure),
+    ('target_power', ('target_power',),                  ps_phy_target_power),
+    ('level_shift',  ('level_shift',),                   ps_phy_level_shift),
+    ('delays',       ('word_delay',),                    ps_spi_configure_delays),
+    ('spi',          ('mode', 'bit_order', 'ss_polarity'), ps_spi_configure),
+    ('ss_enable',    ('ss_enable',),                     ps_spi_enable_ss),
+    ('bitrate',      ('bitrate_khz',),                   ps_spi_bitrate),
+)
+
+# Prefixes of the promact_is_py constants for values given by name
+NAMED = {
+    'app_config'   : 'PS_APP_CONFIG_',
+    'target_power' : 'PS_PHY_TARGET_POWER_',
+    'mode'         : 'PS_SPI_MODE_',
+    'bit_order'    : 'PS_SPI_BITORDER_',
+}
+
+
+#==========================================================================
+# FUNCTIONS
+#==========================================================================
+def _value (key, value):
+    if isinstance(value, str) and key in NAMED:
+        name = NAMED[key] + value.upper()
+        if not hasattr(promact_is_py, name):
+            raise ValueError("unknown %s value: %s" % (key, value))
+        return getattr(promact_is_py, name)
+    return value
+
+def profile_from_dict (data):
+    """
+    Resolve a parsed profile into { name : settings }.  Each
+    controller's settings are the defaults overridden by its own table,
+    with symbolic values replaced by their constants.
+    """
+    defaults    = data.get('defaults', { })
+    controllers = data.get('controllers', { })
+    profile = { }
+    for name, table in controllers.items():
+        settings = dict(defaults)
+        settings.update(table)
+        profile[name] = dict((k, _value(k, v)) for k, v in settings.items())
+    return profile
+
+def load_profile (path):
+    """Read a .toml or .json profile file and resolve it."""
+    if path.lower().endswith('.toml'):
+        if tomllib is None:
+            raise ImportError("reading %s needs tomllib or tomli" % path)
+        with open(path, 'rb') as f:
+            data = tomllib.load(f)
+    else:
+        with open(path) as f:
+            data = json.load(f)
+    return profile_from_dict(data)
+
+
+#==========================================================================
+# CLASSES
+#==========================================================================
+class ProfileApplier:
+    """
+    Apply controller settings, skipping values already in place.
+
+    A target is a PromiraSession, whose configure() records the call so
+    it is replayed after a reconnect, or a bare channel handle.  The
+    shadow of each target holds the values and results of the last
+    successful call per step; a failed call is left out so it is
+    retried next time.  Call forget(target) after closing a bare
+    channel, since its settings are lost with it.
+    """
+    def __init__ (self):
+        self._shadow = { }
+        self._lock   = threading.Lock()
+
+    def forget (self, target):
+        with self._lock:
+            self._shadow.pop(target, None)
+
+    def current (self, target, step):
+        """Result of the last successful call of step, or None."""
+        with self._lock:
+            last = self._shadow.get(target, { }).get(step)
+        return last and last[1]
+
+    def apply (self, target, settings):
+        """
+        Apply settings to one target.  Returns { step : result } for
+        every step named in settings, from the shadow when unchanged.
+        Steps whose keys are missing from settings are left alone.
+        """
+        with self._lock:
+            shadow = self._shadow.setdefault(target, { })
+        configure = getattr(target, 'configure', None)
+
+        results = { }
+        for step, keys, func in SETTINGS:
+            if not all(k in settings for k in keys):
+                continue
+            args = tuple(settings[k] for k in keys)
+            last = shadow.get(step)
+            if last is not None and last[0] == args:
+                results[step] = last[1]
+                continue
+
+            if configure is not None:
+                ret = configure(func, *args)
+            else:
+                ret = func(target, *args)
+            results[step] = ret
+            if ret >= 0:
+                shadow[step] = (args, ret)
+            else:
+                shadow.pop(step, None)
+        return results
+
+    def apply_all (self, targets, profile):
+        """
+        Apply profile[name] to targets[name] for every name in both,
+        one thread per controller.  Returns { name : results }.
+        """
+        names = [ n for n in targets if n in profile and targets[n] ]
+        if not names:
+            return { }
+        with ThreadPoolExecutor(len(names)) as pool:
+            futures = [ pool.submit(self.apply, targets[n], profile[n])
+                        for n in names ]
+            return dict(zip(names, [ f.result() for f in futures ]))
@@ -0,0 +1,416 @@
+#==========================================================================
+# Promira SPI Controller
+#--------------------------------------------------------------------------
+# Project : POC- SPI Controller
+# File    : ps_session.py
+#--------------------------------------------------------------------------
+# Cached Promira sessions with automatic reconnect
+#--------------------------------------------------------------------------
+# A PromiraSession holds the platform, application connection, channel
+# and one queue for a device, and remembers every configuration call
+# made through it.  When a call reports PS_APP_CONNECTION_LOST the
+# session reconnects, replays that configuration and retries once.
+# SessionManager caches sessions by IP or unique ID and hands them out
+# as context managers.  Unique IDs are resolved with find_ip unless a
+# DiscoveryCache's resolve method is given.
+#
+# Opening first tries to attach to an application that is already
+# running at the installed version, and only calls pm_load when that
+# fails.  The time spent in each startup step is kept in `timings`.
+#
+# transfer() sends a payload straight from memory on the session queue
+# in a single submit, and read() clocks the bus without sending one;
+# master output is enabled on first use and left on until the session
+# closes.
+#==========================================================================
+
+
+#==========================================================================
+# IMPORTS
+#==========================================================================
+from __future__ import division, with_statement, print_function
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from promira_py import *
+from promact_is_py import *
+from ps_collect import *
+from ps_discovery import ip_string, find_ip
+from ps_stream import queue_spi_read, queue_frames, align_responses
+
+
+#==========================================================================
+# CONSTANTS
+#==========================================================================
+APP_NAME = "com.totalphase.promact_is"
+
+RECONNECT_ATTEMPTS = 3
+RECONNECT_DELAY    = 0.5
+
+SPI_SS_MASK     = 1
+SPI_BUFFER_SIZE = 2048
+
+
+#==========================================================================
+# HELPER FUNCTIONS
+#==========================================================================
+class PromiraError(Exception):
+    """A Promira or promact_is call returned a negative status code."""
+    def __init__ (self, what, code, status_string = ps_app_status_string):
+        self.code = code
+        Exception.__init__(self, "%s: %s (%d)" %
+                           (what, status_string(code), code))
+
+def _lost (ret):
+    return isinstance(ret, int) and ret == PS_APP_CONNECTION_LOST
+
+
+#==========================================================================
+# CLASSES
+#==========================================================================
+class PromiraSession:
+    """
+    Open handles for one Promira running the promact_is application.
+
+    configure(func, *args) calls func(channel, *args) and records it;
+    the most recent arguments of each configuration function are
+    replayed in their original order after a reconnect.  call() runs a
+    channel function without recording it.  transact(build) rebuilds
+    the session queue with build(queue), submits it and returns
+    collect_all's (data, table).  transfer(data) is a full-duplex SPI
+    write of any buffer that returns the bytes read back; read(n)
+    returns n bytes without a payload.  transfer_frames(frames) sends
+    a burst to a device whose MISO lags by `latency` clocks.
+    """
+    def __init__ (self, ip, module = PS_MODULE_ID_SPI_ACTIVE,
+                  attempts = RECONNECT_ATTEMPTS, delay = RECONNECT_DELAY,
+                  warm_start = True):
+        self.ip         = ip
+        self.module     = module
+        self.attempts   = attempts
+        self.delay      = delay
+        self.warm_start = warm_start
+        self.warm       = False
+        self.timings    = OrderedDict()
+        self.pm         = 0
+        self.conn       = 0
+        self.channel    = 0
+        self.queue      = 0
+        self.oe         = False
+        self.latency    = 0
+        self.config     = OrderedDict()
+        self.reconnects = 0
+        self.lock       = threading.RLock()
+
+    def __enter__ (self):
+        if not self.channel:
+            self.open()
+        return self
+
+    def __exit__ (self, exc_type, exc, tb):
+        self.close()
+
+    def is_open (self):
+        return self.channel > 0
+
+    def _app_current (self, pm, channel):
+        # The running application matches the installed one
+        (ret, running) = ps_app_version(channel)
+        if ret < 0:
+            return False
+        (ret, installed) = pm_app_version(pm, APP_NAME)
+        if ret < 0:
+            return False
+        return running.firmware == installed.firmware
+
+    def open (self):
+        timings = OrderedDict()
+        lap = [ time.perf_counter() ]
+        def mark (step):
+            now = time.perf_counter()
+            timings[step] = now - lap[0]
+            lap[0] = now
+
+        pm = pm_open(self.ip)
+        if pm <= 0:
+            raise PromiraError("Unable to open Promira platform on %s"
+                               % self.ip, pm, pm_status_string)
+        mark('open')
+
+        # Warm start: attach to an application that is already running
+        conn = channel = 0
+        flags = PM_LOAD_NO_FLAGS
+        if self.warm_start:
+            conn = ps_app_connect(self.ip)
+            if conn > 0:
+                channel = ps_channel_open(conn)
+                if channel <= 0 or not self._app_current(pm, channel):
+                    if channel > 0:
+                        ps_channel_close(channel)
+                    ps_app_disconnect(conn)
+                    conn = channel = 0
+                    flags = PM_LOAD_UNLOAD
+            mark('probe')
+        self.warm = channel > 0
+
+        if not self.warm:
+            ret = pm_load_ext(pm, APP_NAME, flags)
+            if ret < 0 and ret != PM_APP_ALREADY_LOADED:
+                pm_close(pm)
+                raise PromiraError("Unable to load the application(%s)"
+                                   % APP_NAME, ret, pm_status_string)
+            mark('load')
+
+            conn = ps_app_connect(self.ip)
+            if conn <= 0:
+                pm_close(pm)
+                raise PromiraError("Unable to open the application on %s"
+                                   % self.ip, conn)
+            mark('connect')
+
+            channel = ps_channel_open(conn)
+            if channel <= 0:
+                ps_app_disconnect(conn)
+                pm_close(pm)
+                raise PromiraError("Unable to open the channel", channel)
+            mark('channel')
+
+        queue = ps_queue_create(conn, self.module)
+        if queue <= 0:
+            ps_channel_close(channel)
+            ps_app_disconnect(conn)
+            pm_close(pm)
+            raise PromiraError("Unable to create a queue", queue)
+
+        self.pm, self.conn, self.channel, self.queue = \
+            pm, conn, channel, queue
+        self.timings = timings
+
+    def startup_report (self):
+        """One-line breakdown of the last open(), in milliseconds."""
+        steps = [ "%s %.1f ms" % (step, t * 1000)
+                  for step, t in self.timings.items() ]
+        total = sum(self.timings.values()) * 1000
+        return "%s (%s start, total %.1f ms)" % \
+            (", ".join(steps), self.warm and "warm" or "cold", total)
+
+    def close (self):
+        # Errors are ignored: the connection may already be gone.
+        if self.oe and self.queue:
+            self._queue_oe(0)
+        self.oe = False
+        if self.queue:
+            ps_queue_destroy(self.queue)
+        if self.channel:
+            ps_channel_close(self.channel)
+        if self.conn:
+            ps_app_disconnect(self.conn)
+        if self.pm:
+            pm_close(self.pm)
+        self.pm = self.conn = self.channel = self.queue = 0
+
+    def reconnect (self):
+        """Reopen all handles and replay the recorded configuration."""
+        with self.lock:
+            was_oe = self.oe
+            self.close()
+            for attempt in range(self.attempts):
+                try:
+                    self.open()
+                    break
+                except PromiraError:
+                    if attempt + 1 == self.attempts:
+                        raise
+                    time.sleep(self.delay)
+            self.reconnects += 1
+            for func, args in self.config.items():
+                func(self.channel, *args)
+            if was_oe:
+                self.oe = not collect_errors(self._queue_oe(1))
+
+    def call (self, func, *args):
+        with self.lock:
+            ret = func(self.channel, *args)
+            if _lost(ret):
+                self.reconnect()
+                ret = func(self.channel, *args)
+            return ret
+
+    def configure (self, func, *args):
+        with self.lock:
+            self.config.pop(func, None)
+            self.config[func] = args
+            return self.call(func, *args)
+
+    def transact (self, build, out = None, skip = ()):
+        with self.lock:
+            for attempt in range(2):
+                ps_queue_clear(self.queue)
+                build(self.queue)
+                collect, _ = ps_queue_submit(self.queue, self.channel, 0)
+                data, table = collect_all(collect, out, skip)
+                if attempt == 0 and \
+                   any(_lost(row[COLLECT_TYPE]) for row in table):
+                    self.reconnect()
+                    continue
+                return (data, table)
+
+    def _queue_oe (self, enable):
+        ps_queue_clear(self.queue)
+        ps_queue_spi_oe(self.queue, enable)
+        collect, _ = ps_queue_submit(self.queue, self.channel, 0)
+        return collect_all(collect)[1]
+
+    def output_enable (self, enable = True):
+        """Switch SPI master output; transfer() turns it on as needed."""
+        with self.lock:
+            table = self.transact(
+                lambda queue: ps_queue_spi_oe(queue, enable))[1]
+            self.oe = bool(enable) and not collect_errors(table)
+            return table
+
+    def transfer (self, data, io = PS_SPI_IO_STANDARD, ss_mask = SPI_SS_MASK,
+                  chunk = SPI_BUFFER_SIZE, out = None):
+        """
+        Write data (a byte buffer or list of ints) with SS asserted and
+        return collect_all's (data, table) for the bytes read back.  SS
+        is released between chunks of `chunk` bytes (0 for one frame);
+        all chunks go out in one submit.
+        """
+        if not isinstance(data, (bytes, bytearray, array, memoryview)):
+            data = array('B', data)
+        view = memoryview(data)
+        if view.format != 'B':
+            view = view.cast('B')
+        size = len(view)
+        step = chunk or size or 1
+
+        def build (queue):
+            for offset in range(0, size, step):
+                part = view[offset:offset + step]
+                ps_queue_spi_ss(queue, ss_mask)
+                ps_queue_spi_write(queue, io, 8, len(part), part)
+                ps_queue_spi_ss(queue, 0)
+
+        with self.lock:
+            if not self.oe:
+                self.output_enable(1)
+            return self.transact(build, out)
+
+    def read (self, n, io = PS_SPI_IO_STANDARD, ss_mask = SPI_SS_MASK,
+              fill = None, out = None):
+        """
+        Read n bytes in one SS frame and one submit.  The clocks are
+        generated on the device (see ps_stream.queue_spi_read), so only
+        the commands cross the network.  Returns (data, table).
+        """
+        def build (queue):
+            ps_queue_spi_ss(queue, ss_mask)
+            queue_spi_read(queue, n, io, fill)
+            ps_queue_spi_ss(queue, 0)
+
+        with self.lock:
+            if not self.oe:
+                self.output_enable(1)
+            return self.transact(build, out)
+
+    def transfer_frames (self, frames, io = PS_SPI_IO_STANDARD,
+                         ss_mask = SPI_SS_MASK, fill = None):
+        """
+        Send frames back to back in one submit, padding the burst once
+        with self.latency clocks.  Returns (responses, table) with
+        responses[k] aligned to frames[k]; see ps_stream.
+        """
+        sizes = [ ]
+        def build (queue):
+            views = queue_frames(queue, frames, self.latency, io, ss_mask,
+                                 fill)
+            sizes[:] = [ len(v) for v in views ]
+
+        with self.lock:
+            if not self.oe:
+                self.output_enable(1)
+            data, table = self.transact(build)
+            return (align_responses(data, sizes, self.latency), table)
+
+class SessionManager:
+    """
+    Cache of open sessions keyed by IP string or unique ID.
+
+    get(key) returns the cached session, opening it if needed.
+    session(key) does the same as a context manager that holds the
+    session lock, so one thread at a time uses the handles.  Sessions
+    stay open until close(), close_channel() or close_all().
+    """
+    def __init__ (self, resolve = find_ip, module = PS_MODULE_ID_SPI_ACTIVE):
+        self.resolve   = resolve
+        self.module    = module
+        self._sessions = { }
+        self._lock     = threading.Lock()
+
+    def _ip (self, key):
+        if isinstance(key, int):
+            ip = self.resolve(key)
+            if ip is None:
+                raise PromiraError("No Promira with unique ID %d" % key,
+                                   PM_UNABLE_TO_OPEN, pm_status_string)
+            return ip
+        return key
+
+    def get (self, key):
+        with self._lock:
+            session = self._sessions.get(key)
+        if session is None:
+            # Resolving may run a discovery; other keys are not held up
+            ip = self._ip(key)
+            with self._lock:
+                session = self._sessions.setdefault(
+                    key, PromiraSession(ip, self.module))
+        with session.lock:
+            if not session.is_open():
+                session.open()
+        return session
+
+    def for_channel (self, channel):
+        """The open session that owns this channel handle, or None."""
+        with self._lock:
+            for session in self._sessions.values():
+                if session.channel == channel:
+                    return session
+        return None
+
+    @contextmanager
+    def session (self, key):
+        session = self.get(key)
+        with session.lock:
+            yield session
+
+    def close (self, key):
+        with self._lock:
+            session = self._sessions.pop(key, None)
+        if session is not None:
+            with session.lock:
+                session.close()
+
+    def close_channel (self, channel):
+        """Close and drop the session that owns this channel handle."""
+        with self._lock:
+            for key, session in list(self._sessions.items()):
+                if session.channel == channel:
+                    del self._sessions[key]
+                    break
+            else:
+                return
+        with session.lock:
+            session.close()
+
+    def close_all (self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            with session.lock:
+                session.close()
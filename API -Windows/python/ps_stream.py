@@ -0,0 +1,294 @@
+#==========================================================================
+# Promira SPI Controller
+#--------------------------------------------------------------------------
+# Project : POC- SPI Controller
+# File    : ps_stream.py
+#--------------------------------------------------------------------------
+# Chunked full-duplex SPI streaming
+#--------------------------------------------------------------------------
+# stream_transfer sends a buffer or an iterator of buffers as SS-framed
+# chunks, each exactly once.  Chunks go through a SubmitPipeline, so
+# chunk k+1 is submitted while chunk k is still on the bus and being
+# collected.  MISO data is written into one preallocated output buffer
+# at each chunk's offset.
+#
+# spi_read clocks the bus with ps_queue_spi_read (or
+# ps_queue_spi_write_word for a fill pattern), so the host sends a few
+# commands per block instead of one zero byte per byte read.
+#
+# For devices whose MISO lags MOSI by a fixed number of clocks,
+# latency_transfer sends a burst of frames back to back so that each
+# response is clocked out while the next frame is sent, pads the bus
+# once at the end, and returns the responses aligned to their frames.
+#==========================================================================
+
+
+#==========================================================================
+# IMPORTS
+#==========================================================================
+from __future__ import division, with_statement, print_function
+import time
+from array import array
+
+from promact_is_py import *
+from ps_collect import *
+from ps_pipeline import SubmitPipeline
+
+
+#==========================================================================
+# CONSTANTS
+#==========================================================================
+STREAM_CHUNK = 2048
+STREAM_DEPTH = 2
+
+# Words per read command and per submitted queue
+SPI_READ_CMD   = 32 * 1024
+SPI_READ_BLOCK = 512 * 1024
+
+
+#==========================================================================
+# HELPER FUNCTIONS
+#==========================================================================
+def _as_buffer (data):
+    # Lists of ints are packed; iterators raise TypeError
+    if isinstance(data, (list, tuple)):
+        data = array('B', data)
+    view = memoryview(data)
+    if view.format != 'B':
+        view = view.cast('B')
+    return view
+
+def _chunks (source, chunk):
+    # (offset, view) of each chunk; a buffer is sliced without copying
+    try:
+        view = _as_buffer(source)
+    except TypeError:
+        view = None
+
+    if view is not None:
+        for offset in range(0, len(view), chunk):
+            yield offset, view[offset:offset + chunk]
+        return
+
+    offset = 0
+    for part in source:
+        part = _as_buffer(part)
+        for start in range(0, len(part), chunk):
+            piece = part[start:start + chunk]
+            yield offset, piece
+            offset += len(piece)
+
+
+#==========================================================================
+# CLASSES
+#==========================================================================
+class StreamStats:
+    """Totals of one stream_transfer call."""
+    def __init__ (self, bitrate_khz = None):
+        self.bitrate_khz = bitrate_khz
+        self.chunks      = 0
+        self.written     = 0
+        self.read        = 0
+        self.short       = 0
+        self.errors      = [ ]
+        self.seconds     = 0.0
+
+    def mbps (self):
+        """Effective throughput in Mbit/s of data written."""
+        if not self.seconds:
+            return 0.0
+        return self.written * 8 / self.seconds / 1e6
+
+    def efficiency (self):
+        """Effective throughput as a fraction of the SPI bitrate."""
+        if not self.bitrate_khz or not self.seconds:
+            return None
+        return self.mbps() * 1000 / self.bitrate_khz
+
+    def report (self):
+        text = "%d bytes in %d chunks, %.3f s, %.3f Mbit/s" % \
+            (self.written, self.chunks, self.seconds, self.mbps())
+        if self.efficiency() is not None:
+            text += " (%.1f%% of %d kHz)" % (self.efficiency() * 100,
+                                            self.bitrate_khz)
+        if self.short:
+            text += ", %d short chunks" % self.short
+        if self.errors:
+            text += ", %d errors" % len(self.errors)
+        return text
+
+
+#==========================================================================
+# FUNCTIONS
+#==========================================================================
+def stream_transfer (channel, queue, source, out = None,
+                     chunk = STREAM_CHUNK, io = PS_SPI_IO_STANDARD,
+                     ss_mask = 1, depth = STREAM_DEPTH, bitrate_khz = None):
+    """
+    Write source over SPI in SS-framed chunks of at most `chunk` bytes
+    and capture the bytes read back.
+
+    source is a byte buffer, a list of ints, or an iterator of either.
+    MISO data of each chunk lands in out at the chunk's offset.  If out
+    is None it is allocated to the size of a buffer source, or grown
+    for an iterator.  bitrate_khz, as returned by ps_spi_bitrate, lets
+    the stats relate throughput to the bus rate.
+
+    Returns (data, stats): data is out trimmed to the bytes written.
+    """
+    stats = StreamStats(bitrate_khz)
+    if isinstance(source, list):
+        source = array('B', source)
+    if out is None:
+        try:
+            total = len(_as_buffer(source))
+        except TypeError:
+            total = None
+        grow = total is None
+        out = array('B') if grow else array_u08(total)
+    else:
+        grow = False
+
+    def consumer (context, data, table):
+        offset, size = context
+        if grow:
+            out.extend(data)
+        stats.read += len(data)
+        if len(data) != size:
+            stats.short += 1
+        stats.errors.extend(collect_errors(table))
+
+    start = time.perf_counter()
+    with SubmitPipeline(channel, depth, consumer) as pipe:
+        for offset, part in _chunks(source, chunk):
+            ps_queue_clear(queue)
+            ps_queue_spi_ss(queue, ss_mask)
+            ps_queue_spi_write(queue, io, 8, len(part), part)
+            ps_queue_spi_ss(queue, 0)
+
+            target = None if grow else out
+            ret = pipe.submit(queue, (offset, len(part)), target, (),
+                              offset)
+            if ret < 0:
+                stats.errors.append((ret, 0, 0, -1))
+                break
+            stats.chunks  += 1
+            stats.written += len(part)
+    stats.seconds = time.perf_counter() - start
+
+    if grow:
+        return (out, stats)
+    return (memoryview(out)[:stats.written], stats)
+
+def queue_spi_read (queue, n, io = PS_SPI_IO_STANDARD, fill = None,
+                    cmd = SPI_READ_CMD):
+    """
+    Queue n bytes of bus clocks without a payload, in commands of at
+    most cmd words.  With fill set, that byte is driven on MOSI through
+    ps_queue_spi_write_word; otherwise ps_queue_spi_read is used.
+    """
+    for offset in range(0, n, cmd):
+        count = min(cmd, n - offset)
+        if fill is None:
+            ps_queue_spi_read(queue, io, 8, count)
+        else:
+            ps_queue_spi_write_word(queue, io, 8, count, fill)
+
+def spi_read (channel, queue, n, out = None, io = PS_SPI_IO_STANDARD,
+              ss_mask = 1, fill = None, block = SPI_READ_BLOCK,
+              depth = STREAM_DEPTH, bitrate_khz = None):
+    """
+    Read n bytes with SS asserted for the whole read.
+
+    Reads longer than block are split over several pipelined queues;
+    SS is asserted by the first and released by the last.  The data is
+    written into out (allocated if None).  Returns (data, stats) as
+    stream_transfer does, with stats.written counting bytes clocked.
+    """
+    stats = StreamStats(bitrate_khz)
+    if out is None:
+        out = array_u08(n)
+
+    def consumer (context, data, table):
+        offset, size = context
+        stats.read += len(data)
+        if len(data) != size:
+            stats.short += 1
+        stats.errors.extend(collect_errors(table))
+
+    start = time.perf_counter()
+    with SubmitPipeline(channel, depth, consumer) as pipe:
+        for offset in range(0, n, block):
+            size = min(block, n - offset)
+            ps_queue_clear(queue)
+            if offset == 0:
+                ps_queue_spi_ss(queue, ss_mask)
+            queue_spi_read(queue, size, io, fill)
+            if offset + size == n:
+                ps_queue_spi_ss(queue, 0)
+
+            ret = pipe.submit(queue, (offset, size), out, (), offset)
+            if ret < 0:
+                stats.errors.append((ret, 0, 0, -1))
+                break
+            stats.chunks  += 1
+            stats.written += size
+    stats.seconds = time.perf_counter() - start
+
+    return (memoryview(out)[:stats.read], stats)
+
+def queue_frames (queue, frames, latency, io = PS_SPI_IO_STANDARD,
+                  ss_mask = 1, fill = None, ss_per_frame = False):
+    """
+    Queue frames back to back followed by enough clocks to shift out
+    the last response, latency clocks late.  SS stays asserted for the
+    whole burst unless ss_per_frame is set.  The pad is clocked as in
+    queue_spi_read.  Returns the frames as byte views.
+    """
+    views = [ _as_buffer(frame) for frame in frames ]
+    ps_queue_spi_ss(queue, ss_mask)
+    for i, view in enumerate(views):
+        if ss_per_frame and i:
+            ps_queue_spi_ss(queue, 0)
+            ps_queue_spi_ss(queue, ss_mask)
+        ps_queue_spi_write(queue, io, 8, len(view), view)
+    queue_spi_read(queue, (latency + 7) // 8, io, fill)
+    ps_queue_spi_ss(queue, 0)
+    return views
+
+def align_responses (data, sizes, latency):
+    """
+    Drop the first latency bits of the MISO stream of a burst and split
+    the rest into one response per frame size.
+    """
+    skip, bits = divmod(latency, 8)
+    stream = memoryview(data)[skip:]
+    if bits:
+        # Sub-byte latency: shift the whole burst left
+        size  = len(stream)
+        value = int.from_bytes(stream, 'big') << bits
+        stream = memoryview((value & ((1 << 8 * size) - 1)).to_bytes(size,
+                                                                     'big'))
+    responses = [ ]
+    offset = 0
+    for size in sizes:
+        responses.append(stream[offset:offset + size])
+        offset += size
+    return responses
+
+def latency_transfer (channel, queue, frames, latency,
+                      io = PS_SPI_IO_STANDARD, ss_mask = 1, fill = None,
+                      ss_per_frame = False):
+    """
+    Send frames as one burst to a device whose response lags by
+    latency clocks.  Returns (responses, table): responses[k] is the
+    MISO data belonging to frames[k], shorter if the read came up
+    short.
+    """
+    ps_queue_clear(queue)
+    views = queue_frames(queue, frames, latency, io, ss_mask, fill,
+                         ss_per_frame)
+    collect, _ = ps_queue_submit(queue, channel, 0)
+    data, table = collect_all(collect)
+    return (align_responses(data, [ len(v) for v in views ], latency),
+            table)
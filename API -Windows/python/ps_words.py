@@ -0,0 +1,130 @@
+#==========================================================================
+# Promira SPI Controller
+#--------------------------------------------------------------------------
+# Project : POC- SPI Controller
+# File    : ps_words.py
+#--------------------------------------------------------------------------
+# NumPy packing of 2..32-bit SPI words
+#--------------------------------------------------------------------------
+# ps_queue_spi_write takes, and ps_collect_spi_read returns, a bitwise
+# concatenation of words, most significant bit first and zero padded
+# to a whole byte: words 0x1 0x2 0x3 0x4 0x5 of 4 bits are 0x12 0x34
+# 0x50.  pack_words and unpack_words convert between that layout and
+# integer arrays without a Python loop per word.  Byte-aligned sizes
+# (8, 16, 24, 32) are byte swaps; other sizes go through
+# numpy.unpackbits/packbits.
+#
+# NumPy is optional for the rest of the package; these functions raise
+# ImportError without it.
+#==========================================================================
+
+
+#==========================================================================
+# IMPORTS
+#==========================================================================
+from __future__ import division, with_statement, print_function
+
+from promact_is_py import *
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+#==========================================================================
+# CONSTANTS
+#==========================================================================
+WORD_SIZE_MIN = 2
+WORD_SIZE_MAX = 32
+
+
+#==========================================================================
+# HELPER FUNCTIONS
+#==========================================================================
+def _check (word_size):
+    if numpy is None:
+        raise ImportError("SPI word packing needs numpy")
+    if not WORD_SIZE_MIN <= word_size <= WORD_SIZE_MAX:
+        raise ValueError("word_size must be between %d and %d, not %d" %
+                         (WORD_SIZE_MIN, WORD_SIZE_MAX, word_size))
+
+def packed_size (word_size, num_words):
+    """Bytes needed for num_words words of word_size bits."""
+    return (word_size * num_words + 7) // 8
+
+
+#==========================================================================
+# FUNCTIONS
+#==========================================================================
+def pack_words (words, word_size):
+    """
+    Pack a sequence of integers into the API's bit-concatenated layout.
+    Bits above word_size are ignored.  Returns a numpy uint8 array that
+    can be passed to ps_queue_spi_write as is.
+    """
+    _check(word_size)
+    words = numpy.asarray(words, dtype = numpy.uint32).ravel()
+
+    if word_size == 8:
+        return words.astype(numpy.uint8)
+    if word_size == 16:
+        return words.astype('>u2').view(numpy.uint8)
+    if word_size == 32:
+        return words.astype('>u4').view(numpy.uint8)
+
+    # Each word as 4 big-endian bytes, keep the low word_size bits
+    raw = words.astype('>u4').view(numpy.uint8).reshape(-1, 4)
+    if word_size == 24:
+        return raw[:, 1:].ravel()
+    bits = numpy.unpackbits(raw, axis = 1)[:, 32 - word_size:]
+    return numpy.packbits(bits.ravel())
+
+def unpack_words (data, word_size, count = None):
+    """
+    Split bit-concatenated data (any byte buffer) into words of
+    word_size bits.  count defaults to every whole word in data.
+    Returns a numpy uint32 array.
+    """
+    _check(word_size)
+    data = numpy.frombuffer(data, dtype = numpy.uint8)
+    whole = len(data) * 8 // word_size
+    count = whole if count is None else min(count, whole)
+
+    if word_size == 8:
+        return data[:count].astype(numpy.uint32)
+    if word_size == 16:
+        return data[:count * 2].view('>u2').astype(numpy.uint32)
+    if word_size == 32:
+        return data[:count * 4].view('>u4').astype(numpy.uint32)
+
+    raw = numpy.zeros((count, 4), dtype = numpy.uint8)
+    if word_size == 24:
+        raw[:, 1:] = data[:count * 3].reshape(-1, 3)
+    else:
+        bits = numpy.unpackbits(data)[:count * word_size]
+        full = numpy.zeros((count, 32), dtype = numpy.uint8)
+        full[:, 32 - word_size:] = bits.reshape(-1, word_size)
+        raw = numpy.packbits(full, axis = 1)
+    return raw.view('>u4').ravel().astype(numpy.uint32)
+
+def queue_spi_write_words (queue, io, word_size, words):
+    """Pack words and queue them with ps_queue_spi_write."""
+    data = pack_words(words, word_size)
+    num_words = numpy.size(words)
+    return ps_queue_spi_write(queue, io, word_size, num_words, data)
+
+def collect_spi_read_words (collect, num_words):
+    """
+    ps_collect_spi_read for word data.  Call it after ps_collect_resp
+    returns PS_SPI_CMD_READ, with num_words at least the number of
+    words the command clocked.  Returns (ret, word_size, words) where
+    ret is the number of words received, or a negative status code.
+    """
+    _check(WORD_SIZE_MAX)
+    buf = numpy.zeros(packed_size(WORD_SIZE_MAX, num_words),
+                      dtype = numpy.uint8)
+    ret, word_size = ps_collect_spi_read_into(collect, buf)
+    if ret < 0:
+        return (ret, word_size, numpy.zeros(0, dtype = numpy.uint32))
+    return (ret, word_size, unpack_words(buf, word_size, ret))
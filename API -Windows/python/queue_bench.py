@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+#==========================================================================
+# Promira SPI Controller
+#--------------------------------------------------------------------------
+# Project : POC- SPI Controller
+# File    : queue_bench.py
+#--------------------------------------------------------------------------
+# Measure host-side SPI queue construction throughput
+#--------------------------------------------------------------------------
+# Builds SPI write queues from a large payload without submitting them,
+# once the old way (slice and copy into array('B') per chunk) and once
+# passing zero-copy buffer slices straight to ps_queue_spi_write.
+#==========================================================================
+
+
+#==========================================================================
+# IMPORTS
+#==========================================================================
+from __future__ import division, with_statement, print_function
+import sys
+import time
+from array import array
+
+from promira_py import *
+from promact_is_py import *
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+#==========================================================================
+# CONSTANTS
+#==========================================================================
+MB = 1 * 1024 * 1024
+KB = 1 * 1024
+
+DEFAULT_SIZE  = 16 * MB
+DEFAULT_CHUNK = 2 * KB
+
+
+#==========================================================================
+# FUNCTION (APP)
+#==========================================================================
+APP_NAME = "com.totalphase.promact_is"
+def dev_open (ip):
+    pm = pm_open(ip)
+    if pm <= 0:
+         print("Unable to open Promira platform on %s" % ip)
+         print("Error code = %d" % pm)
+         sys.exit()
+
+    ret = pm_load(pm, APP_NAME)
+    if ret < 0:
+         print("Unable to load the application(%s)" % APP_NAME)
+         print("Error code = %d" % ret)
+         sys.exit()
+
+    conn = ps_app_connect(ip)
+    if conn <= 0:
+         print("Unable to open the application on %s" % ip)
+         print("Error code = %d" % conn)
+         sys.exit()
+
+    return pm, conn
+
+def dev_close (pm, conn):
+    ps_app_disconnect(conn)
+    pm_close(pm)
+
+
+#==========================================================================
+# FUNCTIONS
+#==========================================================================
+def build_copy (queue, payload, chunk):
+    # Previous caller pattern: slice, then copy into a fresh array('B')
+    for offset in range(0, len(payload), chunk):
+        ps_queue_clear(queue)
+        data_out = array('B', payload[offset:offset + chunk])
+        ps_queue_spi_write(queue, PS_SPI_IO_STANDARD, 8,
+                           len(data_out), data_out)
+
+def build_view (queue, payload, chunk):
+    # Zero-copy: hand memoryview slices straight to the queue
+    view = memoryview(payload)
+    for offset in range(0, len(view), chunk):
+        ps_queue_clear(queue)
+        data_out = view[offset:offset + chunk]
+        ps_queue_spi_write(queue, PS_SPI_IO_STANDARD, 8,
+                           len(data_out), data_out)
+
+def measure (func, queue, payload, chunk):
+    start = time.perf_counter()
+    func(queue, payload, chunk)
+    elapsed = time.perf_counter() - start
+    return len(payload) / elapsed if elapsed > 0 else float('inf')
+
+def bench (queue, size, chunk):
+    raw = bytes(bytearray(i & 0xff for i in range(256))) * (size // 256)
+    sources = [ ('bytes', raw), ('bytearray', bytearray(raw)) ]
+    if numpy is not None:
+        sources.append(('numpy.uint8', numpy.frombuffer(raw, numpy.uint8)))
+
+    print("Payload %d KB, chunk %d bytes" % (size // KB, chunk))
+    print("%-12s %14s %14s %8s" % ("source", "copy MB/s", "view MB/s",
+                                   "speedup"))
+    for name, payload in sources:
+        before = measure(build_copy, queue, payload, chunk)
+        after  = measure(build_view, queue, payload, chunk)
+        print("%-12s %14.1f %14.1f %7.1fx" %
+              (name, before / MB, after / MB, after / before))
+
+    # The view column only measures zero copy if the native module
+    # took the buffers as they are
+    if api_buffer_protocol():
+        print("view: buffers passed to promact_is without a copy")
+    else:
+        print("view: promact_is rejected buffers, so they were copied "
+              "into array('B') as well")
+
+
+#==========================================================================
+# MAIN PROGRAM
+#==========================================================================
+if __name__ == '__main__':
+    if (len(sys.argv) < 2):
+        print("usage: queue_bench IP [SIZE_KB] [CHUNK]")
+        print("")
+        print("  Queues are built and cleared on the host only;")
+        print("  nothing is submitted to the bus.")
+        sys.exit()
+
+    ip    = sys.argv[1]
+    size  = len(sys.argv) > 2 and int(sys.argv[2]) * KB or DEFAULT_SIZE
+    chunk = len(sys.argv) > 3 and int(sys.argv[3]) or DEFAULT_CHUNK
+
+    # Open the device
+    pm, conn = dev_open(ip)
+
+    # Create a queue for SPI transactions
+    queue = ps_queue_create(conn, PS_MODULE_ID_SPI_ACTIVE)
+
+    bench(queue, size, chunk)
+
+    # Destroy the queue
+    ps_queue_destroy(queue)
+
+    # Close the device and exit
+    dev_close(pm, conn)
@@ -33,6 +33,7 @@ import time
 
 from promira_py import *
 from promact_is_py import *
+from ps_hexdump import write_dump
 
 
 #==========================================================================
@@ -167,16 +168,8 @@ def _readMemory (channel, queue, addr, length):
         print("error: read %d bytes (expected %d)" % (len(data_in) - 3, length))
 
     # Dump the data to the screen
-    sys.stdout.write("\nData read from device:")
-    for i in range(len(data_in) - 3):
-        if ((i & 0x0f) == 0):
-            sys.stdout.write("\n%04x:  " % (addr + i))
-
-        sys.stdout.write("%02x " % (data_in[i + 3] & 0xff))
-        if (((i + 1) & 0x07) == 0):
-            sys.stdout.write(" ")
-
-    sys.stdout.write("\n")
+    write_dump("\nData read from device:", memoryview(data_in)[3:], addr,
+               end = "\n")
 
 
 #==========================================================================
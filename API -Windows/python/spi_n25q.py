@@ -29,11 +29,20 @@
 # IMPORTS
 #==========================================================================
 from __future__ import division, with_statement, print_function
+import mmap
+import random
 import sys
 import time
 
 from promira_py import *
 from promact_is_py import *
+from ps_collect import *
+from ps_pipeline import SubmitPipeline
+from ps_buffers import BufferPool
+from ps_hexdump import write_dump
+from ps_image import ImageSource, pattern_chunks
+from ps_flash import PageProgrammer, HashCache, sector_hash, \
+                     sector_hashes, erase_units, plan_erase, DEFAULT_PAGE_US
 
 
 #==========================================================================
@@ -44,6 +53,13 @@ KB              = 1 * 1024
 
 CMD_DEV_ID  = [ 0x9F, 0x00, 0x00, 0x00 ]
 
+# READ ID returns 20 bytes: manufacturer, 2 device ID bytes, the UID
+# length (0x10), then the extended ID, configuration and 14 bytes of
+# factory unique data
+CMD_READ_UID = [ 0x9F ] + [ 0x00 ] * 20
+UID_OFFSET   = 5
+UID_SIZE     = 16
+
 DEV_IDS     = {
     'N25Q032A' : [ 0x20, 0xBA, 0x16 ],
     'N25Q064A' : [ 0x20, 0xBA, 0x17 ],
@@ -104,9 +120,25 @@ READ_CMD_SIZE   = 32 * KB
 READ_BLK_SIZE   = 512 * KB
 WRITE_PAGE_SIZE = 256
 
+# Erase unit of the diff command: 4 KB subsectors or 64 KB sectors
+DIFF_SECTOR_SIZE = 4 * KB
+
+# Subsector and sector erase sizes of the N25Q family
+ERASE_SECTORS = ( 4 * KB, 64 * KB )
+
 BITRATE = 40000
 SS_MASK = 1
 
+# Number of read blocks kept in flight on the channel
+READ_DEPTH = 4
+
+# Receive buffers for one READ_BLK_SIZE block, reused across blocks
+BLOCK_POOL = BufferPool(READ_BLK_SIZE, count = READ_DEPTH)
+
+# Command indices of a read queue whose data is not memory content:
+# the command/address echo and the dummy bytes (index 0 is SS).
+READ_SKIP_CMDS = (1, 2)
+
 
 #==========================================================================
 # FUNCTION (APP)
@@ -150,20 +182,8 @@ def dev_close (pm, app, channel):
     pm_close(pm)
 
 def dev_collect (collect):
-    if collect < 0:
-        print(ps_app_status_string(collect))
-        return
-
-    response = array('B', [ ])
-    while True:
-        t, length, result = ps_collect_resp(collect, -1)
-        if t == PS_APP_NO_MORE_CMDS_TO_COLLECT:
-            break
-        elif t < 0:
-            print(ps_app_status_string(t))
-        if t == PS_SPI_CMD_READ:
-            ret, word_size, buf = ps_collect_spi_read(collect, result)
-            response += buf
+    response, table = collect_all(collect)
+    collect_print_errors(table)
     return response
 
 def spi_master_oe (channel, queue, enable):
@@ -177,45 +197,20 @@ def spi_master_oe (channel, queue, enable):
 # HELPER FUNCTIONS
 #==========================================================================
 def dump_array (addr, data, index, count):
-    for i in range(count):
-        if not i & 0xf:
-            if i:
-                sys.stdout.write("\n")
-            sys.stdout.write("%08x:  " % (addr + i))
-
-        sys.stdout.write("%02x " % (data[index + i] & 0xff))
-        if not (i + 1) & 0x7:
-            sys.stdout.write(" ")
-    sys.stdout.write("\n");
-
-# Collect outstanding packets
-def flash_collect (channel, addr, block_size, ignore_bytes,
-                   print_buf_size = 16):
-    collect, _ = ps_queue_async_collect(channel)
-    if collect < 0:
-        return False
-
-    block_addr = 0
-
-    ignore_bytes += [ 0 ]
-    while True:
-        t, length, result = ps_collect_resp(collect, -1)
-        if t == PS_APP_NO_MORE_CMDS_TO_COLLECT:
-            break
-        elif t < 0:
-            print(ps_app_status_string(t))
-
-        if t == PS_SPI_CMD_READ:
-            if ignore_bytes and result in ignore_bytes:
-                continue
+    write_dump(None, memoryview(data)[index:index + count], addr, 8,
+               end = "\n")
 
-            ret, word_size, buf = ps_collect_spi_read(collect, result)
+# Print the start of every read command of a collected block
+def flash_print_block (addr, data, table, print_buf_size = 16):
+    collect_print_errors(table)
 
-            if print_buf_size:
-                dump_array(addr + block_addr, buf, 0, min(ret, print_buf_size))
-                block_addr += ret
-
-    return True
+    if print_buf_size:
+        for row in table:
+            offset = row[COLLECT_OFFSET]
+            if offset < 0 or not row[COLLECT_LENGTH]:
+                continue
+            dump_array(addr + offset, data, offset,
+                       min(row[COLLECT_LENGTH], print_buf_size))
 
 
 def get_addr (addr, addr_size):
@@ -247,6 +242,24 @@ def flash_n25q_detect (channel, queue):
             DEV_NAME = name
             break
 
+def flash_n25q_uid (channel, queue):
+    # The flash's factory unique ID as hex, None if it has none
+    ps_queue_clear(queue)
+
+    ps_queue_spi_ss(queue, SS_MASK)
+    ps_queue_spi_write(queue, 0, 8, len(CMD_READ_UID),
+                       array('B', CMD_READ_UID))
+    ps_queue_spi_ss(queue, 0)
+
+    collect, _ = ps_queue_submit(queue, channel, 0)
+    data_in = dev_collect(collect)
+
+    uid = bytes(data_in[UID_OFFSET:UID_OFFSET + UID_SIZE])
+    if len(uid) != UID_SIZE or uid in (b'\x00' * UID_SIZE,
+                                       b'\xff' * UID_SIZE):
+        return None
+    return uid.hex()
+
 def flash_n25q_prepare (channel, queue):
     cmds = SETUP_CMDS[DEV_NAME]
 
@@ -261,131 +274,255 @@ def flash_n25q_prepare (channel, queue):
         collect, _ = ps_queue_submit(queue, channel, 0)
         data_in = dev_collect(collect)
 
-def flash_n25q_read (IO, channel, queue):
+def flash_queue_read (IO, queue, addr, size = READ_BLK_SIZE):
     CMD_READ, CMD_WRITE, DUMMY_BYTES  = CMDS[IO]
-    DEV_SIZE  = DEV_SIZES[DEV_NAME]
     ADDR_SIZE = ADDR_SIZES[DEV_NAME]
 
-    block_cnt = DEV_SIZE // READ_BLK_SIZE
-    addr      = 0
-
-    for i in range(block_cnt):
-        ps_queue_clear(queue)
+    ps_queue_clear(queue)
 
-        # Assemble write command and address
-        data = array('B', [ CMD_READ ] + get_addr(addr, ADDR_SIZE))
+    # Assemble write command and address
+    data = array('B', [ CMD_READ ] + get_addr(addr, ADDR_SIZE))
 
-        ps_queue_spi_ss(queue, SS_MASK)
-        # Write command and address and read dummy bytes and memory data
-        ps_queue_spi_write(queue, 0, 8, len(data), data)
-        ps_queue_spi_read(queue, IO, 8, DUMMY_BYTES)
-        for _ in range(READ_BLK_SIZE // READ_CMD_SIZE):
-            ps_queue_spi_read(queue, IO, 8, READ_CMD_SIZE)
-        ps_queue_spi_ss(queue, 0)
+    ps_queue_spi_ss(queue, SS_MASK)
+    # Write command and address and read dummy bytes and memory data
+    ps_queue_spi_write(queue, 0, 8, len(data), data)
+    ps_queue_spi_read(queue, IO, 8, DUMMY_BYTES)
+    for offset in range(0, size, READ_CMD_SIZE):
+        ps_queue_spi_read(queue, IO, 8, min(READ_CMD_SIZE, size - offset))
+    ps_queue_spi_ss(queue, 0)
 
-        ps_queue_async_submit(queue, channel, 0)
-        ret = flash_collect(channel, addr, READ_CMD_SIZE,
-                            [ len(data), DUMMY_BYTES ])
-        addr += READ_BLK_SIZE
+def flash_n25q_read (IO, channel, queue):
+    DEV_SIZE  = DEV_SIZES[DEV_NAME]
 
-def flash_n25q_erase (IO, channel, queue):
-    DEV_SIZE = DEV_SIZES[DEV_NAME]
-    CMD_ERASE, DIE_SIZE = ERASE_CMD[DEV_NAME]
-    ADDR_SIZE = ADDR_SIZES[DEV_NAME]
+    block_cnt = DEV_SIZE // READ_BLK_SIZE
+    addr      = 0
 
-    die_cnt   = 1 if DIE_SIZE == 0 else DEV_SIZE // DIE_SIZE
-    ADDR_SIZE = 0 if DIE_SIZE == 0 else ADDR_SIZE
+    # Called in block order as the pipeline collects each queue
+    def block_done (block, data, table):
+        block_addr, buf = block
+        flash_print_block(block_addr, data, table)
+        BLOCK_POOL.release(buf)
 
-    addr = 0
+    pipeline = SubmitPipeline(channel, READ_DEPTH, block_done)
 
-    queue_busy = ps_queue_create(conn, PS_MODULE_ID_SPI_ACTIVE)
+    for i in range(block_cnt):
+        flash_queue_read(IO, queue, addr)
+
+        buf = BLOCK_POOL.acquire()
+        ret = pipeline.submit(queue, (addr, buf), buf, READ_SKIP_CMDS)
+        if ret < 0:
+            BLOCK_POOL.release(buf)
+            print('Unable to submit the read at 0x%08x: %s' %
+                  (addr, ps_app_status_string(ret)))
+            break
+        addr += READ_BLK_SIZE
 
-    ps_queue_spi_ss(queue_busy, SS_MASK)
-    ps_queue_spi_write(queue_busy, 0, 8,
-                       len(CMD_STATUS), array('B', CMD_STATUS))
-    ps_queue_spi_ss(queue_busy, 0)
+    pipeline.flush()
 
-    for n in range(die_cnt):
-        print('Erasing 0x%08x' % addr)
-        ps_queue_clear(queue)
+def flash_n25q_dump (IO, channel, queue, path, bitrate_khz):
+    DEV_SIZE  = DEV_SIZES[DEV_NAME]
 
-        # Write enable
-        ps_queue_spi_ss(queue, SS_MASK)
-        ps_queue_spi_write(queue, 0, 8,
-                           len(CMD_WREN), array('B', CMD_WREN))
-        ps_queue_spi_ss(queue, 0)
+    block_cnt = DEV_SIZE // READ_BLK_SIZE
+    bad       = [ ]
+
+    # Called in block order; the data is already in the file
+    def block_done (block_addr, data, table):
+        if collect_errors(table) or len(data) != READ_BLK_SIZE:
+            collect_print_errors(table)
+            print('Short read at 0x%08x: %d of %d bytes' %
+                  (block_addr, len(data), READ_BLK_SIZE))
+            bad.append(block_addr)
+        elif not (block_addr + READ_BLK_SIZE) % (8 * MB):
+            print('Dumped %d MB' % ((block_addr + READ_BLK_SIZE) // MB))
+
+    with open(path, 'w+b') as f:
+        f.truncate(DEV_SIZE)
+        image = mmap.mmap(f.fileno(), DEV_SIZE)
+        try:
+            start = time.time()
+            pipeline = SubmitPipeline(channel, READ_DEPTH, block_done)
+            for addr in range(0, block_cnt * READ_BLK_SIZE, READ_BLK_SIZE):
+                flash_queue_read(IO, queue, addr)
+                ret = pipeline.submit(queue, addr, image, READ_SKIP_CMDS,
+                                      addr)
+                if ret < 0:
+                    print('Unable to submit the read at 0x%08x: %s' %
+                          (addr, ps_app_status_string(ret)))
+                    bad.append(addr)
+                    break
+            pipeline.flush()
+            elapsed = time.time() - start
+            image.flush()
+        finally:
+            image.close()
+
+    rate = elapsed and DEV_SIZE / elapsed / MB or 0
+    bus  = bitrate_khz * 1000 * max(IO, 1) / 8 / MB
+    print('Dumped %d MB to %s in %.2f s: %.2f MB/s (bus %.2f MB/s, %.0f%%)' %
+          (DEV_SIZE // MB, path, elapsed, rate, bus, rate * 100 / bus))
+    if bad:
+        print('%d blocks failed' % len(bad))
+    return len(bad)
+
+def flash_n25q_hashes (IO, channel, queue, size, sector_size):
+    # Read back the first size bytes and hash them sector by sector.
+    # Sectors that could not be read get None, so the list stays
+    # indexed by address and those sectors count as changed.
+    hashes = [ ]
+    count  = (size + sector_size - 1) // sector_size
+
+    def block_done (block, data, table):
+        block_addr, buf = block
+        if collect_errors(table) or len(data) != READ_BLK_SIZE:
+            collect_print_errors(table)
+            print('Short read at 0x%08x: %d of %d bytes' %
+                  (block_addr, len(data), READ_BLK_SIZE))
+            hashes.extend([ None ] * (READ_BLK_SIZE // sector_size))
+        else:
+            hashes.extend(sector_hashes(data, sector_size))
+        BLOCK_POOL.release(buf)
+
+    pipeline = SubmitPipeline(channel, READ_DEPTH, block_done)
+    for addr in range(0, size, READ_BLK_SIZE):
+        flash_queue_read(IO, queue, addr)
+        buf = BLOCK_POOL.acquire()
+        ret = pipeline.submit(queue, (addr, buf), buf, READ_SKIP_CMDS)
+        if ret < 0:
+            BLOCK_POOL.release(buf)
+            print('Unable to submit the read at 0x%08x: %s' %
+                  (addr, ps_app_status_string(ret)))
+            break
+    pipeline.flush()
 
-        # Erase
-        data = array('B', [ CMD_ERASE ] + get_addr(addr, ADDR_SIZE))
+    hashes.extend([ None ] * (count - len(hashes)))
+    return hashes[:count]
 
-        ps_queue_spi_ss(queue, SS_MASK)
-        ps_queue_spi_write(queue, 0, 8, len(data), data)
-        ps_queue_spi_ss(queue, 0)
+def flash_n25q_matches (IO, channel, queue, hashes, sector_size):
+    # Spot-check cached hashes: the first sector and one at random
+    for index in set([ 0, random.randrange(len(hashes)) ]):
+        if hashes[index] is None:
+            continue
+        flash_queue_read(IO, queue, index * sector_size, sector_size)
         collect, _ = ps_queue_submit(queue, channel, 0)
-        data_in = dev_collect(collect)
-
-        while True:
-            collect, _ = ps_queue_submit(queue_busy, channel, 0)
-            data_in = dev_collect(collect)
-            if data_in[-1] & 0x80:
-                break
-
-        addr += DIE_SIZE
-
-    ps_queue_destroy(queue_busy)
-    return 0
+        data, table = collect_all(collect, None, READ_SKIP_CMDS)
+        if collect_errors(table) or len(data) != sector_size or \
+           sector_hash(data, sector_size) != hashes[index]:
+            return False
+    return True
 
-def flash_n25q_write (IO, channel, queue):
+def flash_programmer (IO, channel, queue, bitrate_khz):
     CMD_READ, CMD_WRITE, DUMMY_BYTES  = CMDS[IO]
-    DEV_SIZE  = DEV_SIZES[DEV_NAME]
-    ADDR_SIZE = ADDR_SIZES[DEV_NAME]
+    DEV_SIZE = DEV_SIZES[DEV_NAME]
+    CMD_ERASE, DIE_SIZE = ERASE_CMD[DEV_NAME]
 
-    page_cnt = DEV_SIZE // WRITE_PAGE_SIZE
-    addr = 0
+    units = erase_units(DEV_SIZE, ERASE_SECTORS, DIE_SIZE)
+    return PageProgrammer(channel, queue, DEV_NAME, ADDR_SIZES[DEV_NAME],
+                          IO, CMD_WRITE, ss_mask = SS_MASK,
+                          bitrate_khz = bitrate_khz, units = units)
 
-    data_out = [ x & 0xff for x in range(DEV_SIZE) ]
+def parse_range (text):
+    # START:END or START+LENGTH, decimal or 0x hex
+    if '+' in text:
+        start, length = text.split('+')
+        return (int(start, 0), int(start, 0) + int(length, 0))
+    start, end = text.split(':')
+    return (int(start, 0), int(end, 0))
 
-    queue_busy = ps_queue_create(conn, PS_MODULE_ID_SPI_ACTIVE)
+def flash_n25q_erase (IO, channel, queue, bitrate_khz, ranges = None):
+    DEV_SIZE = DEV_SIZES[DEV_NAME]
 
-    ps_queue_spi_ss(queue_busy, SS_MASK)
-    ps_queue_spi_write(queue_busy, 0, 8,
-                       len(CMD_STATUS), array('B', CMD_STATUS))
-    ps_queue_spi_ss(queue_busy, 0)
+    # Without ranges, erase the whole device
+    ranges = ranges or [ (0, DEV_SIZE) ]
+
+    programmer = flash_programmer(IO, channel, queue, bitrate_khz)
+    plan, expected = plan_erase(ranges, programmer.units,
+                                programmer.erase_cost, DEV_SIZE)
+    for size in sorted(set(size for addr, size in plan)):
+        count = sum(1 for addr, s in plan if s == size)
+        print('%5d x %s erase' % (count, size >= MB and
+                                  '%d MB' % (size // MB) or
+                                  '%d KB' % (size // KB)))
+    print('Expected erase time %.1f s' % (expected / 1e6))
+
+    stats, plan = programmer.erase_ranges(ranges, DEV_SIZE)
+    print('Erased %d of %d in %.1f s' % (stats.erased, len(plan),
+                                         stats.seconds))
+    for addr, status in stats.failed:
+        print('Erase failed at 0x%08x, flag status 0x%02x' % (addr, status))
+    return len(stats.failed) + len(stats.errors)
+
+def flash_n25q_write (IO, channel, queue, bitrate_khz, image = None):
+    DEV_SIZE  = DEV_SIZES[DEV_NAME]
 
-    for n in range(page_cnt):
-        if not (addr & 0xFFFF):
-            print('Programming address 0x%x' % addr)
-        ps_queue_clear(queue)
+    # Without an image, program the test pattern over the whole device
+    if image is None:
+        image = pattern_chunks(DEV_SIZE)
+    source = ImageSource(image, DEV_SIZE)
 
-        # Write enable
-        ps_queue_spi_ss(queue, SS_MASK)
-        ps_queue_spi_write(queue, 0, 8,
-                           len(CMD_WREN), array('B', CMD_WREN))
-        ps_queue_spi_ss(queue, 0)
+    def pages ():
+        for addr, page in source.pages(WRITE_PAGE_SIZE):
+            if not (addr & 0xFFFF):
+                print('Programming address 0x%x' % addr)
+            yield (addr, page)
 
-        # Program
-        ps_queue_spi_ss(queue, SS_MASK)
-        data = array('B', [ CMD_WRITE ] + get_addr(addr, ADDR_SIZE))
-        ps_queue_spi_write(queue, 0, 8, len(data), data)
-        ps_queue_spi_write(queue, IO, 8,
-                           WRITE_PAGE_SIZE,
-                           array('B', data_out[addr: addr + WRITE_PAGE_SIZE]))
-        ps_queue_spi_ss(queue, 0)
-        collect, _ = ps_queue_submit(queue, channel, 0)
+    programmer = flash_programmer(IO, channel, queue, bitrate_khz)
+    print('Page program time %.0f us' % programmer.timing.typical(
+        DEV_NAME, 'page', DEFAULT_PAGE_US))
+    stats = programmer.program(pages())
+    source.close()
 
-        while True:
-            collect, _ = ps_queue_submit(queue_busy, channel, 0)
-            data_in = dev_collect(collect)
-            if not data_in:
-                print(ps_channel_submitted_count(channel))
-                continue
-            if data_in[-1] & 0x80:
-                break
+    print(stats.report())
+    for addr, status in stats.failed:
+        print('Programming failed at 0x%08x, flag status 0x%02x' %
+              (addr, status))
+    return len(stats.failed) + len(stats.errors)
 
-        addr += WRITE_PAGE_SIZE
 
-    ps_queue_destroy(queue_busy)
-    return 0
+def flash_n25q_diff (IO, channel, queue, bitrate_khz, image,
+                     readback = False):
+    DEV_SIZE  = DEV_SIZES[DEV_NAME]
+
+    source = ImageSource(image, DEV_SIZE)
+    cache  = HashCache()
+
+    # The cache is keyed on the flash's own unique ID; a part without
+    # one cannot be told apart from another, so it is always read back
+    uid = flash_n25q_uid(channel, queue)
+    key = uid and '%s@%s' % (DEV_NAME, uid)
+    if key is None:
+        print('No flash unique ID, the hash cache is not used')
+        readback = True
+
+    # What the device holds: the last image written to this flash, or
+    # read it back.  The cache assumes nothing else wrote the flash
+    # since, so a sample of it is checked against the device.
+    old = None if readback else cache.get(key, DIFF_SECTOR_SIZE, DEV_SIZE)
+    if old and not flash_n25q_matches(IO, channel, queue, old,
+                                      DIFF_SECTOR_SIZE):
+        print('Cached hashes do not match the device')
+        old = None
+    if old is None:
+        size = source.size or DEV_SIZE
+        print('Reading back %d KB' % (size // KB))
+        old = flash_n25q_hashes(IO, channel, queue, size, DIFF_SECTOR_SIZE)
+
+    # Forget the hashes until the new image is completely written
+    if key is not None:
+        cache.set(key, DIFF_SECTOR_SIZE, None)
+        cache.save()
+
+    programmer = flash_programmer(IO, channel, queue, bitrate_khz)
+    stats, hashes = programmer.program_diff(source.pages(WRITE_PAGE_SIZE),
+                                            old, DIFF_SECTOR_SIZE)
+    source.close()
+
+    print(stats.report())
+    for addr, status in stats.failed:
+        print('Failed at 0x%08x, flag status 0x%02x' % (addr, status))
+    if key is not None and not stats.failed and not stats.errors:
+        cache.set(key, DIFF_SECTOR_SIZE, hashes, DEV_SIZE)
+        cache.save()
+    return len(stats.failed) + len(stats.errors)
 
 
 #==========================================================================
@@ -393,8 +530,10 @@ def flash_n25q_write (IO, channel, queue):
 #==========================================================================
 if (len(sys.argv) < 4):
     print("usage: spi_n25q IP read IO")
-    print("usage: spi_n25q IP write IO")
-    print("usage: spi_n25q IP erase IO")
+    print("usage: spi_n25q IP write IO [FILE]")
+    print("usage: spi_n25q IP erase IO [START:END | START+LENGTH ...]")
+    print("usage: spi_n25q IP dump IO FILE")
+    print("usage: spi_n25q IP diff IO FILE [readback]")
     print("  IO : 0 - standard, 2 - dual, 4 - quad")
     sys.exit()
 
@@ -436,13 +575,23 @@ if DEV_NAME == None:
 flash_n25q_prepare(channel, queue)
 
 if "write".startswith(command):
-    flash_n25q_write(IO, channel, queue)
+    flash_n25q_write(IO, channel, queue, bitrate,
+                     sys.argv[4] if len(sys.argv) > 4 else None)
 
 elif "read".startswith(command):
     flash_n25q_read(IO, channel, queue)
 
 elif "erase".startswith(command):
-    flash_n25q_erase(IO, channel, queue)
+    flash_n25q_erase(IO, channel, queue, bitrate,
+                     [ parse_range(r) for r in sys.argv[4:] ])
+
+# diff and dump need two letters: a lone "d" must not program the flash
+elif len(command) > 1 and "diff".startswith(command) and len(sys.argv) > 4:
+    flash_n25q_diff(IO, channel, queue, bitrate, sys.argv[4],
+                    len(sys.argv) > 5 and sys.argv[5] == "readback")
+
+elif len(command) > 1 and "dump".startswith(command) and len(sys.argv) > 4:
+    flash_n25q_dump(IO, channel, queue, sys.argv[4], bitrate)
 
 else:
     print("unknown command: %s" % command)
@@ -33,6 +33,7 @@ import time
 
 from promira_py import *
 from promact_is_py import *
+from ps_hexdump import *
 
 
 #==========================================================================
@@ -44,6 +45,10 @@ INTERVAL_TIMEOUT =   500
 
 SS_MASK          = 0x1
 
+# DUMP_FULL, DUMP_SUMMARY or DUMP_QUIET, and bytes shown per transaction
+DUMP_MODE        = DUMP_FULL
+DUMP_LIMIT       = None
+
 
 #==========================================================================
 # FUNCTION (APP)
@@ -116,18 +121,11 @@ def dump (channel, timeout_ms):
                 return
 
             # Dump the data to the screen
-            sys.stdout.write("*** Transaction #%02d\n" % trans_num)
-            sys.stdout.write("Data read from device: SS:%d, IsLast:%d" %
-                             (info.ss_mask, info.is_last))
-            for i in range(num_read):
-                if ((i & 0x0f) == 0):
-                    sys.stdout.write("\n%04x:  " % i)
-
-                sys.stdout.write("%02x " % (data_in[i] & 0xff))
-                if (((i + 1) & 0x07) == 0):
-                    sys.stdout.write(" ")
-
-            sys.stdout.write("\n\n")
+            write_dump("*** Transaction #%02d\n"
+                       "Data read from device: SS:%d, IsLast:%d" %
+                       (trans_num, info.ss_mask, info.is_last),
+                       memoryview(data_in)[:num_read],
+                       limit = DUMP_LIMIT, mode = DUMP_MODE)
 
         elif (result == PS_SPI_SLAVE_DATA_LOST):
             # Get number of packets lost since queue in the device is full
@@ -0,0 +1,78 @@
+#==========================================================================
+# Promira SPI Controller
+#--------------------------------------------------------------------------
+# Project : POC- SPI Controller
+# File    : test_promact_is_py.py
+#--------------------------------------------------------------------------
+# Tests of the zero-copy buffer fallback of the u08[] wrappers
+#--------------------------------------------------------------------------
+# Runs without a Promira (see fake_promira); the native write call is
+# patched to accept or reject buffer objects.
+#
+#   python -m unittest test_promact_is_py
+#==========================================================================
+
+
+#==========================================================================
+# IMPORTS
+#==========================================================================
+from __future__ import division, with_statement, print_function
+import unittest
+import warnings
+from array import ArrayType
+from unittest import mock
+
+import fake_promira
+import promact_is_py
+from promact_is_py import *
+
+
+#==========================================================================
+# CLASSES
+#==========================================================================
+class BufferFallbackTest (unittest.TestCase):
+    def setUp (self):
+        patcher = mock.patch.object(promact_is_py, '_api_buffer_protocol',
+                                    True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.calls = [ ]
+
+    def native (self, accepts_buffers):
+        def write (queue, io, word_size, num_words, data):
+            if not isinstance(word_size, int):
+                raise TypeError("an integer is required")
+            if not accepts_buffers and not isinstance(data, ArrayType):
+                raise TypeError("array('B') required")
+            self.calls.append(type(data))
+            return num_words
+        return mock.patch.object(promact_is_py.api, 'py_ps_queue_spi_write',
+                                 write, create = True)
+
+    def test_buffers_passed_through (self):
+        with self.native(True):
+            ps_queue_spi_write(1, 0, 8, 3, b'abc')
+        self.assertEqual(self.calls, [ memoryview ])
+        self.assertTrue(api_buffer_protocol())
+
+    def test_other_type_error_keeps_zero_copy (self):
+        with self.native(True):
+            with self.assertRaises(TypeError):
+                ps_queue_spi_write(1, 0, 8.0, 3, b'abc')
+            ps_queue_spi_write(1, 0, 8, 3, b'abc')
+        self.assertEqual(self.calls, [ memoryview ])
+        self.assertTrue(api_buffer_protocol())
+
+    def test_rejected_buffer_falls_back_with_warning (self):
+        with self.native(False):
+            with warnings.catch_warnings(record = True) as caught:
+                warnings.simplefilter('always')
+                ps_queue_spi_write(1, 0, 8, 3, b'abc')
+                ps_queue_spi_write(1, 0, 8, 3, b'def')
+        self.assertEqual(self.calls, [ ArrayType, ArrayType ])
+        self.assertFalse(api_buffer_protocol())
+        self.assertEqual(len(caught), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
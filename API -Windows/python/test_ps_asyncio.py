@@ -0,0 +1,73 @@
+#==========================================================================
+# Promira SPI Controller
+#--------------------------------------------------------------------------
+# Project : POC- SPI Controller
+# File    : test_ps_asyncio.py
+#--------------------------------------------------------------------------
+# Tests of AsyncChannel call overlap
+#--------------------------------------------------------------------------
+# Runs without a Promira (see fake_promira); the asynchronous submit and
+# collect calls are patched, and the collect blocks until released.
+#
+#   python -m unittest test_ps_asyncio
+#==========================================================================
+
+
+#==========================================================================
+# IMPORTS
+#==========================================================================
+from __future__ import division, with_statement, print_function
+import asyncio
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import fake_promira
+import ps_asyncio
+from ps_asyncio import AsyncChannel
+
+
+#==========================================================================
+# CLASSES
+#==========================================================================
+class OverlapTest (unittest.TestCase):
+    def setUp (self):
+        self.release   = threading.Event()
+        self.submitted = [ ]
+
+        def async_collect (channel):
+            self.release.wait(2)
+            return (1, 0)
+
+        def async_submit (queue, channel, ctrl_id):
+            self.submitted.append(queue)
+            return 0
+
+        patcher = mock.patch.multiple(
+            ps_asyncio,
+            ps_queue_async_collect = async_collect,
+            ps_queue_async_submit  = async_submit,
+            collect_all            = lambda collect, out, skip: (b'', [ ]))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        executor = ThreadPoolExecutor(2)
+        self.addCleanup(executor.shutdown)
+        self.channel = AsyncChannel(1, executor)
+
+    def test_submit_not_blocked_by_collect (self):
+        async def run ():
+            collect = asyncio.ensure_future(self.channel.async_collect())
+            await asyncio.sleep(0)
+            await asyncio.wait_for(self.channel.async_submit(7), 1)
+            self.assertFalse(collect.done())
+            self.release.set()
+            return await collect
+
+        self.assertEqual(asyncio.run(run()), (b'', [ ]))
+        self.assertEqual(self.submitted, [ 7 ])
+
+
+if __name__ == '__main__':
+    unittest.main()
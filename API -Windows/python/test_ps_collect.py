@@ -0,0 +1,120 @@
+#==========================================================================
+# Promira SPI Controller
+#--------------------------------------------------------------------------
+# Project : POC- SPI Controller
+# File    : test_ps_collect.py
+#--------------------------------------------------------------------------
+# Tests of collect_all
+#--------------------------------------------------------------------------
+# Runs without a Promira (see fake_promira); ps_collect_resp and
+# ps_collect_spi_read_into are patched to play back a list of
+# responses.
+#
+#   python -m unittest test_ps_collect
+#==========================================================================
+
+
+#==========================================================================
+# IMPORTS
+#==========================================================================
+from __future__ import division, with_statement, print_function
+import unittest
+from unittest import mock
+
+import fake_promira
+import ps_collect
+from ps_collect import *
+from promact_is_py import *
+
+
+#==========================================================================
+# CLASSES
+#==========================================================================
+class FakeCollect:
+    """
+    Responses of one collect handle: (type, payload, word_size) for
+    each command.  Reads report their length in words, as the device
+    does.
+    """
+    def __init__ (self, responses):
+        self.responses = list(responses)
+        self.current   = None
+
+    def resp (self, collect, timeout):
+        if not self.responses:
+            return (PS_APP_NO_MORE_CMDS_TO_COLLECT, 0, 0)
+        self.current = self.responses.pop(0)
+        t, payload, word_size = self.current
+        words = len(payload) // ((word_size + 7) // 8)
+        return (t, words, words)
+
+    def read_into (self, collect, buf, offset = 0, length = None):
+        t, payload, word_size = self.current
+        size = len(payload)
+        if length is not None:
+            size = min(size, length)
+        memoryview(buf)[offset:offset + size] = payload[:size]
+        return (size // ((word_size + 7) // 8), word_size)
+
+class CollectAllTest (unittest.TestCase):
+    def collect (self, responses, *args):
+        fake = FakeCollect(responses)
+        with mock.patch.multiple(ps_collect,
+                                 ps_collect_resp = fake.resp,
+                                 ps_collect_spi_read_into = fake.read_into):
+            return collect_all(1, *args)
+
+    def test_8bit_reads (self):
+        data, table = self.collect([
+            (PS_SPI_CMD_SS, b'', 8),
+            (PS_SPI_CMD_READ, b'\x01\x02\x03', 8),
+            (PS_SPI_CMD_READ, b'\x04\x05', 8),
+            (PS_SPI_CMD_SS, b'', 8) ])
+        self.assertEqual(bytes(data), b'\x01\x02\x03\x04\x05')
+        self.assertEqual([ row[COLLECT_OFFSET] for row in table ],
+                         [ -1, 0, 3, -1 ])
+        self.assertEqual(table[2][COLLECT_LENGTH], 2)
+
+    def test_16bit_reads (self):
+        first  = b'\x11\x12\x21\x22\x31\x32'
+        second = b'\x41\x42\x51\x52'
+        data, table = self.collect([
+            (PS_SPI_CMD_READ, first, 16),
+            (PS_SPI_CMD_READ, second, 16) ])
+        self.assertEqual(bytes(data), first + second)
+        self.assertEqual(table[0][COLLECT_LENGTH], 6)
+        self.assertEqual(table[1][COLLECT_OFFSET], 6)
+        self.assertEqual(table[1][COLLECT_LENGTH], 4)
+
+    def test_16bit_reads_into_buffer (self):
+        out = bytearray(16)
+        data, table = self.collect([
+            (PS_SPI_CMD_READ, b'\xaa\xbb\xcc\xdd', 16),
+            (PS_SPI_CMD_READ, b'\xee\xff', 16) ], out, (), -1, 2)
+        self.assertEqual(bytes(data), b'\xaa\xbb\xcc\xdd\xee\xff')
+        self.assertEqual(bytes(out[2:8]), b'\xaa\xbb\xcc\xdd\xee\xff')
+        self.assertEqual(table[1][COLLECT_OFFSET], 6)
+
+    def test_skip (self):
+        data, table = self.collect([
+            (PS_SPI_CMD_SS, b'', 8),
+            (PS_SPI_CMD_READ, b'\x0b\x00\x00\x00', 8),
+            (PS_SPI_CMD_READ, b'\xff', 8),
+            (PS_SPI_CMD_READ, b'\x10\x20', 8),
+            (PS_SPI_CMD_SS, b'', 8) ], None, (1, 2))
+        self.assertEqual(bytes(data), b'\x10\x20')
+        self.assertEqual([ row[COLLECT_OFFSET] for row in table ],
+                         [ -1, -1, -1, 0, -1 ])
+
+    def test_fatal_error_stops (self):
+        data, table = self.collect([
+            (PS_SPI_CMD_READ, b'\x01', 8),
+            (PS_APP_CONNECTION_LOST, b'', 8),
+            (PS_SPI_CMD_READ, b'\x02', 8) ])
+        self.assertEqual(bytes(data), b'\x01')
+        self.assertEqual(len(table), 2)
+        self.assertEqual(table[-1][COLLECT_TYPE], PS_APP_CONNECTION_LOST)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+#==========================================================================
+# Promira SPI Controller
+#--------------------------------------------------------------------------
+# Project : POC- SPI Controller
+# File    : test_ps_flash.py
+#--------------------------------------------------------------------------
+# Tests of PageProgrammer busy handling and plan_erase
+#--------------------------------------------------------------------------
+# Runs without a Promira (see fake_promira); the queue and collect
+# functions used by ps_flash are patched to a device that reports
+# chosen pages busy at every queued status read.
+#
+#   python -m unittest test_ps_flash
+#==========================================================================
+
+
+#==========================================================================
+# IMPORTS
+#==========================================================================
+from __future__ import division, with_statement, print_function
+import os
+import shutil
+import tempfile
+import unittest
+from array import array
+from unittest import mock
+
+import fake_promira
+import ps_flash
+from ps_flash import *
+from promact_is_py import *
+
+
+#==========================================================================
+# CLASSES
+#==========================================================================
+class FakeFlash:
+    """
+    Replays a queue: page programs are logged, and the flag status
+    reads after a page in busy read 0 until the host polls on its own.
+    """
+    def __init__ (self, busy):
+        self.busy       = set(busy)
+        self.pending    = [ ]
+        self.submitted  = None
+        self.programmed = [ ]
+
+    def functions (self):
+        def ss (queue, mask):
+            self.pending.append(('ss', ))
+
+        def write (queue, io, word_size, num_words, data):
+            self.pending.append(('write', bytes(data)))
+
+        def delay (queue, value):
+            self.pending.append(('delay', ))
+
+        def submit (queue, channel, ctrl_id):
+            self.submitted = list(self.pending)
+            return (1, 0)
+
+        return dict(ps_queue_clear        = lambda q: self.pending.clear(),
+                    ps_queue_spi_ss       = ss,
+                    ps_queue_spi_write    = write,
+                    ps_queue_spi_delay_ns = delay,
+                    ps_queue_delay_ms     = delay,
+                    ps_queue_submit       = submit,
+                    collect_all           = self.collect_all)
+
+    def collect_all (self, collect, out = None, skip = ()):
+        data, table = array('B'), [ ]
+        page = None
+        for index, cmd in enumerate(self.submitted):
+            if cmd[0] != 'write':
+                table.append((PS_SPI_CMD_SS, 0, 0, -1))
+                continue
+            payload = cmd[1]
+            if payload[0] == 0x02:
+                page = int.from_bytes(payload[1:4], 'big')
+                self.programmed.append(page)
+            if index in skip:
+                table.append((PS_SPI_CMD_READ, len(payload), 0, -1))
+                continue
+            status = FLAG_READY
+            if payload[0] == CMD_FLAG_STATUS and page in self.busy:
+                status = 0
+            table.append((PS_SPI_CMD_READ, len(payload), len(payload),
+                          len(data)))
+            data.extend([ 0 ] * (len(payload) - 1) + [ status ])
+        if page is None:
+            self.busy.clear()
+        return (data, table)
+
+class BusyPageTest (unittest.TestCase):
+    def setUp (self):
+        self.flash = FakeFlash(busy = [ 0x100 ])
+        patcher = mock.patch.multiple(ps_flash, **self.flash.functions())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        self.timing = FlashTiming(os.path.join(tmp, 'timing.json'))
+        self.programmer = PageProgrammer(1, 2, 'N25Q', 3, batch = 4,
+                                         timing = self.timing)
+
+    def test_pages_behind_busy_page_resent (self):
+        pages = [ (addr, b'\x00' * PAGE_SIZE)
+                  for addr in range(0, 4 * PAGE_SIZE, PAGE_SIZE) ]
+        delay, interval, polls = self.programmer.schedule()
+        with mock.patch.object(self.timing, 'record',
+                               wraps = self.timing.record) as record:
+            stats = self.programmer.program(pages)
+
+        self.assertEqual(self.flash.programmed,
+                         [ 0x000, 0x100, 0x200, 0x300, 0x200, 0x300 ])
+        self.assertEqual((stats.pages, stats.waits, stats.resent),
+                         (4, 1, 2))
+        self.assertFalse(stats.failed or stats.errors)
+
+        times = [ call[0][2] for call in record.call_args_list ]
+        self.assertEqual(len(times), 4)
+        self.assertGreaterEqual(times[1], delay + (polls - 1) * interval)
+        self.assertEqual(self.timing.typical('N25Q', 'page'),
+                         sorted(times)[len(times) * TIMING_PERCENT // 100])
+
+class PlanEraseTest (unittest.TestCase):
+    MB = 1024 * 1024
+
+    def cost (self, size):
+        # One larger erase is faster than its parts
+        return size ** 0.5
+
+    def test_aligned_64k (self):
+        plan, _ = plan_erase([ (0x10000, 0x20000) ], erase_units(self.MB),
+                             self.cost, self.MB)
+        self.assertEqual(plan, [ (0x10000, 0x10000) ])
+
+    def test_8k_takes_two_4k (self):
+        plan, _ = plan_erase([ (0x1000, 0x3000) ], erase_units(self.MB),
+                             self.cost, self.MB)
+        self.assertEqual(plan, [ (0x1000, 0x1000), (0x2000, 0x1000) ])
+
+    def test_full_device_bulk (self):
+        plan, _ = plan_erase([ (0, self.MB) ], erase_units(self.MB),
+                             self.cost, self.MB)
+        self.assertEqual(plan, [ (0, self.MB) ])
+
+    def test_full_device_dies (self):
+        units = erase_units(2 * self.MB, die_size = self.MB)
+        plan, _ = plan_erase([ (0, 2 * self.MB) ], units, self.cost,
+                             2 * self.MB)
+        self.assertEqual(plan, [ (0, self.MB), (self.MB, self.MB) ])
+
+    def test_sizes_must_divide (self):
+        with self.assertRaises(ValueError):
+            plan_erase([ (0, 0x1000) ], [ 0x1000, 0x1800 ], self.cost,
+                       self.MB)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+#==========================================================================
+# Promira SPI Controller
+#--------------------------------------------------------------------------
+# Project : POC- SPI Controller
+# File    : test_ps_session.py
+#--------------------------------------------------------------------------
+# Tests of PromiraSession reconnect handling
+#--------------------------------------------------------------------------
+# Runs without a Promira (see fake_promira); the queue functions used
+# by ps_session are patched to record what is queued.
+#
+#   python -m unittest test_ps_session
+#==========================================================================
+
+
+#==========================================================================
+# IMPORTS
+#==========================================================================
+from __future__ import division, with_statement, print_function
+import threading
+import unittest
+from unittest import mock
+
+import fake_promira
+import ps_session
+from ps_session import PromiraSession, SessionManager
+from promact_is_py import PS_APP_CONNECTION_LOST
+
+
+#==========================================================================
+# CLASSES
+#==========================================================================
+class FakeDevice:
+    """Records queued commands; the first submit reports a lost link."""
+    def __init__ (self):
+        self.log     = [ ]
+        self.pending = [ ]
+        self.lost    = 1
+
+    def functions (self):
+        def queue (name):
+            return lambda q, *args: self.pending.append((name, ) + args)
+
+        def submit (queue, channel, timeout):
+            self.log.extend(self.pending)
+            self.log.append(('submit', ))
+            return (len(self.log), 0)
+
+        def collect_all (collect, out = None, skip = ()):
+            if self.lost:
+                self.lost -= 1
+                return (b'', [ (PS_APP_CONNECTION_LOST, 0, 0, -1) ])
+            return (b'', [ (0, 0, 0, -1) ])
+
+        none = lambda *args: 0
+        return dict(ps_queue_clear     = lambda q: self.pending.clear(),
+                    ps_queue_spi_oe    = queue('oe'),
+                    ps_queue_spi_ss    = queue('ss'),
+                    ps_queue_spi_write = queue('write'),
+                    ps_queue_submit    = submit,
+                    collect_all        = collect_all,
+                    ps_queue_destroy   = none,
+                    ps_channel_close   = none,
+                    ps_app_disconnect  = none,
+                    pm_close           = none)
+
+class ReconnectTest (unittest.TestCase):
+    def setUp (self):
+        self.device  = FakeDevice()
+        patcher = mock.patch.multiple(ps_session, **self.device.functions())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.session = PromiraSession('10.0.0.1', delay = 0)
+        self.session.open = self._open
+        self._open()
+
+    def _open (self):
+        self.device.log.append(('open', ))
+        s = self.session
+        s.pm, s.conn, s.channel, s.queue = 1, 2, 3, 4
+
+    def test_output_enabled_after_reconnect (self):
+        self.session.oe = True
+        self.device.log[:] = [ ]
+
+        self.session.transfer(b'\x9f\x00\x00')
+
+        log = self.device.log
+        reopened = log.index(('open', ))
+        self.assertIn(('oe', 1), log[reopened:])
+        self.assertLess(log.index(('oe', 1), reopened),
+                        max(i for i, cmd in enumerate(log)
+                            if cmd[0] == 'write'))
+        self.assertTrue(self.session.oe)
+        self.assertEqual(self.session.reconnects, 1)
+
+    def test_output_left_off_after_reconnect (self):
+        self.session.oe = False
+        self.device.log[:] = [ ]
+        self.session.transact(lambda queue: None)
+        self.assertEqual(self.session.reconnects, 1)
+        self.assertNotIn(('oe', 1), self.device.log)
+
+class SessionManagerTest (unittest.TestCase):
+    def test_unique_ids_resolve_in_parallel (self):
+        # Each resolve waits for the other: run one after the other,
+        # the barrier times out
+        barrier = threading.Barrier(2, timeout = 2)
+        def resolve (unique_id):
+            barrier.wait()
+            return '10.0.0.%d' % unique_id
+
+        manager = SessionManager(resolve)
+        sessions = { }
+        def get (unique_id):
+            sessions[unique_id] = manager.get(unique_id)
+
+        with mock.patch.object(PromiraSession, 'open', lambda self: None):
+            threads = [ threading.Thread(target = get, args = (n, ))
+                        for n in (1, 2) ]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            self.assertIs(manager.get(1), sessions[1])
+
+        self.assertFalse(barrier.broken)
+        self.assertEqual(sorted(s.ip for s in sessions.values()),
+                         [ '10.0.0.1', '10.0.0.2' ])
+
+
+if __name__ == '__main__':
+    unittest.main()
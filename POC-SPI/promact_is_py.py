@@ -107,7 +107,7 @@ PS_APP_LIBRARY_LOADED  = \
 #==========================================================================
 # HELPER FUNCTIONS
 #==========================================================================
-def array_u08 (n):  return array('B', [0]*n)
+def array_u08 (n):  return array('B', bytes(n))
 def array_u16 (n):  return array('H', [0]*n)
 def array_u32 (n):  return array('I', [0]*n)
 def array_u64 (n):  return array('K', [0]*n)
@@ -119,6 +119,106 @@ def array_f32 (n):  return array('f', [0]*n)
 def array_f64 (n):  return array('d', [0]*n)
 
 
+# Resolve a u08[] input argument into (buffer, length) without copying
+# the data.  In addition to array('B') and the (array, length) tuple,
+# any object exporting a contiguous byte buffer is accepted: bytes,
+# bytearray, memoryview (including slices), mmap and NumPy uint8
+# arrays.  Such objects are passed to the API as a flat memoryview,
+# trimmed to the requested length.
+def _buffer_in (data, name):
+    if isinstance(data, ArrayType):
+        if data.typecode != 'B':
+            raise TypeError("type for '%s' must be array('B')" % name)
+        return (data, len(data))
+    if isinstance(data, tuple):
+        (buf, num_bytes) = _buffer_in(data[0], name)
+        num_bytes = min(num_bytes, int(data[1]))
+        if not isinstance(buf, ArrayType):
+            buf = buf[:num_bytes]
+        return (buf, num_bytes)
+    try:
+        view = memoryview(data)
+    except TypeError:
+        raise TypeError("type for '%s' must be array('B') or a byte buffer"
+                        % name)
+    if view.itemsize != 1:
+        raise TypeError("type for '%s' must have 1-byte items" % name)
+    if not view.c_contiguous:
+        raise TypeError("buffer for '%s' must be contiguous" % name)
+    if view.format != 'B' or view.ndim != 1:
+        view = view.cast('B')
+    return (view, view.nbytes)
+
+# Whether the native module accepts buffer objects other than
+# array('B').  Cleared on the first rejection, after which buffers are
+# copied into an array('B') once before every call.
+_api_buffer_protocol = True
+
+# Call an API function whose last argument is a u08[] input buffer.
+def _api_call_buffer_in (func, *args):
+    global _api_buffer_protocol
+    data = args[-1]
+    if isinstance(data, ArrayType):
+        return func(*args)
+    if _api_buffer_protocol:
+        try:
+            return func(*args)
+        except TypeError:
+            _api_buffer_protocol = False
+    copy = array('B')
+    copy.frombytes(data)
+    return func(*(args[:-1] + (copy,)))
+
+# Resolve a u08[] output argument into (buffer, length).  Any writable
+# object exporting a contiguous byte buffer is accepted besides
+# array('B') and the (array, length) tuple.  When an offset or length
+# is given, the API writes straight into that window of the buffer.
+def _buffer_out (data, name, offset=0, length=None):
+    if isinstance(data, tuple):
+        (data, length) = (data[0], min(len(data[0]) - offset, int(data[1])))
+    if isinstance(data, ArrayType):
+        if data.typecode != 'B':
+            raise TypeError("type for '%s' must be array('B')" % name)
+        if offset == 0:
+            if length is None or length >= len(data):
+                return (data, len(data))
+            return (data, max(0, length))
+    try:
+        view = memoryview(data)
+    except TypeError:
+        raise TypeError("type for '%s' must be array('B') or a writable "
+                        "byte buffer" % name)
+    if view.readonly:
+        raise TypeError("buffer for '%s' must be writable" % name)
+    if view.itemsize != 1:
+        raise TypeError("type for '%s' must have 1-byte items" % name)
+    if not view.c_contiguous:
+        raise TypeError("buffer for '%s' must be contiguous" % name)
+    if view.format != 'B' or view.ndim != 1:
+        view = view.cast('B')
+    if offset < 0 or offset > len(view):
+        raise ValueError("offset for '%s' is outside the buffer" % name)
+    end = len(view) if length is None else min(len(view), offset + length)
+    view = view[offset:end]
+    return (view, len(view))
+
+# Call an API function whose last argument is a u08[] output buffer.
+def _api_call_buffer_out (func, *args):
+    global _api_buffer_protocol
+    data = args[-1]
+    if isinstance(data, ArrayType):
+        return func(*args)
+    if _api_buffer_protocol:
+        try:
+            return func(*args)
+        except TypeError:
+            _api_buffer_protocol = False
+    copy = array_u08(len(data))
+    ret = func(*(args[:-1] + (copy,)))
+    data[:] = copy
+    return ret
+
+
 #==========================================================================
 # STATUS CODES
 #==========================================================================
@@ -535,7 +635,8 @@ def ps_i2c_read (channel, slave_addr, flags, data_in):
     integer can be passed in place of the array argument and the API
     will automatically create an array of that length.  All output
     arrays, whether passed in or generated, are passed back in the
-    returned tuple."""
+    returned tuple.  Output arrays may also be any writable object
+    exporting a contiguous byte buffer, which is filled in place."""
 
     if not PS_APP_LIBRARY_LOADED: return PS_APP_INCOMPATIBLE_LIBRARY
     # data_in pre-processing
@@ -543,16 +644,27 @@ def ps_i2c_read (channel, slave_addr, flags, data_in):
     if __data_in:
         (data_in, num_bytes) = (array_u08(data_in), data_in)
     else:
-        (data_in, num_bytes) = isinstance(data_in, ArrayType) and (data_in, len(data_in)) or (data_in[0], min(len(data_in[0]), int(data_in[1])))
-        if data_in.typecode != 'B':
-            raise TypeError("type for 'data_in' must be array('B')")
+        (data_in, num_bytes) = _buffer_out(data_in, 'data_in')
     # Call API function
-    (_ret_, num_read) = api.py_ps_i2c_read(channel, slave_addr, flags, num_bytes, data_in)
+    (_ret_, num_read) = _api_call_buffer_out(api.py_ps_i2c_read, channel, slave_addr, flags, num_bytes, data_in)
     # data_in post-processing
     if __data_in: del data_in[max(0, min(num_read, len(data_in))):]
     return (_ret_, data_in, num_read)
 
 
+# Read a stream of bytes from the I2C slave device directly into buf,
+# starting at byte offset.  At most length bytes are read, or the rest
+# of buf if length is None.  No array is allocated or returned.
+def ps_i2c_read_into (channel, slave_addr, flags, buf, offset=0, length=None):
+    """usage: (int return, u16 num_read) = ps_i2c_read_into(PromiraChannelHandle channel, u16 slave_addr, PromiraI2cFlags flags, u08[] buf, int offset, int length)"""
+
+    if not PS_APP_LIBRARY_LOADED: return PS_APP_INCOMPATIBLE_LIBRARY
+    # buf pre-processing
+    (data_in, num_bytes) = _buffer_out(buf, 'buf', offset, length)
+    # Call API function
+    return _api_call_buffer_out(api.py_ps_i2c_read, channel, slave_addr, flags, num_bytes, data_in)
+
+
 # Queue I2C read.
 def ps_queue_i2c_read (queue, slave_addr, flags, num_bytes):
     """usage: int return = ps_queue_i2c_read(PromiraQueueHandle queue, u16 slave_addr, PromiraI2cFlags flags, u16 num_bytes)"""
@@ -578,7 +690,8 @@ def ps_collect_i2c_read (collect, data_in):
     integer can be passed in place of the array argument and the API
     will automatically create an array of that length.  All output
     arrays, whether passed in or generated, are passed back in the
-    returned tuple."""
+    returned tuple.  Output arrays may also be any writable object
+    exporting a contiguous byte buffer, which is filled in place."""
 
     if not PS_APP_LIBRARY_LOADED: return PS_APP_INCOMPATIBLE_LIBRARY
     # data_in pre-processing
@@ -586,11 +699,9 @@ def ps_collect_i2c_read (collect, data_in):
     if __data_in:
         (data_in, num_bytes) = (array_u08(data_in), data_in)
     else:
-        (data_in, num_bytes) = isinstance(data_in, ArrayType) and (data_in, len(data_in)) or (data_in[0], min(len(data_in[0]), int(data_in[1])))
-        if data_in.typecode != 'B':
-            raise TypeError("type for 'data_in' must be array('B')")
+        (data_in, num_bytes) = _buffer_out(data_in, 'data_in')
     # Call API function
-    (_ret_, num_read) = api.py_ps_collect_i2c_read(collect, num_bytes, data_in)
+    (_ret_, num_read) = _api_call_buffer_out(api.py_ps_collect_i2c_read, collect, num_bytes, data_in)
     # data_in post-processing
     if __data_in: del data_in[max(0, min(num_read, len(data_in))):]
     return (_ret_, data_in, num_read)
@@ -608,15 +719,18 @@ def ps_i2c_write (channel, slave_addr, flags, data_out):
     as the length argument to the API funtion (please refer to the
     product datasheet).  If only the array is provided, the array's
     intrinsic length is used as the argument to the underlying API
-    function."""
+    function.
+
+    Input arrays may also be given as any object exporting a
+    contiguous byte buffer (bytes, bytearray, memoryview, mmap, NumPy
+    uint8 array), alone or in a (buffer, length) tuple.  The data is
+    handed to the API without an intermediate copy."""
 
     if not PS_APP_LIBRARY_LOADED: return PS_APP_INCOMPATIBLE_LIBRARY
     # data_out pre-processing
-    (data_out, num_bytes) = isinstance(data_out, ArrayType) and (data_out, len(data_out)) or (data_out[0], min(len(data_out[0]), int(data_out[1])))
-    if data_out.typecode != 'B':
-        raise TypeError("type for 'data_out' must be array('B')")
+    (data_out, num_bytes) = _buffer_in(data_out, 'data_out')
     # Call API function
-    return api.py_ps_i2c_write(channel, slave_addr, flags, num_bytes, data_out)
+    return _api_call_buffer_in(api.py_ps_i2c_write, channel, slave_addr, flags, num_bytes, data_out)
 
 
 # Queue I2C write.
@@ -629,15 +743,18 @@ def ps_queue_i2c_write (queue, slave_addr, flags, data_out):
     as the length argument to the API funtion (please refer to the
     product datasheet).  If only the array is provided, the array's
     intrinsic length is used as the argument to the underlying API
-    function."""
+    function.
+
+    Input arrays may also be given as any object exporting a
+    contiguous byte buffer (bytes, bytearray, memoryview, mmap, NumPy
+    uint8 array), alone or in a (buffer, length) tuple.  The data is
+    handed to the API without an intermediate copy."""
 
     if not PS_APP_LIBRARY_LOADED: return PS_APP_INCOMPATIBLE_LIBRARY
     # data_out pre-processing
-    (data_out, num_bytes) = isinstance(data_out, ArrayType) and (data_out, len(data_out)) or (data_out[0], min(len(data_out[0]), int(data_out[1])))
-    if data_out.typecode != 'B':
-        raise TypeError("type for 'data_out' must be array('B')")
+    (data_out, num_bytes) = _buffer_in(data_out, 'data_out')
     # Call API function
-    return api.py_ps_queue_i2c_write(queue, slave_addr, flags, num_bytes, data_out)
+    return _api_call_buffer_in(api.py_ps_queue_i2c_write, queue, slave_addr, flags, num_bytes, data_out)
 
 
 # Collect I2C write.
@@ -677,15 +794,18 @@ def ps_i2c_slave_set_resp (channel, data_out):
     as the length argument to the API funtion (please refer to the
     product datasheet).  If only the array is provided, the array's
     intrinsic length is used as the argument to the underlying API
-    function."""
+    function.
+
+    Input arrays may also be given as any object exporting a
+    contiguous byte buffer (bytes, bytearray, memoryview, mmap, NumPy
+    uint8 array), alone or in a (buffer, length) tuple.  The data is
+    handed to the API without an intermediate copy."""
 
     if not PS_APP_LIBRARY_LOADED: return PS_APP_INCOMPATIBLE_LIBRARY
     # data_out pre-processing
-    (data_out, num_bytes) = isinstance(data_out, ArrayType) and (data_out, len(data_out)) or (data_out[0], min(len(data_out[0]), int(data_out[1])))
-    if data_out.typecode != 'B':
-        raise TypeError("type for 'data_out' must be array('B')")
+    (data_out, num_bytes) = _buffer_in(data_out, 'data_out')
     # Call API function
-    return api.py_ps_i2c_slave_set_resp(channel, num_bytes, data_out)
+    return _api_call_buffer_in(api.py_ps_i2c_slave_set_resp, channel, num_bytes, data_out)
 
 
 # Polling function to check if there are any asynchronous
@@ -735,7 +855,8 @@ def ps_i2c_slave_read (channel, data_in):
     integer can be passed in place of the array argument and the API
     will automatically create an array of that length.  All output
     arrays, whether passed in or generated, are passed back in the
-    returned tuple."""
+    returned tuple.  Output arrays may also be any writable object
+    exporting a contiguous byte buffer, which is filled in place."""
 
     if not PS_APP_LIBRARY_LOADED: return PS_APP_INCOMPATIBLE_LIBRARY
     # data_in pre-processing
@@ -743,11 +864,9 @@ def ps_i2c_slave_read (channel, data_in):
     if __data_in:
         (data_in, num_bytes) = (array_u08(data_in), data_in)
     else:
-        (data_in, num_bytes) = isinstance(data_in, ArrayType) and (data_in, len(data_in)) or (data_in[0], min(len(data_in[0]), int(data_in[1])))
-        if data_in.typecode != 'B':
-            raise TypeError("type for 'data_in' must be array('B')")
+        (data_in, num_bytes) = _buffer_out(data_in, 'data_in')
     # Call API function
-    (_ret_, addr, num_read) = api.py_ps_i2c_slave_read(channel, num_bytes, data_in)
+    (_ret_, addr, num_read) = _api_call_buffer_out(api.py_ps_i2c_slave_read, channel, num_bytes, data_in)
     # data_in post-processing
     if __data_in: del data_in[max(0, min(num_read, len(data_in))):]
     return (_ret_, addr, data_in, num_read)
@@ -886,15 +1005,18 @@ def ps_queue_spi_write (queue, io, word_size, out_num_words, data_out):
     as the length argument to the API funtion (please refer to the
     product datasheet).  If only the array is provided, the array's
     intrinsic length is used as the argument to the underlying API
-    function."""
+    function.
+
+    Input arrays may also be given as any object exporting a
+    contiguous byte buffer (bytes, bytearray, memoryview, mmap, NumPy
+    uint8 array), alone or in a (buffer, length) tuple.  The data is
+    handed to the API without an intermediate copy."""
 
     if not PS_APP_LIBRARY_LOADED: return PS_APP_INCOMPATIBLE_LIBRARY
     # data_out pre-processing
-    (data_out, _) = isinstance(data_out, ArrayType) and (data_out, len(data_out)) or (data_out[0], min(len(data_out[0]), int(data_out[1])))
-    if data_out.typecode != 'B':
-        raise TypeError("type for 'data_out' must be array('B')")
+    (data_out, _) = _buffer_in(data_out, 'data_out')
     # Call API function
-    return api.py_ps_queue_spi_write(queue, io, word_size, out_num_words, data_out)
+    return _api_call_buffer_in(api.py_ps_queue_spi_write, queue, io, word_size, out_num_words, data_out)
 
 
 # Queue a single word out_num_word times.  word_size is the number of
@@ -937,7 +1059,8 @@ def ps_collect_spi_read (collect, data_in):
     integer can be passed in place of the array argument and the API
     will automatically create an array of that length.  All output
     arrays, whether passed in or generated, are passed back in the
-    returned tuple."""
+    returned tuple.  Output arrays may also be any writable object
+    exporting a contiguous byte buffer, which is filled in place."""
 
     if not PS_APP_LIBRARY_LOADED: return PS_APP_INCOMPATIBLE_LIBRARY
     # data_in pre-processing
@@ -945,16 +1068,28 @@ def ps_collect_spi_read (collect, data_in):
     if __data_in:
         (data_in, in_num_bytes) = (array_u08(data_in), data_in)
     else:
-        (data_in, in_num_bytes) = isinstance(data_in, ArrayType) and (data_in, len(data_in)) or (data_in[0], min(len(data_in[0]), int(data_in[1])))
-        if data_in.typecode != 'B':
-            raise TypeError("type for 'data_in' must be array('B')")
+        (data_in, in_num_bytes) = _buffer_out(data_in, 'data_in')
     # Call API function
-    (_ret_, word_size) = api.py_ps_collect_spi_read(collect, in_num_bytes, data_in)
+    (_ret_, word_size) = _api_call_buffer_out(api.py_ps_collect_spi_read, collect, in_num_bytes, data_in)
     # data_in post-processing
     if __data_in: del data_in[max(0, min(_ret_, len(data_in))):]
     return (_ret_, word_size, data_in)
 
 
+# Collect SPI data directly into buf, starting at byte offset.  At most
+# length bytes are written, or the rest of buf if length is None.  This
+# lets a whole block be assembled in one preallocated buffer without
+# any per-command allocation.
+def ps_collect_spi_read_into (collect, buf, offset=0, length=None):
+    """usage: (int return, u08 word_size) = ps_collect_spi_read_into(PromiraCollectHandle collect, u08[] buf, int offset, int length)"""
+
+    if not PS_APP_LIBRARY_LOADED: return PS_APP_INCOMPATIBLE_LIBRARY
+    # buf pre-processing
+    (data_in, in_num_bytes) = _buffer_out(buf, 'buf', offset, length)
+    # Call API function
+    return _api_call_buffer_out(api.py_ps_collect_spi_read, collect, in_num_bytes, data_in)
+
+
 # enum PromiraSlaveMode
 PS_SPI_SLAVE_MODE_STD = 0
 
@@ -1017,15 +1152,18 @@ def ps_spi_std_slave_set_resp (channel, resp):
     as the length argument to the API funtion (please refer to the
     product datasheet).  If only the array is provided, the array's
     intrinsic length is used as the argument to the underlying API
-    function."""
+    function.
+
+    Input arrays may also be given as any object exporting a
+    contiguous byte buffer (bytes, bytearray, memoryview, mmap, NumPy
+    uint8 array), alone or in a (buffer, length) tuple.  The data is
+    handed to the API without an intermediate copy."""
 
     if not PS_APP_LIBRARY_LOADED: return PS_APP_INCOMPATIBLE_LIBRARY
     # resp pre-processing
-    (resp, num_bytes) = isinstance(resp, ArrayType) and (resp, len(resp)) or (resp[0], min(len(resp[0]), int(resp[1])))
-    if resp.typecode != 'B':
-        raise TypeError("type for 'resp' must be array('B')")
+    (resp, num_bytes) = _buffer_in(resp, 'resp')
     # Call API function
-    return api.py_ps_spi_std_slave_set_resp(channel, num_bytes, resp)
+    return _api_call_buffer_in(api.py_ps_spi_std_slave_set_resp, channel, num_bytes, resp)
 
 
 # Polling function to check if there are any asynchronous messages
@@ -1072,7 +1210,8 @@ def ps_spi_slave_read (channel, data_in):
     integer can be passed in place of the array argument and the API
     will automatically create an array of that length.  All output
     arrays, whether passed in or generated, are passed back in the
-    returned tuple."""
+    returned tuple.  Output arrays may also be any writable object
+    exporting a contiguous byte buffer, which is filled in place."""
 
     if not PS_APP_LIBRARY_LOADED: return PS_APP_INCOMPATIBLE_LIBRARY
     # data_in pre-processing
@@ -1080,11 +1219,9 @@ def ps_spi_slave_read (channel, data_in):
     if __data_in:
         (data_in, in_num_bytes) = (array_u08(data_in), data_in)
     else:
-        (data_in, in_num_bytes) = isinstance(data_in, ArrayType) and (data_in, len(data_in)) or (data_in[0], min(len(data_in[0]), int(data_in[1])))
-        if data_in.typecode != 'B':
-            raise TypeError("type for 'data_in' must be array('B')")
+        (data_in, in_num_bytes) = _buffer_out(data_in, 'data_in')
     # Call API function
-    (_ret_, c_read_info) = api.py_ps_spi_slave_read(channel, in_num_bytes, data_in)
+    (_ret_, c_read_info) = _api_call_buffer_out(api.py_ps_spi_slave_read, channel, in_num_bytes, data_in)
     # read_info post-processing
     read_info = PromiraSpiSlaveReadInfo()
     (read_info.in_data_bits, read_info.out_data_bits, read_info.header_bits, read_info.resp_id, read_info.ss_mask, read_info.is_last) = c_read_info
@@ -1093,6 +1230,22 @@ def ps_spi_slave_read (channel, data_in):
     return (_ret_, read_info, data_in)
 
 
+# Read SPI slave data directly into buf, starting at byte offset.  At
+# most length bytes are written, or the rest of buf if length is None.
+def ps_spi_slave_read_into (channel, buf, offset=0, length=None):
+    """usage: (int return, PromiraSpiSlaveReadInfo read_info) = ps_spi_slave_read_into(PromiraChannelHandle channel, u08[] buf, int offset, int length)"""
+
+    if not PS_APP_LIBRARY_LOADED: return PS_APP_INCOMPATIBLE_LIBRARY
+    # buf pre-processing
+    (data_in, in_num_bytes) = _buffer_out(buf, 'buf', offset, length)
+    # Call API function
+    (_ret_, c_read_info) = _api_call_buffer_out(api.py_ps_spi_slave_read, channel, in_num_bytes, data_in)
+    # read_info post-processing
+    read_info = PromiraSpiSlaveReadInfo()
+    (read_info.in_data_bits, read_info.out_data_bits, read_info.header_bits, read_info.resp_id, read_info.ss_mask, read_info.is_last) = c_read_info
+    return (_ret_, read_info)
+
+
 # Return number of SPI transactions lost due to the overflow of the
 # internal Promira buffer.
 def ps_spi_slave_data_lost_stats (channel):